@@ -3,16 +3,23 @@
 # Author: vvlachoudis@gmail.com
 # Date: 24-Aug-2014
 
+import itertools
 import math
 import os
+import queue
 import re
+import threading
+import traceback
+from array import array
 from tkinter import messagebox
 import types
+import zlib
 
 import numpy as np
-from scipy.spatial import distance_matrix
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
+import lazy
+import planner
+import streamfit
+import tour
 import undo
 import Unicode
 from bmath import (
@@ -30,11 +37,16 @@ from dxf import DXF
 from svgcode import SVGcode
 from Helpers import to_zip
 
+# plotting and spatial helpers are loaded on first use
+plt = lazy.lazyImport("matplotlib.pyplot")
+spatial = lazy.lazyImport("scipy.spatial")
+
 IDPAT = re.compile(r".*\bid:\s*(.*?)\)")
 PARENPAT = re.compile(r"(\(.*?\))")
 SEMIPAT = re.compile(r"(;.*)")
 OPPAT = re.compile(r"(.*)\[(.*)\]")
 CMDPAT = re.compile(r"([A-Za-z]+)")
+WORDPAT = re.compile(r"[A-Za-z]+[^A-Za-z\s]*|[^A-Za-z\s]+")
 BLOCKPAT = re.compile(r"^\(Block-([A-Za-z]+):\s*(.*)\)")
 AUXPAT = re.compile(r"^(%[A-Za-z0-9]+)\b *(.*)$")
 
@@ -105,6 +117,9 @@ MODAL_MODES = {
 ERROR_HANDLING = {}
 TOLERANCE = 1e-7
 MAXINT = 1000000000  # python3 doesn't have maxint
+LEVEL_BATCH = 1000  # moves autoleveled together while compiling
+FIT_BATCH = 500  # maximum moves fitted together while compiling
+LOAD_BATCH = 10000  # lines parsed between progress reports while loading
 
 
 # -----------------------------------------------------------------------------
@@ -502,6 +517,126 @@ class Probe:
         segments.append((x2, y2, z2 + self.interpolate(x2, y2)))
         return segments
 
+    # ----------------------------------------------------------------------
+    # Vectorized interpolate for arrays of x, y
+    # ----------------------------------------------------------------------
+    def interpolateArray(self, x, y):
+        matrix = np.asarray(self.matrix, dtype=float)
+        ix = (x - self.xmin) / self._xstep
+        jy = (y - self.ymin) / self._ystep
+        i = np.clip(np.floor(ix).astype(int), 0, self.xn - 2)
+        j = np.clip(np.floor(jy).astype(int), 0, self.yn - 2)
+
+        a = ix - i
+        b = jy - j
+        a1 = 1.0 - a
+        b1 = 1.0 - b
+
+        return (
+                a1 * b1 * matrix[j, i]
+                + a1 * b * matrix[j + 1, i]
+                + a * b1 * matrix[j, i + 1]
+                + a * b * matrix[j + 1, i + 1]
+        )
+
+    # ----------------------------------------------------------------------
+    # Vectorized splitLine for many segments at once
+    # @param p1, p2 (N,3) arrays with the start and end of every segment
+    # @return (M,3) array of the end points of the split segments
+    #         corrected in Z and the (M,) array of the segment index
+    #         of each point, ordered as splitLine would return them
+    # ----------------------------------------------------------------------
+    def splitSegments(self, p1, p2):
+        pts, seg = self.splitGrid(p1, p2, self._xstep, self._ystep)
+        pts[:, 2] += self.interpolateArray(pts[:, 0], pts[:, 1])
+        return pts, seg
+
+    # ----------------------------------------------------------------------
+    # Split many segments at the crossings of a xstep x ystep grid
+    # starting at xmin, ymin. Points are returned uncorrected in Z
+    # ----------------------------------------------------------------------
+    def splitGrid(self, p1, p2, xstep, ystep):
+        p1 = np.asarray(p1, dtype=float).reshape(-1, 3)
+        p2 = np.asarray(p2, dtype=float).reshape(-1, 3)
+        n = len(p1)
+        d = p2 - p1
+        d[np.abs(d) < 1e-10] = 0.0
+
+        # Length along projection on X-Y plane
+        rxy = np.hypot(d[:, 0], d[:, 1])
+        moving = rxy > 0.0
+        u = d / np.where(moving, rxy, 1.0)[:, None]  # direction cosines
+        limit = rxy * 0.999999999  # avoid precision errors
+
+        # distances along the segments to the crossings of the grid lines
+        def crossings(axis, amin, step):
+            a1 = p1[:, axis]
+            ua = u[:, axis]
+            aend = (a1 + limit * ua - amin) / step
+            k0 = np.floor((a1 - amin) / step)
+            pos = moving & (ua > 1e-10)
+            neg = moving & (ua < -1e-10)
+            k0 = np.where(pos, k0 + 1.0, k0)
+            count = np.zeros(n, dtype=int)
+            count[pos] = np.ceil(aend[pos]) - k0[pos]
+            count[neg] = k0[neg] - np.floor(aend[neg])
+            np.maximum(count, 0, out=count)
+            seg = np.repeat(np.arange(n), count)
+            m = np.arange(len(seg)) - np.repeat(np.cumsum(count) - count, count)
+            k = k0[seg] + np.where(pos[seg], m, -m)
+            return seg, (k * step + amin - a1[seg]) / ua[seg]
+
+        xseg, xt = crossings(0, self.xmin, xstep)
+        yseg, yt = crossings(1, self.ymin, ystep)
+        seg = np.concatenate((xseg, yseg, np.arange(n)))
+        t = np.concatenate((xt, yt, rxy))
+        end = np.zeros(len(t), dtype=bool)
+        end[-n:] = True
+        order = np.lexsort((t, seg))
+        seg = seg[order]
+        t = t[order]
+        end = end[order]
+
+        # crossing a grid node gives the same point twice
+        keep = np.ones(len(t), dtype=bool)
+        keep[1:] = (seg[1:] != seg[:-1]) | (t[1:] - t[:-1] > 1e-10)
+        keep |= end
+        seg = seg[keep]
+        t = t[keep]
+        end = end[keep]
+
+        pts = p1[seg] + t[:, None] * u[seg]
+        pts[end] = p2[seg[end]]
+        return pts, seg
+
+    # ----------------------------------------------------------------------
+    # Evaluate the fitted polynomial surface over arrays of x, y.
+    # Coefficients are ordered as build_vandermonde orders the terms
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def polyArray(x, y, coeffs, degree):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        coeffs = np.asarray(coeffs, dtype=float)
+        xp = [x ** i for i in range(degree + 1)]
+        yp = [y ** j for j in range(degree + 1)]
+        z = np.zeros(np.broadcast(x, y).shape)
+        index = 0
+        for i in range(degree + 1):
+            for j in range(degree + 1 - i):
+                z += coeffs[index] * xp[i] * yp[j]
+                index += 1
+        return z
+
+    # ----------------------------------------------------------------------
+    # Vectorized splitLine_surf_align for many segments at once
+    # @return same as splitSegments
+    # ----------------------------------------------------------------------
+    def splitSegmentsSurfAlign(self, p1, p2, coeffs, degree, step_size):
+        pts, seg = self.splitGrid(p1, p2, step_size, step_size)
+        pts[:, 2] += self.polyArray(pts[:, 0], pts[:, 1], coeffs, degree)
+        return pts, seg
+
     def calculate_z_from_poly(self, X, Y, coeffs, degree):
         Z = 0.0
         index = 0
@@ -963,6 +1098,7 @@ class CNC:
 
     toolWaitAfterProbe = True  # wait at tool change position after probing
     appendFeed = False  # append feed on every G1/G2/G3 commands to be used
+    fitTolerance = 0.0  # merge lines and fit arcs while sending, 0=off
 
     # for feed override testing
     # FIXME will not be needed after Grbl v1.0
@@ -1107,6 +1243,10 @@ class CNC:
             CNC.drozeropad = int(config.get(section, "drozeropad"))
         except Exception:
             pass
+        try:
+            CNC.fitTolerance = float(config.get(section, "fittolerance"))
+        except Exception:
+            pass
 
         try:
             CNC.startup = config.get(section, "startup")
@@ -1131,6 +1271,7 @@ class CNC:
             CNC.travel_x /= 25.4
             CNC.travel_y /= 25.4
             CNC.travel_z /= 25.4
+            CNC.fitTolerance /= 25.4
             # a,b,c are in degrees no conversion required
 
         section = "Error"
@@ -1149,6 +1290,31 @@ class CNC:
     def saveConfig(config):
         pass
 
+    # ----------------------------------------------------------------------
+    # Machine limits for the motion planner: maximum rate [units/min] and
+    # acceleration [units/min^2] of X, Y, Z and the junction deviation
+    # [units]. Taken from the controller $ settings when they were read,
+    # from the configuration otherwise
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def machineLimits():
+        try:
+            rate = [float(CNC.vars[f"grbl_11{i}"]) for i in range(3)]
+            accel = [float(CNC.vars[f"grbl_12{i}"]) for i in range(3)]
+            junction = float(CNC.vars["grbl_11"])
+            if CNC.inch:
+                rate = [x / 25.4 for x in rate]
+                accel = [x / 25.4 for x in accel]
+                junction /= 25.4
+        except (KeyError, ValueError):
+            rate = [CNC.feedmax_x, CNC.feedmax_y, CNC.feedmax_z]
+            accel = [CNC.acceleration_x, CNC.acceleration_y,
+                     CNC.acceleration_z]
+            junction = planner.JUNCTION_DEVIATION
+            if CNC.inch:
+                junction /= 25.4
+        return rate, [x * 3600.0 for x in accel], junction
+
     # ----------------------------------------------------------------------
     def initPath(self, x=None, y=None, z=None, a=None, b=None, c=None):
         if x is None:
@@ -1242,6 +1408,17 @@ class CNC:
         v = round(v, d)
         return (f"{c}{v:>{d}f}").rstrip("0").rstrip(".")
 
+    # ----------------------------------------------------------------------
+    # fmt for a list of values at once
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def fmtList(c, values, d=None):
+        if d is None:
+            d = CNC.digits
+        # "%.df" rounds as round() does, fmt prints at most 6 decimals
+        f = f"%{d}.{min(d, 6)}f"
+        return [c + (f % v).rstrip("0").rstrip(".") for v in values]
+
     # ----------------------------------------------------------------------
     @staticmethod
     def gcode(g, pairs):
@@ -1393,23 +1570,34 @@ class CNC:
         line = CMDPAT.sub(r" \1", line).lstrip()
         return line.split()
 
+    # ----------------------------------------------------------------------
+    # Compile a line, setting CNC.comment to its comment
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def compileLine(line, space=False):
+        cmds, comment = CNC.parseLine(line, space)
+        if comment is not None:
+            CNC.comment = comment
+        return cmds
+
     # ----------------------------------------------------------------------
     # @return line,comment
     #   line broken in a list of commands,
     #       None,"" if empty or comment
     #       else compiled expressions,""
+    #   the comment is None when the line cannot have one
     # ----------------------------------------------------------------------
     @staticmethod
-    def compileLine(line, space=False):
+    def parseLine(line, space=False):
         line = line.strip()
         if not line:
-            return None
+            return None, None
         if line[0] == "$":
-            return line
+            return line, None
 
         # to accept #nnn variables as _nnn internally
         line = line.replace("#", "_")
-        CNC.comment = ""
+        comment = ""
 
         # execute literally the line after the first character
         if line[0] == "%":
@@ -1422,36 +1610,35 @@ class CNC:
                 cmd = None
                 args = None
             if cmd == "%wait":
-                return (WAIT,)
+                return (WAIT,), comment
             elif cmd == "%msg":
                 if not args:
                     args = None
-                return (MSG, args)
+                return (MSG, args), comment
             elif cmd == "%update":
-                return (UPDATE, args)
+                return (UPDATE, args), comment
             elif line.startswith("%if running") and not CNC.vars["running"]:
                 # ignore if running lines when not running
-                return None
+                return None, comment
             else:
                 try:
-                    return compile(line[1:], "", "exec")
+                    return compile(line[1:], "", "exec"), comment
                 except Exception as e:
                     print("Compile line error: \n")
                     print(e)
-                    return None
+                    return None, comment
 
         # most probably an assignment like  #nnn = expr
         if line[0] == "_":
             try:
-                return compile(line, "", "exec")
+                return compile(line, "", "exec"), comment
             except Exception:
                 # FIXME show the error!!!!
-                return None
+                return None, comment
 
         # commented line
         if line[0] == ";":
-            CNC.comment = line[1:].strip()
-            return None
+            return None, line[1:].strip()
 
         out = []  # output list of commands
         bracket = 0  # bracket count []
@@ -1486,7 +1673,7 @@ class CNC:
                     else:
                         expr += ch
                 else:
-                    CNC.comment += ch
+                    comment += ch
             elif ch == "]":
                 # expression end?
                 if not inComment:
@@ -1503,7 +1690,7 @@ class CNC:
                     else:
                         expr += ch
                 else:
-                    CNC.comment += ch
+                    comment += ch
             elif ch == "=":
                 # check for assignments (FIXME very bad)
                 if not out and bracket == 0 and paren == 0:
@@ -1513,14 +1700,14 @@ class CNC:
                             break
                     else:
                         try:
-                            return compile(line, "", "exec")
+                            return compile(line, "", "exec"), comment
                         except Exception:
                             # FIXME show the error!!!!
-                            return None
+                            return None, comment
             elif ch == ";":
                 # Skip everything after the semicolon on normal lines
                 if not inComment and paren == 0 and bracket == 0:
-                    CNC.comment += line[i + 1:]
+                    comment += line[i + 1:]
                     break
                 else:
                     expr += ch
@@ -1536,17 +1723,17 @@ class CNC:
                     cmd += ch
 
             elif inComment:
-                CNC.comment += ch
+                comment += ch
 
         if cmd:
             out.append(cmd)
 
         # return output commands
         if len(out) == 0:
-            return None
+            return None, comment
         if len(out) > 1:
-            return out
-        return out[0]
+            return out, comment
+        return out[0], comment
 
     # ----------------------------------------------------------------------
     # Break line into commands
@@ -1555,9 +1742,8 @@ class CNC:
     def breakLine(line):
         if line is None:
             return None
-        # Insert space before each command
-        line = CMDPAT.sub(r" \1", line).lstrip()
-        return line.split()
+        # Split before each command and on spaces
+        return WORDPAT.findall(line)
 
     # ----------------------------------------------------------------------
     # Create path for one g command
@@ -1642,7 +1828,8 @@ class CNC:
                         self.arcabsolute = False
 
                 elif gcode in (93, 94, 95):
-                    CNC.vars["feedmode"] = gcode
+                    # CNC.vars unless the instance has its own (GCodeLoader)
+                    self.vars["feedmode"] = gcode
 
                 elif gcode == 98:
                     self.retractz = True
@@ -1941,8 +2128,8 @@ class CNC:
             p = i
 
         if self.gcode == 0:
-            # FIXME calculate the correct time with the feed direction
-            # and acceleration
+            # Rough estimate, replaced by the motion planner once the
+            # paths of all blocks are known (CNCCanvas.planTime)
             block.time += length / self.feedmax_x
             self.totalTime += length / self.feedmax_x
             block.rapid += length
@@ -2048,9 +2235,9 @@ class CNC:
         lines.append("g53 g0 x[toolchangex] y[toolchangey]")
         lines.append("%wait")
 
-        if CNC.comment:
+        if self.comment:
             lines.append(
-                f"%msg Tool change T{int(self.tool):02} ({CNC.comment})")
+                f"%msg Tool change T{int(self.tool):02} ({self.comment})")
         else:
             lines.append(f"%msg Tool change T{int(self.tool):02}")
         lines.append("m0")  # feed hold
@@ -2207,6 +2394,7 @@ class CNC:
 # =============================================================================
 class Block(list):
     def __init__(self, name=None):
+        self._version = 0  # modifications of the lines
         # Copy constructor
         if isinstance(name, Block):
             self.copy(name)
@@ -2216,6 +2404,9 @@ class Block(list):
         self.expand = False  # Expand in editor
         self.color = None  # Custom color for path
         self._path = []  # canvas drawing paths
+        self._geometry = None  # cached drawing geometry
+        self._cmds = {}  # compiled lines cache
+        self._words = {}  # broken lines cache
         self.sx = self.sy = self.sz = 0  # start  coordinates
         # (entry point first non rapid motion)
         self.ex = self.ey = self.ez = 0  # ending coordinates
@@ -2229,6 +2420,9 @@ class Block(list):
         self.color = src.color
         self[:] = src[:]
         self._path = []
+        self._geometry = None
+        self._cmds = {}
+        self._words = {}
         self.sx = src.sx
         self.sy = src.sy
         self.sz = src.sz
@@ -2412,6 +2606,7 @@ class Block(list):
 
     # ----------------------------------------------------------------------
     def append(self, line):
+        self._version += 1
         if line.startswith("(Block-"):
             pat = BLOCKPAT.match(line)
             if pat:
@@ -2442,6 +2637,96 @@ class Block(list):
                 self._name = pat.group(1)
         list.append(self, line)
 
+    # ----------------------------------------------------------------------
+    # Cached CNC.compileLine() for the lines of the block. The line text
+    # is the key so an edited line is never served stale commands.
+    # @param cnc receives the comment of the line, CNC if None
+    # ----------------------------------------------------------------------
+    def compileLine(self, line, cnc=None):
+        try:
+            entry = self._cmds[line]
+        except KeyError:
+            cmds, comment = CNC.parseLine(line)
+            # special % commands depend on the running state
+            if not line.lstrip().startswith("%"):
+                # most lines have no comment, keep only their commands
+                if comment == "" and not isinstance(cmds, tuple):
+                    self._cmds[line] = cmds
+                else:
+                    self._cmds[line] = cmds, comment
+        else:
+            if isinstance(entry, tuple):
+                cmds, comment = entry
+            else:
+                cmds, comment = entry, ""
+        if comment is not None:
+            if cnc is None:
+                CNC.comment = comment
+            else:
+                cnc.comment = comment
+        if isinstance(cmds, list):
+            # evaluate() replaces the expressions in place
+            return cmds[:]
+        return cmds
+
+    # ----------------------------------------------------------------------
+    # Cached CNC.breakLine(), returns a new list every time
+    # ----------------------------------------------------------------------
+    def breakLine(self, line):
+        try:
+            return list(self._words[line])
+        except KeyError:
+            words = CNC.breakLine(line)
+            if words is not None:
+                self._words[line] = tuple(words)
+            return words
+
+    # ----------------------------------------------------------------------
+    # Release the drawing geometry and the compiled lines, called when
+    # lines are modified
+    # @param lines the lines removed, all the compiled lines if None
+    # ----------------------------------------------------------------------
+    def clearCache(self, lines=None):
+        self._geometry = None
+        if lines is None:
+            self._cmds.clear()
+            self._words.clear()
+            return
+        for line in lines:
+            cmds = self._cmds.pop(line, None)
+            if isinstance(cmds, str):
+                self._words.pop(cmds, None)
+
+    # ----------------------------------------------------------------------
+    # @return the lines as they are now, unchanged by later edits
+    # ----------------------------------------------------------------------
+    def snapshot(self):
+        return self[:]
+
+    # ----------------------------------------------------------------------
+    # @return the number of modifications of the lines, a cheap key of
+    #         the content for the drawing cache
+    # ----------------------------------------------------------------------
+    def version(self):
+        return self._version
+
+    # ----------------------------------------------------------------------
+    # Move the lines to the compact storage of PackedBlock
+    # ----------------------------------------------------------------------
+    def pack(self):
+        lines = PackedLines(self)
+        paths = array("i", [p or 0 for p in self._path])
+        list.clear(self)
+        self._lines = lines
+        self._path = paths
+        self._cmds = {}
+        self._words = {}
+        self.__class__ = PackedBlock
+
+    # ----------------------------------------------------------------------
+    def unpack(self):
+        pass
+
     # ----------------------------------------------------------------------
     def resetPath(self):
         del self._path[:]
@@ -2450,6 +2735,7 @@ class Block(list):
         self.length = 0.0  # cut length
         self.rapid = 0.0  # rapid length
         self.time = 0.0
+        self.limited = []  # lines whose segments are too short for the feed
 
     # ----------------------------------------------------------------------
     def hasPath(self):
@@ -2459,6 +2745,12 @@ class Block(list):
     def addPath(self, p):
         self._path.append(p)
 
+    # ----------------------------------------------------------------------
+    # Set at once the canvas paths of every line
+    # ----------------------------------------------------------------------
+    def setPath(self, paths):
+        self._path = paths
+
     # ----------------------------------------------------------------------
     def path(self, item):
         try:
@@ -2488,11 +2780,434 @@ class Block(list):
         self.zmax = max(self.zmax, max(i[2] for i in xyz))
 
 
+# -----------------------------------------------------------------------------
+# Modifying methods of Block, count the modifications and call the list
+# method
+# -----------------------------------------------------------------------------
+def _modifying(name):
+    listMethod = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        self._version += 1
+        return listMethod(self, *args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__",
+              "extend", "insert", "pop", "remove", "clear",
+              "sort", "reverse"):
+    setattr(Block, _name, _modifying(_name))
+del _name
+
+
+# =============================================================================
+# Linear move waiting in GCode.compileLines to be autoleveled in a batch
+# =============================================================================
+class _LevelMove:
+    __slots__ = ("move",)
+
+    def __init__(self, move):
+        self.move = move  # (g, xyz, extra, unit) as in GCode.autolevelMoves
+
+
+# =============================================================================
+# Linear move waiting in GCode.compileLines to be merged or fitted to arcs
+# =============================================================================
+class _FitMove:
+    __slots__ = ("line", "start", "end", "key")
+
+    def __init__(self, line, start, end, key):
+        self.line = line
+        self.start = start
+        self.end = end
+        self.key = key  # (feed, unit, arcs) shared by the moves fitted together
+
+
+# =============================================================================
+# Compact mapping of every compiled line to its (block, line) origin
+# or None. Stored in two integer arrays instead of a list of tuples
+# to keep the memory constant per line on multi-million line programs
+# =============================================================================
+class PathMap:
+    def __init__(self):
+        self._bid = array("i")
+        self._lid = array("i")
+
+    # ----------------------------------------------------------------------
+    def append(self, path):
+        if path is None:
+            self._bid.append(-1)
+            self._lid.append(-1)
+        else:
+            self._bid.append(path[0])
+            self._lid.append(path[1])
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        # _lid is appended last, safe to read while another thread appends
+        return len(self._lid)
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, item):
+        bid = self._bid[item]
+        if bid < 0:
+            return None
+        return bid, self._lid[item]
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        for bid, lid in zip(self._bid, self._lid):
+            if bid < 0:
+                yield None
+            else:
+                yield bid, lid
+
+
+# =============================================================================
+# Immutable compact sequence of text lines. The lines are stored utf-8
+# encoded and newline terminated in one bytes buffer with an array of
+# their offsets, instead of one str object per line, and decoded on access
+# =============================================================================
+class PackedLines:
+    def __init__(self, lines=()):
+        data = [line.encode() + b"\n" for line in lines]
+        self._offsets = array("q", [0])
+        self._offsets.extend(itertools.accumulate(map(len, data)))
+        self._data = b"".join(data)
+        # if no line contains a newline the buffer can be split at once
+        self._split = self._data.count(b"\n") == len(data)
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        n = len(self)
+        if item < 0:
+            item += n
+        if not 0 <= item < n:
+            raise IndexError("line index out of range")
+        start = self._offsets[item]
+        end = self._offsets[item + 1] - 1
+        return self._data[start:end].decode()
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        if self._split:
+            lines = self._data.decode().split("\n")
+            lines.pop()  # after the last newline
+            return iter(lines)
+        return (self[i] for i in range(len(self)))
+
+    # ----------------------------------------------------------------------
+    # @return bytes used by the storage
+    # ----------------------------------------------------------------------
+    def nbytes(self):
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+# =============================================================================
+# Immutable sequence of text lines compressed with zlib, for the undo
+# records. The lines are decompressed at once when iterated
+# =============================================================================
+class CompressedLines:
+    LEVEL = 1  # zlib compression level, favouring speed
+
+    def __init__(self, lines=()):
+        text = "\n".join(lines)
+        self._count = len(lines)
+        self._data = zlib.compress(text.encode(), self.LEVEL)
+        # lines containing a newline cannot be split back
+        if text.count("\n") != max(self._count - 1, 0):
+            raise ValueError("lines containing a newline")
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return self._count
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, item):
+        return self.lines()[item]
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        return iter(self.lines())
+
+    # ----------------------------------------------------------------------
+    # @return the decompressed lines as a list
+    # ----------------------------------------------------------------------
+    def lines(self):
+        if not self._count:
+            return []
+        return zlib.decompress(self._data).decode().split("\n")
+
+    # ----------------------------------------------------------------------
+    # @return bytes used by the storage
+    # ----------------------------------------------------------------------
+    def nbytes(self):
+        return len(self._data)
+
+
+# =============================================================================
+# Block with its lines in PackedLines and the canvas items of the lines in
+# an integer array (0 for no item). Reading keeps the compact storage, any
+# modification converts it back to a plain Block first, so the list API
+# works unchanged for the editor and the plugins.
+# Enabled with GCode.PACK_LINES
+# =============================================================================
+class PackedBlock(Block):
+    def __len__(self):
+        return len(self._lines)
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, item):
+        return self._lines[item]
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        return iter(self._lines)
+
+    # ----------------------------------------------------------------------
+    def __reversed__(self):
+        return reversed(self._lines[:])
+
+    # ----------------------------------------------------------------------
+    def __contains__(self, line):
+        return any(x == line for x in self._lines)
+
+    # ----------------------------------------------------------------------
+    def __eq__(self, other):
+        return self._lines[:] == list(other)
+
+    __hash__ = None
+
+    # ----------------------------------------------------------------------
+    def __repr__(self):
+        return repr(self._lines[:])
+
+    # ----------------------------------------------------------------------
+    def index(self, line, *args):
+        return self._lines[:].index(line, *args)
+
+    # ----------------------------------------------------------------------
+    def count(self, line):
+        return sum(x == line for x in self._lines)
+
+    # ----------------------------------------------------------------------
+    def dump(self):
+        return self.name(), self.enable, self.expand, self.color, self[:]
+
+    # ----------------------------------------------------------------------
+    def pack(self):
+        pass
+
+    # ----------------------------------------------------------------------
+    # The lines are not cached, packing is chosen to save memory
+    # ----------------------------------------------------------------------
+    def compileLine(self, line, cnc=None):
+        cmds, comment = CNC.parseLine(line)
+        if comment is not None:
+            if cnc is None:
+                CNC.comment = comment
+            else:
+                cnc.comment = comment
+        return cmds
+
+    # ----------------------------------------------------------------------
+    def breakLine(self, line):
+        return CNC.breakLine(line)
+
+    # ----------------------------------------------------------------------
+    # The packed lines are never modified, an edit replaces them
+    # ----------------------------------------------------------------------
+    def snapshot(self):
+        return self._lines
+
+    # ----------------------------------------------------------------------
+    # Convert back to a plain Block
+    # ----------------------------------------------------------------------
+    def unpack(self):
+        lines = self._lines
+        paths = self._path
+        del self._lines
+        self.__class__ = Block
+        list.extend(self, lines)
+        self._path = [p or None for p in paths]
+
+    # ----------------------------------------------------------------------
+    # @return bytes used by the storage of the lines and the paths
+    # ----------------------------------------------------------------------
+    def nbytes(self):
+        return self._lines.nbytes() + self._path.itemsize * len(self._path)
+
+    # ----------------------------------------------------------------------
+    def addPath(self, p):
+        self._path.append(p or 0)
+
+    # ----------------------------------------------------------------------
+    def setPath(self, paths):
+        self._path = array("i", [p or 0 for p in paths])
+
+    # ----------------------------------------------------------------------
+    def path(self, item):
+        try:
+            return self._path[item] or None
+        except Exception:
+            return None
+
+
+# -----------------------------------------------------------------------------
+# Modifying methods of PackedBlock, unpack and call the list method
+# -----------------------------------------------------------------------------
+def _unpacked(name):
+    def method(self, *args, **kwargs):
+        self.unpack()
+        return getattr(self, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__",
+              "append", "extend", "insert", "pop", "remove", "clear",
+              "sort", "reverse"):
+    setattr(PackedBlock, _name, _unpacked(_name))
+del _name
+
+
+# -----------------------------------------------------------------------------
+# Read all the lines of a text file at once. Only the newlines split the
+# lines as iterating the file does, splitlines() would split as well on
+# form feeds and other separators inside comments
+# -----------------------------------------------------------------------------
+def readLines(filename):
+    with open(filename) as f:
+        lines = f.read().split("\n")
+    if not lines[-1]:
+        lines.pop()  # after the last newline
+    return lines
+
+
+# =============================================================================
+# Split a G-code file in blocks on a worker thread
+#
+# The Tk thread starts the loader and collects periodically with poll()
+# the finished blocks, while progress() reports the lines parsed so far.
+# The blocks are parsed by a private GCode instance, so the GUI never
+# sees a block still growing.
+# =============================================================================
+class GCodeLoader:
+    def __init__(self, filename):
+        self.filename = filename
+        self.total = 0  # lines in file
+        self.done = 0  # lines parsed
+        self.error = None  # error message if loading failed
+        # the modal variables set by the file, kept away from the global
+        # CNC.vars used by the GUI until the loading finishes
+        self.vars = {"feedmode": CNC.vars["feedmode"]}
+        self._gcode = GCode()
+        self._gcode.cnc.vars = self.vars
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = None
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="GCodeLoader", daemon=True)
+        self._thread.start()
+
+    # ----------------------------------------------------------------------
+    # Request the worker to stop, the blocks already parsed are kept
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        self._stop.set()
+
+    # ----------------------------------------------------------------------
+    def canceled(self):
+        return self._stop.is_set()
+
+    # ----------------------------------------------------------------------
+    # @return True once the worker ended and all blocks were collected
+    # ----------------------------------------------------------------------
+    def finished(self):
+        return self._finished
+
+    # ----------------------------------------------------------------------
+    # @return fraction of the lines parsed
+    # ----------------------------------------------------------------------
+    def progress(self):
+        if self.total == 0:
+            return 0.0
+        return self.done / self.total
+
+    # ----------------------------------------------------------------------
+    # @return list of the blocks finished since the last call
+    # ----------------------------------------------------------------------
+    def poll(self):
+        blocks = []
+        while True:
+            try:
+                batch = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                self._finished = True
+                break
+            blocks.extend(batch)
+        return blocks
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        try:
+            self._load()
+        except Exception:
+            self.error = traceback.format_exc()
+        self._queue.put(None)
+
+    # ----------------------------------------------------------------------
+    def _load(self):
+        lines = readLines(self.filename)
+        self.total = len(lines)
+
+        gcode = self._gcode
+        gcode.cnc.initPath()
+        gcode._blocksExist = False
+        blocks = gcode.blocks
+        sent = 0
+        for start in range(0, self.total, LOAD_BATCH):
+            if self._stop.is_set():
+                return
+            for line in lines[start:start + LOAD_BATCH]:
+                gcode._addLine(line)
+            self.done = min(start + LOAD_BATCH, self.total)
+
+            # hand over the blocks before the last, still growing, one
+            n = len(blocks) - 1
+            if n > sent:
+                gcode.packBlocks(blocks[sent:n])
+                self._queue.put(blocks[sent:n])
+                sent = n
+
+        gcode._trim()
+        if len(blocks) > sent:
+            gcode.packBlocks(blocks[sent:])
+            self._queue.put(blocks[sent:])
+
+
 # =============================================================================
 # Gcode file
 # =============================================================================
 class GCode:
     LOOP_MERGE = False
+    PACK_LINES = False  # keep the lines of the blocks in PackedBlock
+    UNDO_COMPRESS = 256  # compress the undo records of more lines
 
     # ----------------------------------------------------------------------
     def __init__(self, app=None):
@@ -2508,6 +3223,7 @@ class GCode:
         self.x_probe_to_tool_offset = 0
         self.y_probe_to_tool_offset = 0
         self.z_probe_to_tool_offset = 0
+        self.fitStats = None  # streamfit.FitStats of the last compilation
         self.init()
 
     # ----------------------------------------------------------------------
@@ -2641,19 +3357,56 @@ class GCode:
         self.init()
         self.filename = filename
         try:
-            f = open(self.filename)
+            lines = readLines(self.filename)
         except Exception:
             return False
         self._lastModified = os.stat(self.filename).st_mtime
         self.cnc.initPath()
         self.cnc.resetAllMargins()
         self._blocksExist = False
-        for line in f:
-            self._addLine(line[:-1].replace("\x0d", ""))
+        for line in lines:
+            self._addLine(line)
         self._trim()
-        f.close()
+        self.packBlocks()
         return True
 
+    # ----------------------------------------------------------------------
+    # Start loading a file into editor on a worker thread
+    # The blocks are appended with addLoaded() as the loader returns them
+    # @return the started GCodeLoader or None if the file cannot be opened
+    # ----------------------------------------------------------------------
+    def loadBackground(self, filename=None):
+        if filename is None:
+            filename = self.filename
+        self.init()
+        self.filename = filename
+        try:
+            self._lastModified = os.stat(self.filename).st_mtime
+        except OSError:
+            return None
+        self.cnc.initPath()
+        self.cnc.resetAllMargins()
+        loader = GCodeLoader(self.filename)
+        loader.start()
+        return loader
+
+    # ----------------------------------------------------------------------
+    # Pack the lines of blocks (all if None) when PACK_LINES is enabled
+    # ----------------------------------------------------------------------
+    def packBlocks(self, blocks=None):
+        if not self.PACK_LINES:
+            return
+        if blocks is None:
+            blocks = self.blocks
+        for block in blocks:
+            block.pack()
+
+    # ----------------------------------------------------------------------
+    # Append the blocks returned by GCodeLoader.poll()
+    # ----------------------------------------------------------------------
+    def addLoaded(self, blocks):
+        self.blocks.extend(blocks)
+
     # ----------------------------------------------------------------------
     # Save to a file
     # ----------------------------------------------------------------------
@@ -3440,11 +4193,30 @@ class GCode:
     def canRedo(self):
         return self.undoredo.canRedo()
 
+    # ----------------------------------------------------------------------
+    # @return bytes held by the undo/redo records
+    # ----------------------------------------------------------------------
+    def undoMemory(self):
+        return self.undoredo.memory()
+
+    # ----------------------------------------------------------------------
+    # @return the lines to keep in an undo record, compressed when longer
+    #         than UNDO_COMPRESS
+    # ----------------------------------------------------------------------
+    def undoLines(self, lines):
+        lines = list(lines)
+        if len(lines) > self.UNDO_COMPRESS:
+            try:
+                return CompressedLines(lines)
+            except ValueError:
+                pass
+        return lines
+
     # ----------------------------------------------------------------------
     # Change all lines in editor
     # ----------------------------------------------------------------------
     def setLinesUndo(self, lines):
-        undoinfo = (self.setLinesUndo, list(self.lines()))
+        undoinfo = (self.setLinesUndo, self.undoLines(self.lines()))
         # Delete all blocks and create new ones
         del self.blocks[:]
         self.cnc.initPath()
@@ -3452,6 +4224,7 @@ class GCode:
         for line in lines:
             self._addLine(line)
         self._trim()
+        self.packBlocks()
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3464,8 +4237,11 @@ class GCode:
     # Change a single line in a block
     # ----------------------------------------------------------------------
     def setLineUndo(self, bid, lid, line):
-        undoinfo = (self.setLineUndo, bid, lid, self.blocks[bid][lid])
-        self.blocks[bid][lid] = line
+        block = self.blocks[bid]
+        old = block[lid]
+        undoinfo = (self.setLineUndo, bid, lid, old)
+        block[lid] = line
+        block.clearCache((old,))
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3491,8 +4267,10 @@ class GCode:
     # ----------------------------------------------------------------------
     def delLineUndo(self, bid, lid):
         block = self.blocks[bid]
-        undoinfo = (self.insLineUndo, bid, lid, block[lid])
+        old = block[lid]
+        undoinfo = (self.insLineUndo, bid, lid, old)
         del block[lid]
+        block.clearCache((old,))
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3676,13 +4454,35 @@ class GCode:
         return undoinfo
 
     # ----------------------------------------------------------------------
-    # Replace the lines of a block
+    # Replace the lines of a block. Only the lines differing between the
+    # common head and tail of the old and new lines are kept for the undo
     # ----------------------------------------------------------------------
     def setBlockLinesUndo(self, bid, lines):
+        old = list(self.blocks[bid])
+        lines = list(lines)
+        n = min(len(old), len(lines))
+        start = 0
+        while start < n and old[start] == lines[start]:
+            start += 1
+        end = 0
+        while end < n - start and old[-end - 1] == lines[-end - 1]:
+            end += 1
+        return self.replaceBlockLinesUndo(
+            bid, start, len(old) - end, lines[start:len(lines) - end])
+
+    # ----------------------------------------------------------------------
+    # Replace the lines start..end-1 of a block
+    # ----------------------------------------------------------------------
+    def replaceBlockLinesUndo(self, bid, start, end, lines):
         block = self.blocks[bid]
-        undoinfo = (self.setBlockLinesUndo, bid, block[:])
-        del block[:]
-        block.extend(lines)
+        lines = list(lines)
+        old = block[start:end]
+        undoinfo = (self.replaceBlockLinesUndo, bid, start,
+                    start + len(lines), self.undoLines(old))
+        block[start:end] = lines
+        block.clearCache(old)
+        if self.PACK_LINES:
+            block.pack()
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3707,19 +4507,78 @@ class GCode:
         block.insert(lid + 1, block.pop(lid))
         return undoinfo
 
+    # ----------------------------------------------------------------------
+    # Correct with the probe information a list of linear moves
+    # @param moves list of (g, xyz, extra, unit) where xyz is the motion
+    #        path, extra the non-motion words to append to the first line
+    #        and unit the scale of the G20/G21 mode of the line
+    # @return a list with the autoleveled lines for every move
+    # ----------------------------------------------------------------------
+    def autolevelMoves(self, moves):
+        return self.splitMoves(moves, self.probe.splitSegments)[0]
+
+    # ----------------------------------------------------------------------
+    # Split and correct in one pass a list of linear moves
+    # @param moves as in autolevelMoves
+    # @param split function(p1, p2) returning the corrected points and
+    #        their segment index as Probe.splitSegments does
+    # @param sep separator to place before every axis word
+    # @return the list of lines for every move and the (M,3) array of
+    #         the corrected points
+    # ----------------------------------------------------------------------
+    def splitMoves(self, moves, split, sep=""):
+        if not moves:
+            return [], np.zeros((0, 3))
+        npts = np.array([len(xyz) for g, xyz, extra, unit in moves])
+        pts = np.array([p for g, xyz, extra, unit in moves for p in xyz],
+                       dtype=float)
+        units = np.array([unit for g, xyz, extra, unit in moves])
+        # every point but the last of each move starts a segment
+        start = np.ones(len(pts), dtype=bool)
+        start[np.cumsum(npts) - 1] = False
+        start = np.nonzero(start)[0]
+        segmove = np.repeat(np.arange(len(moves)), npts - 1)
+
+        points, seg = split(pts[start], pts[start + 1])
+        move = segmove[seg]
+        scaled = points / units[move][:, None]
+
+        g = [f"G{int(g)}" for g, xyz, extra, unit in moves]
+        lines = [
+            g[m] + x + y + z
+            for m, x, y, z in zip(
+                move.tolist(),
+                CNC.fmtList(sep + "X", scaled[:, 0].tolist()),
+                CNC.fmtList(sep + "Y", scaled[:, 1].tolist()),
+                CNC.fmtList(sep + "Z", scaled[:, 2].tolist()),
+            )
+        ]
+
+        new = []
+        pos = 0
+        for (g, xyz, extra, unit), n in zip(
+                moves, np.bincount(move, minlength=len(moves)).tolist()):
+            corrected = lines[pos:pos + n]
+            if corrected and extra:
+                corrected[0] += extra
+            new.append(corrected)
+            pos += n
+        return new, points
+
     # ----------------------------------------------------------------------
     # Expand block with autolevel information
     # ----------------------------------------------------------------------
     def autolevelBlock(self, block):
         new = []
+        moves = []  # moves to correct, their index in new
         autolevel = not self.probe.isEmpty()
         for line in block:
-            cmds = CNC.compileLine(line)
+            cmds = block.compileLine(line)
             if cmds is None:
                 new.append(line)
                 continue
             elif isinstance(cmds, str):
-                cmds = CNC.breakLine(cmds)
+                cmds = block.breakLine(cmds)
             else:
                 new.append(line)
                 continue
@@ -3738,30 +4597,27 @@ class GCode:
                         if (c[0].upper() not in
                                 ("G", "X", "Y", "Z", "I", "J", "K", "R")):
                             extra += c
-                    x1, y1, z1 = xyz[0]
                     if self.cnc.gcode == 0:
                         g = 0
                     else:
                         g = 1
-                    for x2, y2, z2 in xyz[1:]:
-                        for x, y, z in self.probe.splitLine(x1, y1, z1, x2,
-                                                            y2, z2):
-                            new.append(
-                                "".join([
-                                    f"G{int(g)}",
-                                    f"{self.fmt('X', x / self.cnc.unit)}",
-                                    f"{self.fmt('Y', y / self.cnc.unit)}",
-                                    f"{self.fmt('Z', z / self.cnc.unit)}",
-                                    extra,
-                                ])
-                            )
-                            extra = ""
-                        x1, y1, z1 = x2, y2, z2
+                    new.append(len(moves))
+                    moves.append((g, xyz, extra, self.cnc.unit))
                 self.cnc.motionEnd()
             else:
                 self.cnc.motionEnd()
                 new.append(line)
-        return new
+
+        if not moves:
+            return new
+        levelled = self.autolevelMoves(moves)
+        lines = []
+        for line in new:
+            if isinstance(line, int):
+                lines.extend(levelled[line])
+            else:
+                lines.append(line)
+        return lines
 
     # ----------------------------------------------------------------------
     # Execute autolevel on selected blocks
@@ -3809,18 +4665,23 @@ class GCode:
     def surf_align_block(self, block, poly_plane_coeffs, poly_plane_degree, step_size=1):
         z_probe_offset = self.z_probe_to_tool_offset
         new = []
+        moves = []  # moves to align, their index in new
 
-        all_x, all_y, all_z = [], [], []
+        def split(p1, p2):
+            pts, seg = self.probe.splitSegmentsSurfAlign(
+                p1, p2, poly_plane_coeffs, poly_plane_degree, step_size)
+            pts[:, 2] -= z_probe_offset
+            return pts, seg
 
         # is_multi_point_probe = not self.probe.multi_point_probe.is_empty()
         is_multi_point_probe = True
         for line in block:
-            cmds = CNC.compileLine(line)
+            cmds = block.compileLine(line)
             if cmds is None:
                 new.append(line)
                 continue
             elif isinstance(cmds, str):
-                cmds = CNC.breakLine(cmds)
+                cmds = block.breakLine(cmds)
             else:
                 new.append(line)
                 continue
@@ -3839,46 +4700,36 @@ class GCode:
                         if (c[0].upper() not in
                                 ("G", "X", "Y", "Z", "I", "J", "K", "R")):
                             extra += c
-                    x1, y1, z1 = xyz[0]
                     if self.cnc.gcode == 0:
                         g = 0
                     else:
                         g = 1
-                    for x2, y2, z2 in xyz[1:]:
-                        for x, y, z in self.probe.splitLine_surf_align(x1, y1, z1, x2,
-                                                                       y2, z2, poly_plane_coeffs, poly_plane_degree,
-                                                                       step_size=step_size):
-                            z -= z_probe_offset
-                            new.append(
-                                "".join([
-                                    f"G{int(g)}",
-                                    f"{self.fmt(' X', x / self.cnc.unit)}",
-                                    f"{self.fmt(' Y', y / self.cnc.unit)}",
-                                    f"{self.fmt(' Z', z / self.cnc.unit)}",
-                                    extra,
-                                ])
-                            )
-                            all_x.append(x)
-                            all_y.append(y)
-                            all_z.append(z)
-                            extra = ""
-                        x1, y1, z1 = x2, y2, z2
+                    new.append(len(moves))
+                    moves.append((g, xyz, extra, self.cnc.unit))
                 self.cnc.motionEnd()
             else:
                 self.cnc.motionEnd()
                 new.append(line)
 
+        aligned, points = self.splitMoves(moves, split, " ")
+        lines = []
+        for line in new:
+            if isinstance(line, int):
+                lines.extend(aligned[line])
+            else:
+                lines.append(line)
+
         # Calculate bounds
-        bounds = {
-            "x_min": min(all_x) if all_x else None,
-            "x_max": max(all_x) if all_x else None,
-            "y_min": min(all_y) if all_y else None,
-            "y_max": max(all_y) if all_y else None,
-            "z_min": min(all_z) if all_z else None,
-            "z_max": max(all_z) if all_z else None,
-        }
+        bounds = dict.fromkeys(
+            ("x_min", "x_max", "y_min", "y_max", "z_min", "z_max"))
+        if len(points):
+            lo = points.min(axis=0).tolist()
+            hi = points.max(axis=0).tolist()
+            for i, axis in enumerate("xyz"):
+                bounds[f"{axis}_min"] = lo[i]
+                bounds[f"{axis}_max"] = hi[i]
 
-        return new, bounds
+        return lines, bounds
 
     def surf_align_gcode(self, items, step_size=1, degree=1):
         print("Surf Align G-Code")
@@ -4577,36 +5428,45 @@ class GCode:
     # ----------------------------------------------------------------------
     def reverse(self, items):
         undoinfo = []
-        remove = ["cut", "climb", "conventional", "cw", "ccw", "reverse"]
         for bid in items:
-            operation = "reverse"
-
-            if self.blocks[bid].name() in ("Header", "Footer"):
-                continue
-            newpath = Path(self.blocks[bid].name())
-
-            # Not sure if this is good idea...
-            # Might get confusing if something goes wrong,
-            # but seems to work fine
-            if self.blocks[bid].operationTest("conventional"):
-                operation += ",climb"
-            if self.blocks[bid].operationTest("climb"):
-                operation += ",conventional"
-            if self.blocks[bid].operationTest("cw"):
-                operation += ",ccw"
-            if self.blocks[bid].operationTest("ccw"):
-                operation += ",cw"
-
-            for path in self.toPath(bid):
-                path.invert()
-                newpath.extend(path)
-            if newpath:
-                block = self.fromPath(newpath)
-                undoinfo.append(
-                    self.addBlockOperationUndo(bid, operation, remove))
-                undoinfo.append(self.setBlockLinesUndo(bid, block))
+            undoinfo.extend(self.reverseBlockUndo(bid))
         self.addUndo(undoinfo)
 
+    # ----------------------------------------------------------------------
+    # Reverse the cut direction of a block
+    # @return the list of undo information
+    # ----------------------------------------------------------------------
+    def reverseBlockUndo(self, bid):
+        undoinfo = []
+        remove = ["cut", "climb", "conventional", "cw", "ccw", "reverse"]
+        operation = "reverse"
+
+        if self.blocks[bid].name() in ("Header", "Footer"):
+            return undoinfo
+        newpath = Path(self.blocks[bid].name())
+
+        # Not sure if this is good idea...
+        # Might get confusing if something goes wrong,
+        # but seems to work fine
+        if self.blocks[bid].operationTest("conventional"):
+            operation += ",climb"
+        if self.blocks[bid].operationTest("climb"):
+            operation += ",conventional"
+        if self.blocks[bid].operationTest("cw"):
+            operation += ",ccw"
+        if self.blocks[bid].operationTest("ccw"):
+            operation += ",cw"
+
+        for path in self.toPath(bid):
+            path.invert()
+            newpath.extend(path)
+        if newpath:
+            block = self.fromPath(newpath)
+            undoinfo.append(
+                self.addBlockOperationUndo(bid, operation, remove))
+            undoinfo.append(self.setBlockLinesUndo(bid, block))
+        return undoinfo
+
     # ----------------------------------------------------------------------
     # Change cut direction
     # 1     CW
@@ -5144,6 +6004,7 @@ class GCode:
     # ----------------------------------------------------------------------
     def modify(self, items, func, tabFunc, *args):
         undoinfo = []
+        changed = {}  # modified lines of every block
         old = {}  # Motion commands: Last value
         new = {}  # Motion commands: New value
         relative = False
@@ -5199,14 +6060,21 @@ class GCode:
                                     self.fmt(c, new[c] / self.cnc.unit))
                         except Exception:
                             pass
-                    undoinfo.append(
-                        self.setLineUndo(bid, lid, " ".join(newcmd)))
+                    changed.setdefault(bid, {})[lid] = " ".join(newcmd)
                 self.cnc.motionEnd()
                 # reset arc offsets
                 for i in "IJK":
                     if i in old:
                         old[i] = 0.0
 
+        # replace the lines of every block at once, keeping for the undo
+        # only the range of the modified lines
+        for bid, lines in changed.items():
+            block = list(self.blocks[bid])
+            for lid, line in lines.items():
+                block[lid] = line
+            undoinfo.append(self.setBlockLinesUndo(bid, block))
+
         # FIXME I should add it later, check all functions using it
         self.addUndo(undoinfo)
 
@@ -5416,126 +6284,264 @@ class GCode:
         pass
 
     # ----------------------------------------------------------------------
-    # Re-arrange using genetic algorithms a set of blocks to minimize
-    # rapid movements.
+    # Return True if the block can be cut backwards with reverse() without
+    # losing information: a single path on the surface, not cut in passes
     # ----------------------------------------------------------------------
-    def optimize(self, items):
-        n = len(items)
+    def reversible(self, bid):
+        block = self.blocks[bid]
+        if block.name() in ("Header", "Footer"):
+            return False
+        if block.zmin < self.cnc["surface"] - TOLERANCE:
+            return False
+        for line in block:
+            if line[:5] == "(pass" or "cut-here" in line:
+                return False
+        return True
 
-        matrix = []
-        for i in range(n):
-            matrix.append([0.0] * n)
-
-        # Find distances between blocks (end to start)
-        for i in range(n):
-            block = self.blocks[items[i]]
-            x1 = block.ex
-            y1 = block.ey
-            for j in range(n):
-                if i == j:
-                    continue
-                block = self.blocks[items[j]]
-                x2 = block.sx
-                y2 = block.sy
-                dx = x1 - x2
-                dy = y1 - y2
-                # Compensate for machines, which have different
-                # speed of X and Y:
-                dx /= CNC.feedmax_x
-                dy /= CNC.feedmax_y
-                matrix[i][j] = sqrt(dx * dx + dy * dy)
-
-        best = [0]
-        unvisited = list(range(1, n))
-        while unvisited:
-            last = best[-1]
-            row = matrix[last]
-            # from all the unvisited places search the closest one
-            mindist = 1e30
-            for i, u in enumerate(unvisited):
-                d = row[u]
-                if d < mindist:
-                    mindist = d
-                    si = i
-            best.append(unvisited.pop(si))
+    # ----------------------------------------------------------------------
+    # Re-arrange a set of blocks to minimize rapid movements. The order is
+    # built with a nearest neighbour search and improved by 2-opt and
+    # Or-opt moves, reversing the open blocks where allowed
+    # @return the rapid distance between the blocks before and after
+    # ----------------------------------------------------------------------
+    def optimize(self, items, timeout=tour.IMPROVE_TIME):
+        n = len(items)
+        blocks = [self.blocks[bid] for bid in items]
+        starts = [(block.sx, block.sy) for block in blocks]
+        ends = [(block.ex, block.ey) for block in blocks]
+        before = tour.length(starts, ends, range(n), [False] * n)
+        if n < 2:
+            return before, before
+
+        # Compensate for machines, which have different
+        # speed of X and Y:
+        scaled = [
+            [(x / CNC.feedmax_x, y / CNC.feedmax_y) for x, y in points]
+            for points in (starts, ends)
+        ]
+        closed = [
+            abs(block.sx - block.ex) < TOLERANCE
+            and abs(block.sy - block.ey) < TOLERANCE
+            for block in blocks
+        ]
+        reversible = [
+            closed[i] or self.reversible(bid) for i, bid in enumerate(items)
+        ]
+        best, flipped = tour.optimize(*scaled, reversible, timeout)
 
         undoinfo = []
-        for i in range(len(best)):
-            b = best[i]
-            if i == b:
+        for i, bid in enumerate(items):
+            if flipped[i] and not closed[i]:
+                undoinfo.extend(self.reverseBlockUndo(bid))
+
+        # permute the blocks with swaps
+        where = list(range(n))  # position of every original block
+        current = list(range(n))  # original block at every position
+        for i, b in enumerate(best):
+            k = where[b]
+            if k == i:
                 continue
-            ptr = best.index(i)
-            undoinfo.append(self.swapBlockUndo(items[i], items[b]))
-            best[i], best[ptr] = best[ptr], best[i]
+            undoinfo.append(self.swapBlockUndo(items[i], items[k]))
+            current[i], current[k] = current[k], current[i]
+            where[current[i]] = i
+            where[current[k]] = k
         self.addUndo(undoinfo, "Optimize")
 
+        return before, tour.length(starts, ends, best, flipped)
+
     # ----------------------------------------------------------------------
     # Use probe information to modify the g-code to autolevel
     # ----------------------------------------------------------------------
     def compile(self, queue, stopFunc=None):
-        paths = []
+        paths = PathMap()
+        stopped = False
+
+        def stop():
+            nonlocal stopped
+            stopped = stopFunc()
+            return stopped
 
-        def add(line, path):
+        for line, path in self.compileLines(stopFunc and stop):
             if line is not None:
                 if isinstance(line, str):
                     queue.put(line + "\n")
                 else:
                     queue.put(line)
             paths.append(path)
+        if stopped:
+            return None
+        return paths
+
+    # ----------------------------------------------------------------------
+    # Generator version of compile. Lines are produced lazily as
+    # (line, path) pairs, so the sender can start streaming before the
+    # whole program is compiled. The program is fixed when called, and
+    # compiled with its own CNC state, so the editor and the canvas can
+    # keep working while the lines are consumed by another thread
+    # @param stopFunc polled periodically, stop compiling if it returns True
+    # ----------------------------------------------------------------------
+    def compileLines(self, stopFunc=None):
+        if CNC.fitTolerance > 0.0 and self.probe.isEmpty():
+            rate, accel, junction = CNC.machineLimits()
+            try:
+                arcTolerance = float(CNC.vars["grbl_12"])
+                if CNC.inch:
+                    arcTolerance /= 25.4
+            except (KeyError, ValueError):
+                arcTolerance = streamfit.ARC_TOLERANCE
+            self.fitStats = streamfit.FitStats(rate, accel, junction,
+                                               arcTolerance)
+        else:
+            self.fitStats = None
 
+        cnc = CNC()
+        cnc.vars = {"feedmode": CNC.vars["feedmode"]}
+        program = [(i, block, block.snapshot())
+                   for i, block in enumerate(self.blocks) if block.enable]
+        return self._batchLines(self._compileLines(cnc, program, stopFunc))
+
+    # ----------------------------------------------------------------------
+    # Autolevel and fit the moves of the compiled lines in batches
+    # ----------------------------------------------------------------------
+    def _batchLines(self, lines):
+        moves = []  # moves waiting to be autoleveled in a batch
+        paths = []
+        fits = []  # moves waiting to be fitted in a batch
+        fitPaths = []
+        for line, path in lines:
+            if isinstance(line, _FitMove):
+                if fits and (line.key != fits[0].key
+                             or line.start != fits[-1].end
+                             or len(fits) >= FIT_BATCH):
+                    yield from self.fitMoves(fits, fitPaths)
+                    del fits[:]
+                    del fitPaths[:]
+                fits.append(line)
+                fitPaths.append(path)
+                continue
+            if fits:
+                yield from self.fitMoves(fits, fitPaths)
+                del fits[:]
+                del fitPaths[:]
+
+            level = isinstance(line, _LevelMove)
+            if level:
+                moves.append(line.move)
+                paths.append(path)
+                if len(moves) < LEVEL_BATCH:
+                    continue
+            if moves:
+                for p, levelled in zip(paths, self.autolevelMoves(moves)):
+                    for levelledLine in levelled:
+                        yield levelledLine, p
+                del moves[:]
+                del paths[:]
+            if not level:
+                yield line, path
+
+        for p, levelled in zip(paths, self.autolevelMoves(moves)):
+            for levelledLine in levelled:
+                yield levelledLine, p
+        if fits:
+            yield from self.fitMoves(fits, fitPaths)
+
+    # ----------------------------------------------------------------------
+    # Replace a run of linear moves by merged lines and arcs within
+    # CNC.fitTolerance. A fitted line is mapped to the path of the last
+    # original line it replaces
+    # ----------------------------------------------------------------------
+    def fitMoves(self, moves, paths):
+        feed, unit, arcs = moves[0].key
+        points = [moves[0].start]
+        points.extend(move.end for move in moves)
+        fitted = streamfit.fit(points, CNC.fitTolerance, arcs)
+        if self.fitStats is not None:
+            self.fitStats.add(points, fitted, feed)
+
+        start = 0
+        arc = False  # controller left in G2/G3 by the previous motion
+        for end, center, cw in fitted:
+            if end == start + 1 and not arc:
+                yield moves[start].line, paths[start]
+            else:
+                if center is None:
+                    cmd = ["G1"]
+                elif cw:
+                    cmd = ["G2"]
+                else:
+                    cmd = ["G3"]
+                # only the axes moved, as the original lines do
+                for axis, a, b in zip("XYZ", points[start], points[end]):
+                    if a != b:
+                        cmd.append(self.fmt(axis, b / unit))
+                if center is not None:
+                    cmd.append(self.fmt("I", (center[0] - points[start][0])
+                                        / unit))
+                    cmd.append(self.fmt("J", (center[1] - points[start][1])
+                                        / unit))
+                if start == 0 or CNC.appendFeed:
+                    cmd.append(self.fmt("F", feed / unit))
+                yield "".join(cmd), paths[end - 1]
+            arc = center is not None
+            start = end
+
+    # ----------------------------------------------------------------------
+    # @param cnc state of the compilation
+    # @param program (block id, block, lines) of the enabled blocks
+    # ----------------------------------------------------------------------
+    def _compileLines(self, cnc, program, stopFunc):
         autolevel = not self.probe.isEmpty()
-        self.initPath()
-        for line in CNC.compile(self.cnc.startup.splitlines()):
-            add(line, None)
+        fitting = CNC.fitTolerance > 0.0 and not autolevel
+        for line in CNC.compile(CNC.startup.splitlines()):
+            yield (line, None)
 
         every = 1
-        for i, block in enumerate(self.blocks):
-            if not block.enable:
-                continue
-            for j, line in enumerate(block):
+        for i, block, lines in program:
+            for j, line in enumerate(lines):
                 every -= 1
                 if every <= 0:
                     if stopFunc is not None and stopFunc():
-                        return None
+                        return
                     every = 50
 
                 newcmd = []
-                cmds = CNC.compileLine(line)
+                cmds = block.compileLine(line, cnc)
                 if cmds is None:
                     continue
                 elif isinstance(cmds, str):
-                    cmds = CNC.breakLine(cmds)
+                    cmds = block.breakLine(cmds)
                 else:
                     # either CodeType or tuple, list[] append at it as is
                     if (isinstance(cmds, types.CodeType)
                             or isinstance(cmds, int)):
-                        add(cmds, None)
+                        yield (cmds, None)
                     else:
-                        add(cmds, (i, j))
+                        yield (cmds, (i, j))
                     continue
 
                 skip = False
                 expand = None
-                self.cnc.motionStart(cmds)
+                fit = None
+                cnc.motionStart(cmds)
 
                 # FIXME append feed on cut commands. It will be obsolete
                 # in grbl v1.0
-                if CNC.appendFeed and self.cnc.gcode in (1, 2, 3):
+                if CNC.appendFeed and cnc.gcode in (1, 2, 3):
                     # Check is not existing in cmds
                     for c in cmds:
                         if c[0] in ("f", "F"):
                             break
                     else:
                         cmds.append(
-                            self.fmt("F", self.cnc.feed / self.cnc.unit))
+                            self.fmt("F", cnc.feed / cnc.unit))
 
-                if (autolevel and self.cnc.gcode in (0, 1, 2, 3)
-                        and self.cnc.mval == 0):
-                    xyz = self.cnc.motionPath()
+                if (autolevel and cnc.gcode in (0, 1, 2, 3)
+                        and cnc.mval == 0):
+                    xyz = cnc.motionPath()
                     if not xyz:
                         # while auto-levelling, do not ignore non-movement
                         # commands, just append the line as-is
-                        add(line, None)
+                        yield (line, None)
                     else:
                         extra = ""
                         for c in cmds:
@@ -5550,32 +6556,18 @@ class GCode:
                                     "R",
                             ):
                                 extra += c
-                        x1, y1, z1 = xyz[0]
-                        if self.cnc.gcode == 0:
+                        if cnc.gcode == 0:
                             g = 0
                         else:
                             g = 1
-                        for x2, y2, z2 in xyz[1:]:
-                            for x, y, z in self.probe.splitLine(x1, y1, z1,
-                                                                x2, y2, z2):
-                                add(
-                                    "".join([
-                                        f"G{int(g)}",
-                                        f"{self.fmt('X', x / self.cnc.unit)}",
-                                        f"{self.fmt('Y', y / self.cnc.unit)}",
-                                        f"{self.fmt('Z', z / self.cnc.unit)}",
-                                        f"{extra}",
-                                    ]),
-                                    (i, j),
-                                )
-                                extra = ""
-                            x1, y1, z1 = x2, y2, z2
-                    self.cnc.motionEnd()
+                        yield (_LevelMove((g, xyz, extra, cnc.unit)),
+                               (i, j))
+                    cnc.motionEnd()
                     continue
                 else:
                     # FIXME expansion policy here variable needed
                     # Canned cycles
-                    if CNC.drillPolicy == 1 and self.cnc.gcode in (
+                    if CNC.drillPolicy == 1 and cnc.gcode in (
                             81,
                             82,
                             83,
@@ -5583,20 +6575,31 @@ class GCode:
                             86,
                             89,
                     ):
-                        expand = self.cnc.macroGroupG8X()
+                        expand = cnc.macroGroupG8X()
                     # Tool change
-                    elif self.cnc.mval == 6:
+                    elif cnc.mval == 6:
                         if CNC.toolPolicy == 0:
                             pass  # send to grbl
                         elif CNC.toolPolicy == 1:
                             skip = True  # skip whole line
                         elif CNC.toolPolicy >= 2:
-                            expand = CNC.compile(self.cnc.toolChange())
-                    self.cnc.motionEnd()
+                            expand = CNC.compile(cnc.toolChange())
+                    elif (fitting and cnc.gcode == 1
+                            and cnc.mval == 0
+                            and cnc.absolute
+                            and not cnc.arcabsolute
+                            and cnc.vars["feedmode"] in (94, "G94")):
+                        fit = _FitMove(
+                            None,
+                            (cnc.x, cnc.y, cnc.z),
+                            (cnc.xval, cnc.yval, cnc.zval),
+                            (cnc.feed, cnc.unit,
+                             cnc.plane == XY))
+                    cnc.motionEnd()
 
                 if expand is not None:
                     for line in expand:
-                        add(line, None)
+                        yield (line, None)
                     expand = None
                     continue
                 elif skip:
@@ -5619,12 +6622,19 @@ class GCode:
                     if cmd is not None:
                         newcmd.append(cmd)
 
-                add("".join(newcmd), (i, j))
+                if fit is not None and all(
+                        c[0] in "XYZFxyzf" or c.upper() in ("G1", "G01")
+                        for c in newcmd):
+                    fit.line = "".join(newcmd)
+                    yield (fit, (i, j))
+                    continue
+
+                yield ("".join(newcmd), (i, j))
 
-        return paths
 
     def plot_cutting_points(self, x_coords, y_coords, z_coords):
         # Plotting the coordinates
+        from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 3d projection
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
         ax.scatter(x_coords, y_coords, z_coords, c='b', marker='o')
@@ -5650,12 +6660,12 @@ class GCode:
             # print("Block", bid)
             for line in block:
                 # print("Line", line)
-                cmds = CNC.compileLine(line)
+                cmds = block.compileLine(line)
                 # print("cmds", cmds)  
                 if cmds is None:
                     continue
                 elif isinstance(cmds, str):
-                    cmds = CNC.breakLine(cmds)
+                    cmds = block.breakLine(cmds)
                 else:
                     continue
                 self.cnc.motionStart(cmds)
@@ -5691,7 +6701,7 @@ class GCode:
         num_points = len(points)
 
         # Compute pairwise distance matrix
-        dist_matrix = distance_matrix(points, points)
+        dist_matrix = spatial.distance_matrix(points, points)
 
         # Step 1: Start with a random center
         selected_centers = [0]  # Select first center as the first point
@@ -5720,7 +6730,7 @@ class GCode:
         candidate_centers = np.array(candidate_centers)
 
         # Step 1: Compute distance matrix
-        dist_matrix = distance_matrix(candidate_centers, candidate_centers)
+        dist_matrix = spatial.distance_matrix(candidate_centers, candidate_centers)
 
         # Step 2: Start with a center near the middle of the rectangle
         rect_x_mid = (rectangle[0] + rectangle[2]) / 2
@@ -5741,7 +6751,7 @@ class GCode:
         fig, ax = plt.subplots()
         ax.scatter(points[:, 0], points[:, 1], color='blue', alpha=0.5, s=3, label="Points")
         ax.scatter(best_centers[:, 0], best_centers[:, 1], color='red', marker='x', s=15, label="Selected Centers")
-        max_radius = max(np.min(distance_matrix(best_centers, points), axis=0))
+        max_radius = max(np.min(spatial.distance_matrix(best_centers, points), axis=0))
         for center in best_centers:
             circle = plt.Circle(center, max_radius, color='black', fill=False, linestyle='dashed')
             ax.add_patch(circle)
@@ -5760,7 +6770,7 @@ class GCode:
                    label="Candidate Points")
         ax.scatter(optimal_centers[:, 0], optimal_centers[:, 1], color='red', marker='x', s=15,
                    label="Selected Centers")
-        max_radius = max(np.min(distance_matrix(optimal_centers, candidate_centers), axis=0))
+        max_radius = max(np.min(spatial.distance_matrix(optimal_centers, candidate_centers), axis=0))
         for center in optimal_centers:
             circle = plt.Circle(center, max_radius, color='green', fill=False, linestyle='dashed')
             ax.add_patch(circle)
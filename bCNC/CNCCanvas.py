@@ -44,8 +44,11 @@ from tkinter import (
 )
 import tkinter
 
+import numpy as np
+
 import bmath
 import Camera
+import planner
 import tkExtra
 import Utils
 from CNC import CNC
@@ -79,6 +82,9 @@ GANTRY_X = GANTRY_R * 2  # 10
 GANTRY_Y = GANTRY_R  # 5
 GANTRY_H = GANTRY_R * 5  # 20
 DRAW_TIME = 5  # Maximum draw time permitted
+MERGE_POINTS = 1000  # Maximum points of a canvas item merging many lines
+LOD_PIXELS = 1.0  # Level of detail, drop path points closer in pixels
+LOD_ZOOM = 2.0  # Rebuild the level of detail when zoom changes by
 
 INSERT_COLOR = "Blue"
 GANTRY_COLOR = "Red"
@@ -132,6 +138,16 @@ ZOOM = 1.25
 S60 = math.sin(math.radians(60))
 C60 = math.cos(math.radians(60))
 
+# Projection matrices from xyz to the canvas i, j of every view
+VIEW_MATRIX = {
+    VIEW_XY: np.array([[1.0, 0.0], [0.0, -1.0], [0.0, 0.0]]),
+    VIEW_XZ: np.array([[1.0, 0.0], [0.0, 0.0], [0.0, -1.0]]),
+    VIEW_YZ: np.array([[0.0, 0.0], [1.0, 0.0], [0.0, -1.0]]),
+    VIEW_ISO1: np.array([[S60, C60], [S60, -C60], [0.0, -1.0]]),
+    VIEW_ISO2: np.array([[S60, -C60], [-S60, -C60], [0.0, -1.0]]),
+    VIEW_ISO3: np.array([[-S60, -C60], [-S60, C60], [0.0, -1.0]]),
+}
+
 DEF_CURSOR = ""
 MOUSE_CURSOR = {
     ACTION_SELECT: DEF_CURSOR,
@@ -159,6 +175,74 @@ class AlarmException(Exception):
     pass
 
 
+# =============================================================================
+# Drawing geometry of a block, computed once and reused on every redraw
+# as long as the lines of the block and the machine state at its start
+# are unchanged
+# =============================================================================
+class BlockGeometry:
+    # machine state accumulated over all blocks, not part of the key
+    TOTALS = ("totalLength", "totalTime")
+
+    __slots__ = (
+        "key",
+        "points",  # (N,3) vertices of all motions
+        "start",  # (M+1,) offset of every motion in points
+        "lines",  # (M,) line index of every motion
+        "rapid",  # (M,) True for G0 motions
+        "feed",  # (M,) feed rate of every motion, inf for rapids
+        "stop",  # (M,) True if the motion starts after a stop
+        "stopEnd",  # True if the block ends with a stop
+        "dwell",  # dwell time [min]
+        "length",
+        "rapidLength",
+        "time",
+        "margins",  # xmin, ymin, zmin, xmax, ymax, zmax
+        "startPoint",  # first non-rapid motion location or None
+        "state",  # machine state at the end of the block
+        "totalLength",
+        "totalTime",
+    )
+
+    # ----------------------------------------------------------------------
+    # Key of the block lines and the machine state cnc
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def makeKey(block, cnc):
+        state = tuple(
+            sorted(
+                (k, v)
+                for k, v in vars(cnc).items()
+                if k not in BlockGeometry.TOTALS
+            )
+        )
+        return (
+            len(block),
+            block.version(),
+            state,
+            CNC.feedmax_x,
+            CNC.vars.get("feedmode"),
+        )
+
+    # ----------------------------------------------------------------------
+    # Restore on block and cnc the side effects of computing the geometry
+    # ----------------------------------------------------------------------
+    def apply(self, block, cnc):
+        block.length = self.length
+        block.rapid = self.rapidLength
+        block.time = self.time
+        (block.xmin, block.ymin, block.zmin,
+         block.xmax, block.ymax, block.zmax) = self.margins
+        vars(cnc).update(self.state)
+        cnc.totalLength += self.totalLength
+        cnc.totalTime += self.totalTime
+        if self.startPoint is not None:
+            block.startPath(*self.startPoint)
+        block.endPath(cnc.x, cnc.y, cnc.z)
+        if self.margins[0] <= self.margins[3]:
+            cnc.pathMargins(block)
+
+
 # =============================================================================
 # Drawing canvas
 # =============================================================================
@@ -212,6 +296,9 @@ class CNCCanvas(Canvas):
         self.zoom = 1.0
         self.__tzoom = 1.0  # delayed zoom (temporary)
         self._items = {}
+        self._runs = {}  # merged items: (bid, lines, last point of line)
+        self._lodZoom = None  # zoom of the level of detail drawn
+        self._lodDropped = False  # if points were dropped
 
         self._x = self._y = 0
         self._xp = self._yp = 0
@@ -676,7 +763,7 @@ class CNCCanvas(Canvas):
                 items = []
                 for i in closest:
                     try:
-                        items.append(self._items[i])
+                        items.extend(self.itemLines(i))
                     except Exception:
                         pass
 
@@ -690,7 +777,8 @@ class CNCCanvas(Canvas):
                 items = []
                 for i in closest:
                     try:
-                        items.append(self._items[i])
+                        items.append(self.itemLine(
+                            i, self.canvasx(event.x), self.canvasy(event.y)))
                     except KeyError:
                         tags = self.gettags(i)
                         if "Orient" in tags:
@@ -750,12 +838,15 @@ class CNCCanvas(Canvas):
         # ... and if we are closer than 5pixels
         for item in self.find_closest(cx, cy, CLOSE_DISTANCE):
             try:
-                bid, lid = self._items[item]
+                bid, lid = self.itemLine(item, cx, cy)
             except KeyError:
                 continue
 
             # Very cheap and inaccurate approach :)
-            coords = self.coords(item)
+            if item in self._runs:
+                coords = self._lineCoords(item, lid)
+            else:
+                coords = self.coords(item)
             x = coords[0]  # first
             y = coords[1]  # point
             d = (cx - x) ** 2 + (cy - y) ** 2
@@ -888,6 +979,14 @@ class CNCCanvas(Canvas):
             self.itemconfig(self._probe, image=self._probeTkImage)
         self.cameraUpdate()
 
+        # Redraw with the level of detail of the new zoom
+        if LOD_PIXELS > 0.0 and self._lodZoom:
+            ratio = self.zoom / self._lodZoom
+            if (ratio >= LOD_ZOOM and self._lodDropped) or (
+                    ratio <= 1.0 / LOD_ZOOM):
+                self._lodZoom = None
+                self.event_generate("<<ViewChange>>")
+
     # ----------------------------------------------------------------------
     # Return selected objects bounding box
     # ----------------------------------------------------------------------
@@ -1038,13 +1137,27 @@ class CNCCanvas(Canvas):
             return
         block = self.gcode[b]
         item = block.path(i)
+        if item is not None and self._items.get(self._lastActive) == (b, i):
+            return
+        if item in self._runs:
+            item = self.lineItem(b, i)
 
         if item is not None and item != self._lastActive:
-            if self._lastActive is not None:
-                self.itemconfig(self._lastActive, arrow=NONE)
+            self._clearActive()
             self._lastActive = item
             self.itemconfig(self._lastActive, arrow=LAST)
 
+    # ----------------------------------------------------------------------
+    def _clearActive(self):
+        if self._lastActive is None:
+            return
+        if "overlay" in self.gettags(self._lastActive):
+            self._items.pop(self._lastActive, None)
+            self.delete(self._lastActive)
+        else:
+            self.itemconfig(self._lastActive, arrow=NONE)
+        self._lastActive = None
+
     # ----------------------------------------------------------------------
     # Display gantry
     # ----------------------------------------------------------------------
@@ -1091,9 +1204,10 @@ class CNCCanvas(Canvas):
     # Clear highlight of selection
     # ----------------------------------------------------------------------
     def clearSelection(self):
-        if self._lastActive is not None:
-            self.itemconfig(self._lastActive, arrow=NONE)
-            self._lastActive = None
+        self._clearActive()
+        for i in self.find_withtag("overlay"):
+            del self._items[i]
+        self.delete("overlay")
 
         for i in self.find_withtag("sel"):
             bid, lid = self._items[i]
@@ -1126,12 +1240,12 @@ class CNCCanvas(Canvas):
             if i is None:
                 sel = block.enable and "sel" or "sel2"
                 for path in block._path:
-                    if path is not None:
+                    if path:
                         self.addtag_withtag(sel, path)
                 sel = block.enable and "sel3" or "sel4"
 
             elif isinstance(i, int):
-                path = block.path(i)
+                path = self.lineItem(b, i)
                 if path:
                     sel = block.enable and "sel" or "sel2"
                     self.addtag_withtag(sel, path)
@@ -1447,6 +1561,7 @@ class CNCCanvas(Canvas):
         self._select = None
         self._vector = None
         self._items.clear()
+        self._runs.clear()
         self.cnc.initPath()
         self.cnc.resetAllMargins()
 
@@ -1752,16 +1867,20 @@ class CNCCanvas(Canvas):
 
         # Draw probe grid
         probe = self.gcode.probe
-        for x in bmath.frange(probe.xmin, probe.xmax + 0.00001, probe.xstep()):
-            xyz = [(x, probe.ymin, 0.0), (x, probe.ymax, 0.0)]
-            item = self.create_line(
-                self.plotCoords(xyz), tag="Probe", fill="Yellow")
-            self.tag_lower(item)
-
-        for y in bmath.frange(probe.ymin, probe.ymax + 0.00001, probe.ystep()):
-            xyz = [(probe.xmin, y, 0.0), (probe.xmax, y, 0.0)]
-            item = self.create_line(
-                self.plotCoords(xyz), tag="Probe", fill="Yellow")
+        xyz = [
+            p
+            for x in bmath.frange(
+                probe.xmin, probe.xmax + 0.00001, probe.xstep())
+            for p in ((x, probe.ymin, 0.0), (x, probe.ymax, 0.0))
+        ]
+        xyz.extend(
+            p
+            for y in bmath.frange(
+                probe.ymin, probe.ymax + 0.00001, probe.ystep())
+            for p in ((probe.xmin, y, 0.0), (probe.xmax, y, 0.0))
+        )
+        for ij in self.projectArray(xyz).reshape(-1, 4).tolist():
+            item = self.create_line(ij, tag="Probe", fill="Yellow")
             self.tag_lower(item)
 
         # Draw probe points
@@ -1903,143 +2022,390 @@ class CNCCanvas(Canvas):
                 block.resetPath()
             return
 
+        self._lodZoom = self.zoom
+        self._lodDropped = False
         try:
-            n = 1
-            startTime = before = time.time()
+            drawTime = 0.0
+            drawing = True
+            before = time.time()
             self.cnc.resetAllMargins()
-            drawG = self.draw_rapid or self.draw_paths or self.draw_margin
+            geometries = []
             for i, block in enumerate(self.gcode.blocks):
-                start = True  # start location found
                 block.resetPath()
-
-                # Draw block
-                for j, line in enumerate(block):
-                    n -= 1
-                    if n == 0:
-                        if time.time() - startTime > DRAW_TIME:
-                            raise AlarmException()
-                        # Force a periodic update since this loop can take time
-                        if time.time() - before > 1.0:
-                            self.update()
-                            before = time.time()
-                        n = 1000
-                    try:
-                        cmd = self.gcode.evaluate(
-                            CNC.compileLine(line), self.app)
-                        if isinstance(cmd, tuple):
-                            cmd = None
-                        else:
-                            cmd = CNC.breakLine(cmd)
-                    except AlarmException:
-                        raise
-                    except Exception:
-                        sys.stderr.write(
-                            _(">>> ERROR: {}\n").format(str(sys.exc_info()[1]))
-                        )
-                        sys.stderr.write(_("     line: {}\n").format(line))
-                        cmd = None
-                    if cmd is None or not drawG:
-                        block.addPath(None)
-                    else:
-                        path = self.drawPath(block, cmd)
-                        self._items[path] = i, j
-                        block.addPath(path)
-                        if start and self.cnc.gcode in (1, 2, 3):
-                            # Mark as start the first non-rapid motion
-                            block.startPath(self.cnc.x, self.cnc.y, self.cnc.z)
-                            start = False
-                block.endPath(self.cnc.x, self.cnc.y, self.cnc.z)
+                geometry = self.blockGeometry(block)
+                geometries.append(geometry)
+                if drawing:
+                    t = time.time()
+                    self.drawGeometry(i, block, geometry)
+                    drawTime += time.time() - t
+                    if drawTime > DRAW_TIME:
+                        # keep on computing the margins and statistics
+                        drawing = False
+                        self.status(
+                            "Rendering takes TOO Long. Interrupted...")
+                # Force a periodic update since this loop can take time
+                if time.time() - before > 1.0:
+                    self.update()
+                    before = time.time()
+            self.planTime(geometries)
         except AlarmException:
             self.status("Rendering takes TOO Long. Interrupted...")
 
     # ----------------------------------------------------------------------
-    # Create path for one g command
-    # ----------------------------------------------------------------------
-    def drawPath(self, block, cmds):
-        self.cnc.motionStart(cmds)
-        xyz = self.cnc.motionPath()
-        self.cnc.motionEnd()
-        if xyz:
-            self.cnc.pathLength(block, xyz)
-            if self.cnc.gcode in (1, 2, 3):
-                block.pathMargins(xyz)
-                self.cnc.pathMargins(block)
-            if block.enable:
-                if self.cnc.gcode == 0 and self.draw_rapid:
-                    xyz[0] = self._last
-                self._last = xyz[-1]
-            else:
-                if self.cnc.gcode == 0:
-                    return None
-            coords = self.plotCoords(xyz)
-            if coords:
-                if block.enable:
-                    if block.color:
-                        fill = block.color
-                    else:
-                        fill = ENABLE_COLOR
+    # Replace the time estimates of the blocks with the ones of the
+    # motion planner simulation over the motions of all the blocks
+    # ----------------------------------------------------------------------
+    def planTime(self, geometries):
+        blocks = self.gcode.blocks
+        nmotions = [len(g.lines) for g in geometries]
+        if sum(nmotions) == 0:
+            return
+        points = np.concatenate([g.points for g in geometries])
+        npoints = np.array([len(g.points) for g in geometries])
+        offset = np.repeat(np.cumsum(npoints) - npoints, nmotions)
+        start = np.append(
+            np.concatenate([g.start[:-1] for g in geometries]) + offset,
+            len(points))
+        feed = np.concatenate([g.feed for g in geometries])
+
+        # a stop at the end of a block holds the next motion
+        stops = []
+        pending = False
+        for g in geometries:
+            stop = g.stop
+            if pending and len(stop):
+                stop = stop.copy()
+                stop[0] = True
+                pending = False
+            stops.append(stop)
+            pending = pending or g.stopEnd
+        stop = np.concatenate(stops)
+
+        rate, accel, junction = CNC.machineLimits()
+        motionTime, limited = planner.plan(
+            points, start, feed, stop, rate, accel, junction)
+
+        bid = np.repeat(np.arange(len(geometries)), nmotions)
+        blockTime = np.bincount(
+            bid, weights=motionTime, minlength=len(geometries)).tolist()
+        total = 0.0
+        a = 0
+        for i, (block, geometry) in enumerate(zip(blocks, geometries)):
+            block.time = blockTime[i] + geometry.dwell
+            total += block.time
+            b = a + nmotions[i]
+            block.limited = geometry.lines[limited[a:b]].tolist()
+            a = b
+        self.cnc.totalTime = total
+
+    # ----------------------------------------------------------------------
+    # Return the geometry of the block, from the cache if the block and
+    # the machine state are the same as when it was computed
+    # ----------------------------------------------------------------------
+    def blockGeometry(self, block):
+        key = BlockGeometry.makeKey(block, self.cnc)
+        geometry = block._geometry
+        if geometry is not None and geometry.key == key:
+            geometry.apply(block, self.cnc)
+            return geometry
+
+        geometry = BlockGeometry()
+        geometry.key = key
+        geometry.startPoint = None
+        totalLength = self.cnc.totalLength
+        totalTime = self.cnc.totalTime
+        cacheable = True
+        paths = []
+        lines = []
+        rapid = []
+        cut = []
+        feed = []
+        stop = []
+        pending = False
+        geometry.dwell = 0.0
+        n = 1
+        before = time.time()
+        for j, line in enumerate(block):
+            n -= 1
+            if n == 0:
+                # Force a periodic update since this loop can take time
+                if time.time() - before > 1.0:
+                    self.update()
+                    before = time.time()
+                n = 1000
+            try:
+                cmd = block.compileLine(line)
+                if not isinstance(cmd, (str, tuple)) and cmd is not None:
+                    cacheable = False  # expressions may change
+                cmd = self.gcode.evaluate(cmd, self.app)
+                if isinstance(cmd, tuple):
+                    cmd = None
                 else:
-                    fill = DISABLE_COLOR
-                if self.cnc.gcode == 0:
-                    if self.draw_rapid:
-                        return self.create_line(coords, fill=fill,
-                                                width=0, dash=(4, 3))
-                elif self.draw_paths:
-                    return self.create_line(
-                        coords, fill=fill, width=0, cap="projecting"
-                    )
-        return None
+                    cmd = block.breakLine(cmd)
+            except AlarmException:
+                raise
+            except Exception:
+                sys.stderr.write(
+                    _(">>> ERROR: {}\n").format(str(sys.exc_info()[1]))
+                )
+                sys.stderr.write(_("     line: {}\n").format(line))
+                cmd = None
+                cacheable = False
+            if cmd is None:
+                continue
+
+            self.cnc.motionStart(cmd)
+            xyz = self.cnc.motionPath()
+            self.cnc.motionEnd()
+            if xyz:
+                self.cnc.pathLength(block, xyz)
+                paths.append(xyz)
+                lines.append(j)
+                rapid.append(self.cnc.gcode == 0)
+                cut.append(self.cnc.gcode in (1, 2, 3))
+                feed.append(self.motionFeed(xyz))
+                stop.append(pending)
+                pending = False
+            else:
+                for word in cmd:
+                    w = word[0].upper()
+                    if w == "G" and word[1:] in ("4", "04"):
+                        pending = True
+                        geometry.dwell += self.cnc.pval / 60.0
+                    elif (w == "M" and word[1:].isdigit()
+                          and int(word[1:]) in planner.SYNC_MCODES):
+                        pending = True
+            if geometry.startPoint is None and self.cnc.gcode in (1, 2, 3):
+                # Mark as start the first non-rapid motion
+                geometry.startPoint = (self.cnc.x, self.cnc.y, self.cnc.z)
+
+        count = np.array([len(xyz) for xyz in paths], dtype=int)
+        geometry.points = np.array(
+            [p for xyz in paths for p in xyz], dtype=float).reshape(-1, 3)
+        geometry.start = np.zeros(len(count) + 1, dtype=int)
+        np.cumsum(count, out=geometry.start[1:])
+        geometry.lines = np.array(lines, dtype=int)
+        geometry.rapid = np.array(rapid, dtype=bool)
+        geometry.feed = np.array(feed, dtype=float)
+        geometry.stop = np.array(stop, dtype=bool)
+        geometry.stopEnd = pending
+
+        cut = np.repeat(np.array(cut, dtype=bool), count)
+        if cut.any():
+            points = geometry.points[cut]
+            lo = points.min(axis=0).tolist()
+            hi = points.max(axis=0).tolist()
+            block.xmin = min(block.xmin, lo[0])
+            block.ymin = min(block.ymin, lo[1])
+            block.zmin = min(block.zmin, lo[2])
+            block.xmax = max(block.xmax, hi[0])
+            block.ymax = max(block.ymax, hi[1])
+            block.zmax = max(block.zmax, hi[2])
+            self.cnc.pathMargins(block)
+        block.endPath(self.cnc.x, self.cnc.y, self.cnc.z)
+        if geometry.startPoint is not None:
+            block.startPath(*geometry.startPoint)
+
+        geometry.length = block.length
+        geometry.rapidLength = block.rapid
+        geometry.time = block.time
+        geometry.margins = (block.xmin, block.ymin, block.zmin,
+                            block.xmax, block.ymax, block.zmax)
+        geometry.state = {
+            k: v
+            for k, v in vars(self.cnc).items()
+            if k not in BlockGeometry.TOTALS
+        }
+        geometry.totalLength = self.cnc.totalLength - totalLength
+        geometry.totalTime = self.cnc.totalTime - totalTime
+        block._geometry = geometry if cacheable else None
+        return geometry
+
+    # ----------------------------------------------------------------------
+    # Feed rate [units/min] of the current motion for the planner
+    # ----------------------------------------------------------------------
+    def motionFeed(self, xyz):
+        if self.cnc.gcode == 0:
+            return math.inf
+        if CNC.vars["feedmode"] == 93:
+            # inverse time, the motion lasts 1/F min
+            length = 0.0
+            for a, b in zip(xyz, xyz[1:]):
+                length += math.dist(a, b)
+            return length * self.cnc.feed
+        return self.cnc.feed
+
+    # ----------------------------------------------------------------------
+    # Create the canvas items of a block. Consecutive connected motions
+    # of the same kind are merged in a single item
+    # ----------------------------------------------------------------------
+    def drawGeometry(self, bid, block, geometry):
+        paths = [None] * len(block)
+        block.setPath(paths)
+        nmotions = len(geometry.lines)
+        if nmotions == 0:
+            return
+
+        points = geometry.points
+        start = geometry.start
+        rapid = geometry.rapid
+        if block.enable:
+            if self.draw_rapid:
+                # rapid motions start from the last drawn location
+                r = np.nonzero(rapid)[0]
+                if len(r):
+                    points = points.copy()
+                    last = np.empty((nmotions, 3))
+                    last[0] = self._last
+                    last[1:] = geometry.points[start[1:-1] - 1]
+                    points[start[r]] = last[r]
+                draw = np.ones(nmotions, dtype=bool)
+            else:
+                draw = ~rapid
+            self._last = tuple(points[-1].tolist())
+            if block.color:
+                fill = block.color
+            else:
+                fill = ENABLE_COLOR
+        else:
+            draw = ~rapid
+            fill = DISABLE_COLOR
+
+        motions = np.nonzero(draw)[0]
+        if len(motions) == 0:
+            return
+        count = start[motions + 1] - start[motions]
+
+        # a new polyline starts on a change of kind or on a jump
+        first = np.ones(len(motions), dtype=bool)
+        first[1:] = (
+            (rapid[motions[1:]] != rapid[motions[:-1]])
+            | np.any(points[start[motions[1:]]]
+                     != points[start[motions[:-1] + 1] - 1], axis=1)
+        )
+
+        # vertices of every polyline, the shared first point of a motion
+        # continuing the polyline is dropped
+        used = count - ~first
+        offset = start[motions] + ~first
+        end = np.cumsum(used)
+        vertices = (np.repeat(offset - (end - used), used)
+                    + np.arange(end[-1]))
+        ij = self.projectArray(points[vertices])
+
+        if LOD_PIXELS > 0.0:
+            # Level of detail: keep only the vertices moving to another
+            # cell of LOD_PIXELS size, and the ends of every polyline
+            cell = np.floor(ij / LOD_PIXELS)
+            keep = np.ones(len(ij), dtype=bool)
+            keep[1:] = np.any(cell[1:] != cell[:-1], axis=1)
+            keep[(end - used)[first]] = True
+            keep[end[np.append(first[1:], True)] - 1] = True
+            if not keep.all():
+                self._lodDropped = True
+                ij = ij[keep]
+                end = np.cumsum(keep)[end - 1]
+
+        # split in items of at most MERGE_POINTS points
+        head = first.copy()
+        head[1:] |= end[1:] // MERGE_POINTS != end[:-1] // MERGE_POINTS
+
+        coords = ij.ravel().tolist()
+        heads = np.nonzero(head)[0].tolist()
+        heads.append(len(motions))
+        first = first.tolist()
+        lids = geometry.lines[motions].tolist()
+        end = end.tolist()
+        for a, b in zip(heads[:-1], heads[1:]):
+            if a == 0:
+                pa = 0
+            elif first[a]:
+                pa = end[a - 1]
+            else:
+                pa = end[a - 1] - 1  # continue from the last point
+            xy = coords[2 * pa:2 * end[b - 1]]
+            if len(xy) < 4:
+                continue
+            if rapid[motions[a]]:
+                item = self.create_line(xy, fill=fill, width=0, dash=(4, 3))
+            else:
+                item = self.create_line(xy, fill=fill, width=0,
+                                        cap="projecting")
+            self._items[item] = bid, lids[a]
+            if b - a > 1:
+                self._runs[item] = (
+                    bid, lids[a:b], [e - pa - 1 for e in end[a:b]])
+            for lid in lids[a:b]:
+                paths[lid] = item
+
+    # ----------------------------------------------------------------------
+    # Return the (bid, lid) of every line drawn by a canvas item
+    # ----------------------------------------------------------------------
+    def itemLines(self, item):
+        run = self._runs.get(item)
+        if run is None:
+            return [self._items[item]]
+        bid, lids, last = run
+        return [(bid, lid) for lid in lids]
+
+    # ----------------------------------------------------------------------
+    # Return the (bid, lid) of the line of item closest to cx, cy
+    # ----------------------------------------------------------------------
+    def itemLine(self, item, cx, cy):
+        run = self._runs.get(item)
+        if run is None:
+            return self._items[item]
+        bid, lids, last = run
+        xy = np.array(self.coords(item)).reshape(-1, 2)
+        k = int(np.argmin((xy[:, 0] - cx) ** 2 + (xy[:, 1] - cy) ** 2))
+        # a vertex shared by two lines belongs to the earliest one
+        return bid, lids[min(int(np.searchsorted(last, k)), len(lids) - 1)]
+
+    # ----------------------------------------------------------------------
+    # Return the canvas coordinates drawing only line lid of item
+    # ----------------------------------------------------------------------
+    def _lineCoords(self, item, lid):
+        bid, lids, last = self._runs[item]
+        k = lids.index(lid)
+        a = last[k - 1] if k else 0
+        return self.coords(item)[2 * a: 2 * last[k] + 2]
+
+    # ----------------------------------------------------------------------
+    # Return a canvas item drawing only line lid of block bid,
+    # for merged items a temporary overlay item is created
+    # ----------------------------------------------------------------------
+    def lineItem(self, bid, lid):
+        path = self.gcode[bid].path(lid)
+        if path is None or path not in self._runs:
+            return path
+        coords = self._lineCoords(path, lid)
+        if len(coords) < 4:
+            return path
+        item = self.create_line(
+            coords,
+            fill=self.itemcget(path, "fill"),
+            dash=self.itemcget(path, "dash"),
+            width=0,
+            tags="overlay",
+        )
+        self._items[item] = bid, lid
+        return item
+
+    # ----------------------------------------------------------------------
+    # Project an (N,3) array of xyz points with the view and zoom
+    # @return (N,2) array of canvas coordinates clipped to MAXDIST.
+    #         Use .ravel().tolist() for the flat sequence Tk expects
+    # ----------------------------------------------------------------------
+    def projectArray(self, xyz):
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        ij = xyz @ (VIEW_MATRIX[self.view] * self.zoom)
+        return np.clip(ij, -MAXDIST, MAXDIST, out=ij)
 
     # ----------------------------------------------------------------------
-    # Return plotting coordinates for a 3d xyz path
-    #
-    # NOTE: Use the tkinter._flatten() to pass to self.coords() function
+    # Return plotting coordinates for a 3d xyz path as a list of [i, j]
     # ----------------------------------------------------------------------
     def plotCoords(self, xyz):
-        coords = None
-        if self.view == VIEW_XY:
-            coords = [(p[0] * self.zoom, -p[1] * self.zoom) for p in xyz]
-        elif self.view == VIEW_XZ:
-            coords = [(p[0] * self.zoom, -p[2] * self.zoom) for p in xyz]
-        elif self.view == VIEW_YZ:
-            coords = [(p[1] * self.zoom, -p[2] * self.zoom) for p in xyz]
-        elif self.view == VIEW_ISO1:
-            coords = [
-                (
-                    (p[0] * S60 + p[1] * S60) * self.zoom,
-                    (+p[0] * C60 - p[1] * C60 - p[2]) * self.zoom,
-                )
-                for p in xyz
-            ]
-        elif self.view == VIEW_ISO2:
-            coords = [
-                (
-                    (p[0] * S60 - p[1] * S60) * self.zoom,
-                    (-p[0] * C60 - p[1] * C60 - p[2]) * self.zoom,
-                )
-                for p in xyz
-            ]
-        elif self.view == VIEW_ISO3:
-            coords = [
-                (
-                    (-p[0] * S60 - p[1] * S60) * self.zoom,
-                    (-p[0] * C60 + p[1] * C60 - p[2]) * self.zoom,
-                )
-                for p in xyz
-            ]
-        # Check limits
-        for i, (x, y) in enumerate(coords):
-            if abs(x) > MAXDIST or abs(y) > MAXDIST:
-                if x < -MAXDIST:
-                    x = -MAXDIST
-                elif x > MAXDIST:
-                    x = MAXDIST
-                if y < -MAXDIST:
-                    y = -MAXDIST
-                elif y > MAXDIST:
-                    y = MAXDIST
-                coords[i] = (x, y)
-        return coords
+        return self.projectArray(xyz).tolist()
 
     # ----------------------------------------------------------------------
     # Canvas to real coordinates
@@ -2129,7 +2495,7 @@ class CanvasFrame(Frame):
         global BOX_SELECT, ENABLE_COLOR, DISABLE_COLOR, SELECT_COLOR
         global SELECT2_COLOR, PROCESS_COLOR, MOVE_COLOR, RULER_COLOR
         global CAMERA_COLOR, PROBE_TEXT_COLOR, CANVAS_COLOR
-        global DRAW_TIME
+        global DRAW_TIME, LOD_PIXELS
 
         self.draw_axes.set(bool(int(Utils.getBool("Canvas", "axes", True))))
         self.draw_grid.set(bool(int(Utils.getBool("Canvas", "grid", True))))
@@ -2142,6 +2508,7 @@ class CanvasFrame(Frame):
         self.view.set(Utils.getStr("Canvas", "view", VIEWS[0]))
 
         DRAW_TIME = Utils.getInt("Canvas", "drawtime", DRAW_TIME)
+        LOD_PIXELS = Utils.getFloat("Canvas", "lod", LOD_PIXELS)
 
         INSERT_COLOR = Utils.getStr("Color", "canvas.insert", INSERT_COLOR)
         GANTRY_COLOR = Utils.getStr("Color", "canvas.gantry", GANTRY_COLOR)
@@ -2163,6 +2530,7 @@ class CanvasFrame(Frame):
     # ----------------------------------------------------------------------
     def saveConfig(self):
         Utils.setInt("Canvas", "drawtime", DRAW_TIME)
+        Utils.setFloat("Canvas", "lod", LOD_PIXELS)
         Utils.setStr("Canvas", "view", self.view.get())
         Utils.setBool("Canvas", "axes", self.draw_axes.get())
         Utils.setBool("Canvas", "grid", self.draw_grid.get())
@@ -5,6 +5,7 @@
 
 import json
 import re
+from bisect import bisect_right
 from tkinter import (
     TclError,
     END,
@@ -21,14 +22,91 @@ COMMENT_COLOR = "Blue"
 DISABLE_COLOR = "Gray"
 
 MAXINT = 1000000000  # python3 doesn't have maxint
+WHEEL_UNITS = 4  # rows scrolled by a mouse wheel step
+
+
+# =============================================================================
+# Index of the rows of the list, the (bid, lid) item shown on every row.
+# Every shown block takes its header row followed by its lines when
+# expanded, so a row is found with a binary search on the prefix sums of
+# the rows of the blocks
+# =============================================================================
+class RowIndex:
+    def __init__(self):
+        self.bids = []  # blocks shown
+        self.starts = [0]  # row of the header of every shown block + total
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        del self.bids[:]
+        del self.starts[1:]
+
+    # ----------------------------------------------------------------------
+    def append(self, bid, rows):
+        self.bids.append(bid)
+        self.starts.append(self.starts[-1] + rows)
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return self.starts[-1]
+
+    # ----------------------------------------------------------------------
+    # @return (bid, lid) of row, lid is None for the header of the block
+    # ----------------------------------------------------------------------
+    def __getitem__(self, row):
+        total = self.starts[-1]
+        if row < 0:
+            row += total
+        if not 0 <= row < total:
+            raise IndexError("row index out of range")
+        k = bisect_right(self.starts, row) - 1
+        lid = row - self.starts[k] - 1
+        return self.bids[k], (lid if lid >= 0 else None)
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        for bid, start, end in zip(self.bids, self.starts, self.starts[1:]):
+            yield bid, None
+            for lid in range(end - start - 1):
+                yield bid, lid
 
 
 # =============================================================================
 # CNC Listbox
+#
+# The list is virtual: the rows, the selection and the active row live in
+# the RowIndex and a set of rows, and only the rows visible in the window
+# are inserted in the Tk listbox. All the index arguments of the Listbox
+# methods are rows of the whole list. The default Listbox bindings are
+# replaced, as they work on the inserted rows only
 # =============================================================================
 class CNCListbox(Listbox):
     def __init__(self, master, app, *kw, **kwargs):
         Listbox.__init__(self, master, *kw, **kwargs)
+        tags = list(self.bindtags())
+        tags[tags.index("Listbox")] = "CNCListbox"
+        self.bindtags(tuple(tags))
+        self.bind_class("CNCListbox", "<Configure>",
+                        lambda e: e.widget.refresh())
+        self.bind("<B1-Motion>", self.motion1)
+        self.bind("<Shift-Button-1>", self.shiftButton1)
+        self.bind("<Control-Button-1>", self.controlButton1)
+        self.bind("<Up>", lambda e: self.moveActive(-1))
+        self.bind("<Down>", lambda e: self.moveActive(1))
+        self.bind("<Shift-Up>", lambda e: self.moveActive(-1, True))
+        self.bind("<Shift-Down>", lambda e: self.moveActive(1, True))
+        self.bind("<Prior>", lambda e: self.scrollPage(-1))
+        self.bind("<Next>", lambda e: self.scrollPage(1))
+        self.bind("<Control-Key-Home>", lambda e: self.moveActive(-MAXINT))
+        self.bind("<Control-Key-End>", lambda e: self.moveActive(MAXINT))
+        self.bind("<Shift-Control-Key-Home>",
+                  lambda e: self.moveActive(-MAXINT, True))
+        self.bind("<Shift-Control-Key-End>",
+                  lambda e: self.moveActive(MAXINT, True))
+        self.bind("<Control-Key-slash>", self.selectAllEvent)
+        self.bind("<MouseWheel>", self.wheel)
+        self.bind("<Button-4>", lambda e: self.scrollUnits(-WHEEL_UNITS))
+        self.bind("<Button-5>", lambda e: self.scrollUnits(WHEEL_UNITS))
         self.bind("<Button-1>", self.button1)
         self.bind("<ButtonRelease-1>", self.release1)
         self.bind("<Double-1>", self.double)
@@ -58,7 +136,14 @@ class CNCListbox(Listbox):
         self.bind("<Control-Key-r>", self.fill)
 
         self._blockPos = []  # listbox position of each block
-        self._items = []  # each listbox lien which item (bid,lid) shows
+        self._items = RowIndex()  # which item (bid,lid) every row shows
+        self._selection = set()  # selected rows
+        self._active = 0  # active row
+        self._anchor = 0  # selection anchor row
+        self._base = set()  # selection before dragging
+        self._first = 0  # first row shown in the window
+        self._blank = None  # row of an empty line being inserted
+        self._yscrollcommand = None
         self.app = app
         self.gcode = app.gcode
         self.font = tkfont.nametofont(self.cget("font"))
@@ -97,11 +182,10 @@ class CNCListbox(Listbox):
         act = self.index(ACTIVE)
 
         items = self.getSelection()
-        self.delete(0, END)
+        self._selection.clear()
 
         del self._blockPos[:]
-        del self._items[:]
-        y = 0
+        self._items.clear()
         for bi, block in enumerate(self.gcode.blocks):
             if self.filter is not None:
                 if not (
@@ -114,28 +198,389 @@ class CNCListbox(Listbox):
                     self._blockPos.append(None)
                     continue
 
-            self._blockPos.append(y)
-            self.insert(END, block.header())
-            self._items.append((bi, None))
-            self.itemconfig(END, background=BLOCK_COLOR)
-            y += 1
-            if not block.enable:
-                self.itemconfig(END, foreground=DISABLE_COLOR)
-            if not block.expand:
-                continue
-
-            for lj, line in enumerate(block):
-                self.insert(END, line)
-                y += 1
-                if line and line[0] in ("(", "%"):
-                    self.itemconfig(END, foreground=COMMENT_COLOR)
-                self._items.append((bi, lj))
+            self._blockPos.append(len(self._items))
+            self._items.append(bi, 1 + len(block) if block.expand else 1)
 
         self.select(items)
         self.yview_moveto(ypos)
         self.activate(act)
         self.see(act)
 
+    # ----------------------------------------------------------------------
+    # Show again the rows of the window, after modifying lines in place
+    # ----------------------------------------------------------------------
+    def refresh(self, event=None):
+        size = self.size()
+        visible = self._visible()
+        self._first = max(0, min(self._first, size - visible))
+        first = self._first
+        last = min(size, first + visible + 1)
+
+        rows = []
+        colors = []  # (position, options) of the colored rows
+        for row in range(first, last):
+            item = self._item(row)
+            if item is None:
+                rows.append("")
+                continue
+            bid, lid = item
+            block = self.gcode.blocks[bid]
+            if lid is None:
+                if block.enable:
+                    colors.append((len(rows), {"background": BLOCK_COLOR}))
+                else:
+                    colors.append((len(rows), {"background": BLOCK_COLOR,
+                                               "foreground": DISABLE_COLOR}))
+                rows.append(block.header())
+            else:
+                line = block[lid]
+                if line and line[0] in ("(", "%"):
+                    colors.append((len(rows), {"foreground": COMMENT_COLOR}))
+                rows.append(line)
+
+        Listbox.delete(self, 0, END)
+        if rows:
+            Listbox.insert(self, END, *rows)
+        for pos, options in colors:
+            Listbox.itemconfig(self, pos, **options)
+        for row in range(first, last):
+            if row in self._selection:
+                Listbox.selection_set(self, row - first)
+        if first <= self._active < last:
+            Listbox.activate(self, self._active - first)
+        Listbox.yview_moveto(self, 0.0)
+        if self._yscrollcommand is not None:
+            self._yscrollcommand(*self.yview())
+
+    # ----------------------------------------------------------------------
+    # @return the item of a row, None for the empty line being inserted
+    # ----------------------------------------------------------------------
+    def _item(self, row):
+        if self._blank is not None:
+            if row == self._blank:
+                return None
+            if row > self._blank:
+                row -= 1
+        return self._items[row]
+
+    # ----------------------------------------------------------------------
+    # @return number of rows fitting in the window
+    # ----------------------------------------------------------------------
+    def _visible(self):
+        height = self.winfo_height()
+        if height <= 1:  # not mapped yet
+            return max(int(self.cget("height")), 1)
+        border = self.winfo_pixels(self.cget("borderwidth")) \
+            + self.winfo_pixels(self.cget("highlightthickness"))
+        row = self.font.metrics("linespace") + 1 \
+            + 2 * self.winfo_pixels(self.cget("selectborderwidth"))
+        return max((height - 2 * border) // row, 1)
+
+    # ----------------------------------------------------------------------
+    # @return position in the Tk listbox of row, None if not shown
+    # ----------------------------------------------------------------------
+    def _shown(self, row):
+        pos = row - self._first
+        if 0 <= pos < Listbox.size(self):
+            return pos
+        return None
+
+    # ----------------------------------------------------------------------
+    # Listbox methods working on the rows of the whole list
+    # ----------------------------------------------------------------------
+    def size(self):
+        return len(self._items) + (self._blank is not None)
+
+    # ----------------------------------------------------------------------
+    def index(self, index):
+        if index == ACTIVE:
+            return self._active
+        elif index == END:
+            return self.size()
+        elif isinstance(index, str) and index.startswith("@"):
+            return self.nearest(int(index.split(",")[1]))
+        return int(index)
+
+    # ----------------------------------------------------------------------
+    def nearest(self, y):
+        pos = Listbox.nearest(self, y)
+        if pos < 0:
+            return pos
+        return self._first + pos
+
+    # ----------------------------------------------------------------------
+    def bbox(self, index):
+        pos = self._shown(self.index(index))
+        if pos is None:
+            return None
+        return Listbox.bbox(self, pos)
+
+    # ----------------------------------------------------------------------
+    # @return the text of a row as shown, or a list of texts of the rows
+    # ----------------------------------------------------------------------
+    def get(self, first, last=None):
+        first = self.index(first)
+        if last is None:
+            pos = self._shown(first)
+            if pos is not None:
+                return Listbox.get(self, pos)
+            item = self._item(first)
+            if item is None:
+                return ""
+            bid, lid = item
+            block = self.gcode.blocks[bid]
+            return block.header() if lid is None else block[lid]
+        last = min(self.index(last), self.size() - 1)
+        return tuple(self.get(row) for row in range(first, last + 1))
+
+    # ----------------------------------------------------------------------
+    # Insert/delete only in the window, the rows are changed in gcode
+    # ----------------------------------------------------------------------
+    def insert(self, index, *elements):
+        pos = self.index(index) - self._first
+        if 0 <= pos <= Listbox.size(self):
+            Listbox.insert(self, pos, *elements)
+
+    # ----------------------------------------------------------------------
+    def delete(self, first, last=None):
+        pos = self._shown(self.index(first))
+        if pos is not None:
+            Listbox.delete(self, pos)
+
+    # ----------------------------------------------------------------------
+    def itemconfigure(self, index, cnf=None, **kw):
+        pos = self._shown(self.index(index))
+        if pos is not None:
+            return Listbox.itemconfigure(self, pos, cnf, **kw)
+
+    itemconfig = itemconfigure
+
+    # ----------------------------------------------------------------------
+    def activate(self, index):
+        self._active = max(0, min(self.index(index), self.size() - 1))
+        pos = self._shown(self._active)
+        if pos is not None:
+            Listbox.activate(self, pos)
+
+    # ----------------------------------------------------------------------
+    def see(self, index):
+        row = max(0, min(self.index(index), self.size() - 1))
+        visible = self._visible()
+        if row < self._first:
+            self._first = row
+        elif row >= self._first + visible:
+            self._first = row - visible + 1
+        else:
+            return
+        self.refresh()
+
+    # ----------------------------------------------------------------------
+    # @return the rows in the range first..last
+    # ----------------------------------------------------------------------
+    def _range(self, first, last):
+        first = max(self.index(first), 0)
+        if last is None:
+            last = first
+        else:
+            last = self.index(last)
+        return range(first, min(last, self.size() - 1) + 1)
+
+    # ----------------------------------------------------------------------
+    def selection_set(self, first, last=None):
+        rows = self._range(first, last)
+        self._selection.update(rows)
+        shown = self._shownRange(rows)
+        if shown:
+            Listbox.selection_set(self, shown.start, shown.stop - 1)
+
+    # ----------------------------------------------------------------------
+    def selection_clear(self, first, last=None):
+        rows = self._range(first, last)
+        if rows.start == 0 and rows.stop >= self.size():
+            self._selection.clear()
+        else:
+            self._selection.difference_update(rows)
+        shown = self._shownRange(rows)
+        if shown:
+            Listbox.selection_clear(self, shown.start, shown.stop - 1)
+
+    # ----------------------------------------------------------------------
+    # @return positions in the Tk listbox of the rows shown in the window
+    # ----------------------------------------------------------------------
+    def _shownRange(self, rows):
+        return range(max(rows.start - self._first, 0),
+                     min(rows.stop - self._first, Listbox.size(self)))
+
+    # ----------------------------------------------------------------------
+    def selection_includes(self, index):
+        return self.index(index) in self._selection
+
+    # ----------------------------------------------------------------------
+    def selection_anchor(self, index):
+        self._anchor = self.index(index)
+
+    # ----------------------------------------------------------------------
+    def curselection(self):
+        return tuple(sorted(self._selection))
+
+    select_set = selection_set
+    select_clear = selection_clear
+    select_includes = selection_includes
+    select_anchor = selection_anchor
+
+    # ----------------------------------------------------------------------
+    # Show the selection of the rows in the window
+    # ----------------------------------------------------------------------
+    def _showSelection(self):
+        Listbox.selection_clear(self, 0, END)
+        first = self._first
+        for pos in range(Listbox.size(self)):
+            if first + pos in self._selection:
+                Listbox.selection_set(self, pos)
+
+    # ----------------------------------------------------------------------
+    def yview(self, *args):
+        if not args:
+            size = self.size()
+            if size == 0:
+                return 0.0, 1.0
+            return (self._first / size,
+                    min(1.0, (self._first + self._visible()) / size))
+        if args[0] == "moveto":
+            self.yview_moveto(args[1])
+        elif args[0] == "scroll":
+            self.yview_scroll(args[1], args[2])
+
+    # ----------------------------------------------------------------------
+    def yview_moveto(self, fraction):
+        self._first = int(float(fraction) * self.size() + 0.5)
+        self.refresh()
+
+    # ----------------------------------------------------------------------
+    def yview_scroll(self, number, what="units"):
+        number = int(number)
+        if what == "pages":
+            number *= max(self._visible() - 1, 1)
+        self._first = max(self._first + number, 0)
+        self.refresh()
+
+    # ----------------------------------------------------------------------
+    # Keep the scroll command to report the position in the whole list
+    # ----------------------------------------------------------------------
+    def configure(self, cnf=None, **kw):
+        if isinstance(cnf, dict):
+            kw = {**cnf, **kw}
+            cnf = None
+        if "yscrollcommand" in kw:
+            self._yscrollcommand = kw.pop("yscrollcommand") or None
+            if cnf is None and not kw:
+                return None
+        return Listbox.configure(self, cnf, **kw)
+
+    config = configure
+
+    # ----------------------------------------------------------------------
+    # Selection with the mouse and the keyboard, replacing the default
+    # Listbox bindings for the EXTENDED select mode
+    # ----------------------------------------------------------------------
+    def _selectChanged(self):
+        self.event_generate("<<ListboxSelect>>")
+
+    # ----------------------------------------------------------------------
+    # Select only row and set it as anchor
+    # ----------------------------------------------------------------------
+    def _beginSelect(self, row):
+        self._selection.clear()
+        self._base = set()
+        self._anchor = row
+        self.selection_set(row)
+        self._selectChanged()
+
+    # ----------------------------------------------------------------------
+    # Select the rows from the anchor to row, on top of the base selection
+    # ----------------------------------------------------------------------
+    def _extendSelect(self, row):
+        if self._anchor >= self.size():
+            self._anchor = row
+        self._selection = set(self._base)
+        self._selection.update(
+            range(min(self._anchor, row), max(self._anchor, row) + 1))
+        self._showSelection()
+        self._selectChanged()
+
+    # ----------------------------------------------------------------------
+    def motion1(self, event):
+        if not self.size():
+            return "break"
+        if event.y < 0:
+            self.yview_scroll(-1)
+        elif event.y > self.winfo_height():
+            self.yview_scroll(1)
+        self._extendSelect(max(self.nearest(event.y), 0))
+        return "break"
+
+    # ----------------------------------------------------------------------
+    def shiftButton1(self, event):
+        if self.size():
+            self.focus_set()
+            self._base = set()
+            self._extendSelect(max(self.nearest(event.y), 0))
+        return "break"
+
+    # ----------------------------------------------------------------------
+    def controlButton1(self, event):
+        if not self.size():
+            return "break"
+        self.focus_set()
+        row = max(self.nearest(event.y), 0)
+        if row in self._selection:
+            self.selection_clear(row)
+        else:
+            self.selection_set(row)
+        self._anchor = row
+        self._base = set(self._selection)
+        self._selectChanged()
+        return "break"
+
+    # ----------------------------------------------------------------------
+    # Move the active row by delta rows, selecting it or extending the
+    # selection up to it
+    # ----------------------------------------------------------------------
+    def moveActive(self, delta, extend=False):
+        if not self.size():
+            return "break"
+        self.activate(self._active + delta)
+        self.see(ACTIVE)
+        if extend:
+            self._base = set()
+            self._extendSelect(self._active)
+        else:
+            self._beginSelect(self._active)
+        return "break"
+
+    # ----------------------------------------------------------------------
+    def scrollPage(self, pages):
+        self.yview_scroll(pages, "pages")
+        self.activate(self._first)
+        return "break"
+
+    # ----------------------------------------------------------------------
+    def selectAllEvent(self, event=None):
+        self.selectAll()
+        self._selectChanged()
+        return "break"
+
+    # ----------------------------------------------------------------------
+    def scrollUnits(self, units):
+        self.yview_scroll(units)
+        return "break"
+
+    # ----------------------------------------------------------------------
+    def wheel(self, event):
+        if abs(event.delta) >= 120:
+            return self.scrollUnits(-(event.delta // 120) * WHEEL_UNITS)
+        return self.scrollUnits(-event.delta)
+
     # ----------------------------------------------------------------------
     # Copy selected items to clipboard
     # ----------------------------------------------------------------------
@@ -379,10 +824,11 @@ class CNCListbox(Listbox):
         self.selection_clear(0, END)
         self.fill()
         # find location of new block
-        while active < self.size():
-            if self._items[active][0] == bid:
-                break
-            active += 1
+        active = self._blockPos[bid]
+        if active is None:
+            # hidden by the filter
+            self.winfo_toplevel().event_generate("<<Modified>>")
+            return
         self.selection_set(active)
         self.see(active)
         self.activate(active)
@@ -404,31 +850,27 @@ class CNCListbox(Listbox):
 
         active += 1
 
-        self.insert(active, "")
+        # show an empty row where the line is edited
         self.selection_clear(0, END)
+        self._blank = active
+        self.see(active)
+        self.refresh()
         self.activate(active)
         self.selection_set(active)
-        self.see(active)
 
         edit = tkExtra.InPlaceEdit(self, bg=self.cget("bg"))
-        ypos = self.yview()[0]
-        self.delete(active)
+        self._blank = None
+        self.selection_clear(0, END)
 
         if edit.value is None:
             # Cancel and leave
+            self.refresh()
             active -= 1
             self.activate(active)
             self.selection_set(active)
             self.see(active)
             return
 
-        self.insert(active, edit.value)
-        self.selection_set(active)
-        self.activate(active)
-        if edit.value and edit.value[0] in ("(", "%"):
-            self.itemconfig(active, foreground=COMMENT_COLOR)
-        self.yview_moveto(ypos)
-
         # Add line into code
 
         # Correct pointers
@@ -438,17 +880,8 @@ class CNCListbox(Listbox):
             lid += 1
         self.gcode.addUndo(self.gcode.insLineUndo(bid, lid, edit.value))
 
-        self._items.insert(active, (bid, lid))
-        for i in range(active + 1, len(self._items)):
-            b, li = self._items[i]
-            if b != bid:
-                break
-            if isinstance(li, int):
-                self._items[i] = (b, li + 1)
-        for i in range(bid + 1, len(self._blockPos)):
-            if self._blockPos[i] is not None:
-                self._blockPos[i] += 1  # shift all blocks below by one
-
+        self.fill()
+        self.select([(bid, lid)], clear=True)
         self.winfo_toplevel().event_generate("<<Modified>>")
 
     # ----------------------------------------------------------------------
@@ -487,6 +920,11 @@ class CNCListbox(Listbox):
         elif self._headerLocation(event) < 2 and selected:
             return "break"  # do not alter selection!
 
+        self.focus_set()
+        if self._ystart >= 0:
+            self._beginSelect(self._ystart)
+        return "break"
+
     # ----------------------------------------------------------------------
     # Release button-1. Warning on separation of double or single click or
     # click and drag
@@ -5,9 +5,12 @@
 
 import Utils
 
-try:
-    import cv2 as cv
-except ImportError:
+import lazy
+
+# opencv is slow to import, load it on the first use of the camera
+if lazy.available("cv2"):
+    cv = lazy.lazyImport("cv2")
+else:
     cv = None
 
 try:
@@ -8,10 +8,12 @@ import os
 import re
 import tempfile
 import threading
+import time
 import io
 
 import Camera
 from CNC import CNC
+from machine import AXES
 from Utils import prgpath
 
 import urllib.parse as urlparse
@@ -28,11 +30,130 @@ __email__ = "Vasilis.Vlachoudis@cern.ch"
 HOSTNAME = "localhost"
 port = 8080
 
+EVENTS_POLL = 0.1  # s, period checking the state for changes
+KEEPALIVE = 15.0  # s, longest silence on the /events stream
+IMAGE_PERIOD = 0.5  # s, age of the camera and canvas images shared by clients
+
+# Variables of the state sent to the pendant
+STATE = [
+    "controller",
+    "state",
+    "pins",
+    "color",
+    "msg",
+    "wx",
+    "wy",
+    "wz",
+    "wa",
+    "wb",
+    "wc",
+    "mx",
+    "my",
+    "mz",
+    "ma",
+    "mb",
+    "mc",
+    "G",
+    "OvFeed",
+    "OvRapid",
+    "OvSpindle",
+]
+
 httpd = None
+_imageLock = threading.Lock()
+_images = {}  # page: (time, image)
 webpath = f"{prgpath}/pendant"
 iconpath = f"{prgpath}/icons/"
 
 
+# -----------------------------------------------------------------------------
+# @return a copy of the state variables, with the position of the last
+#         record of the history of machine if any
+# -----------------------------------------------------------------------------
+def pendantState(machine=None):
+    state = {}
+    for name in STATE:
+        value = CNC.vars.get(name)
+        if isinstance(value, list):
+            value = value[:]
+        state[name] = value
+    if machine is not None and machine.history.count:
+        record = machine.history.last(1)[0]
+        for axis in AXES:
+            state[f"m{axis}"] = round(float(record[f"m{axis}"]), CNC.digits)
+            state[f"w{axis}"] = round(float(record[f"w{axis}"]), CNC.digits)
+    return state
+
+
+# -----------------------------------------------------------------------------
+# @return the image of page made with make(), shared by all the clients
+#         until it is older than IMAGE_PERIOD. The images are made one at
+#         a time, the camera and the canvas are not thread safe
+# -----------------------------------------------------------------------------
+def sharedImage(page, make):
+    with _imageLock:
+        t, image = _images.get(page, (0.0, None))
+        now = time.time()
+        if image is None or now - t > IMAGE_PERIOD:
+            image = make()
+            _images[page] = (now, image)
+        return image
+
+
+# =============================================================================
+# Publisher of the pendant state. A single thread looks for changes of
+# the state, and wakes up the /events clients only when it changes
+# =============================================================================
+class Events:
+    def __init__(self):
+        self.state = {}
+        self.version = 0
+        self.running = False
+        self.machine = None  # MachineState giving the position
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # ----------------------------------------------------------------------
+    def start(self, machine=None):
+        self.machine = machine
+        self.running = True
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+    # ----------------------------------------------------------------------
+    def _poll(self):
+        # a restart replaces the thread
+        while self.running and self._thread is threading.current_thread():
+            state = pendantState(self.machine)
+            if state != self.state:
+                with self._cond:
+                    self.state = state
+                    self.version += 1
+                    self._cond.notify_all()
+            time.sleep(EVENTS_POLL)
+
+    # ----------------------------------------------------------------------
+    # Wait for a version of the state different than version
+    # @return (version, state) the current version and state, unchanged
+    #         after the timeout or when stopped
+    # ----------------------------------------------------------------------
+    def wait(self, version, timeout):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.version != version or not self.running,
+                timeout)
+            return self.version, self.state
+
+
+events = Events()
+
+
 # =============================================================================
 # Simple Pendant controller for CNC
 # =============================================================================
@@ -94,35 +215,13 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
             self.wfile.write(b"")
 
         elif page == "/state":
-            tmp = {}
-            for name in [
-                "controller",
-                "state",
-                "pins",
-                "color",
-                "msg",
-                "wx",
-                "wy",
-                "wz",
-                "wa",
-                "wb",
-                "wc",
-                "mx",
-                "my",
-                "mz",
-                "ma",
-                "mb",
-                "mc",
-                "G",
-                "OvFeed",
-                "OvRapid",
-                "OvSpindle",
-            ]:
-                tmp[name] = CNC.vars[name]
-            contentToSend = json.dumps(tmp)
+            contentToSend = json.dumps(pendantState(httpd.app.machine))
             self.do_HEAD(200, content="text/text", cl=len(contentToSend))
             self.wfile.write(contentToSend.encode())
 
+        elif page == "/events":
+            self.sendEvents()
+
         elif page == "/config":
             snd = {}
             snd["rpmmax"] = httpd.app.get("CNC", "spindlemax")
@@ -145,13 +244,10 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
         elif page == "/canvas":
             if not Image:
                 return
-            ps = httpd.app.canvas.postscript(colormode="color")
             try:
-                with io.BytesIO() as out:
-                    Image.open(io.BytesIO(ps.encode('utf-8'))).save(out, "gif")
-                    self.do_HEAD(200, content="image/gif", cl=out.tell())
-                    out.seek(0)
-                    self.wfile.write(out.read())
+                img = sharedImage("canvas", Pendant.canvasImage)
+                self.do_HEAD(200, content="image/gif", cl=len(img))
+                self.wfile.write(img)
             except Exception:
                 filename = os.path.join(iconpath, "warn.gif")
                 try:
@@ -165,18 +261,13 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
         elif page == "/camera":
             if not Camera.hasOpenCV():
                 return
-            if Pendant.camera is None:
-                Pendant.camera = Camera.Camera("webcam")
-                if not Pendant.camera.start():
-                    Pendant.camera = None
-
-            if Pendant.camera.read():
-                try:
-                    img = Pendant.camera.jpg()
+            try:
+                img = sharedImage("camera", Pendant.cameraImage)
+                if img is not None:
                     self.do_HEAD(200, content="image/jpeg", cl=len(img))
                     self.wfile.write(img)
-                except Exception:
-                    pass
+            except Exception:
+                pass
 
         elif page == "/text.ngc":
             #Provide loaded g-code via web interface, so we can use nice webgl preview in the future
@@ -187,6 +278,58 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
         else:
             self.mainPage(page[1:])
 
+    # ----------------------------------------------------------------------
+    # @return the canvas as a gif image
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def canvasImage():
+        ps = httpd.app.canvas.postscript(colormode="color")
+        with io.BytesIO() as out:
+            Image.open(io.BytesIO(ps.encode("utf-8"))).save(out, "gif")
+            return out.getvalue()
+
+    # ----------------------------------------------------------------------
+    # @return a jpeg image of the camera, opened on first use, or None
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def cameraImage():
+        if Pendant.camera is None:
+            camera = Camera.Camera("webcam")
+            if not camera.start():
+                return None
+            Pendant.camera = camera
+        if not Pendant.camera.read():
+            return None
+        return Pendant.camera.jpg()
+
+    # ----------------------------------------------------------------------
+    # Server-Sent Events stream of the state. The first event carries the
+    # whole state, the next ones only the variables that changed
+    # ----------------------------------------------------------------------
+    def sendEvents(self):
+        self.do_HEAD(200, content="text/event-stream",
+                     headers_extra=[["Cache-Control", "no-cache"]])
+        self.close_connection = True
+        sent = {}
+        version = None
+        try:
+            while events.running:
+                version, state = events.wait(version, KEEPALIVE)
+                delta = {
+                    name: value
+                    for name, value in state.items()
+                    if name not in sent or sent[name] != value
+                }
+                if delta:
+                    self.wfile.write(f"data: {json.dumps(delta)}\n\n".encode())
+                    sent = state
+                else:
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+        except OSError:
+            # client disconnected
+            pass
+
     # ----------------------------------------------------------------------
     def deal_post_data(self):
         str_ok = True
@@ -314,10 +457,11 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
 # -----------------------------------------------------------------------------
 def _server(app):
     global httpd
-    server_class = httpserver.HTTPServer
+    server_class = httpserver.ThreadingHTTPServer
     try:
         httpd = server_class(("", port), Pendant)
         httpd.app = app
+        events.start(app.machine)
         httpd.serve_forever()
     except Exception:
         httpd = None
@@ -339,10 +483,14 @@ def stop():
     global httpd
     if httpd is None:
         return False
+    events.stop()
     httpd.shutdown()
     httpd = None
-    if Pendant.camera:
-        Pendant.camera.stop()
+    with _imageLock:
+        if Pendant.camera:
+            Pendant.camera.stop()
+            Pendant.camera = None
+        _images.clear()
     return True
 
 
@@ -12,17 +12,22 @@ import threading
 import time
 import traceback
 import webbrowser
+from collections import deque
 from datetime import datetime
 from tkinter import messagebox
 from queue import (
     Empty,
+    Full,
     Queue,
 )
 
 import Pendant
 import rexx
+import undo
+from machine import MachineState
+from ringlog import LogFile
 import Utils
-from CNC import CNC, MSG, UPDATE, WAIT, GCode
+from CNC import CNC, MSG, UPDATE, WAIT, GCode, PathMap
 
 __author__ = "Vasilis Vlachoudis"
 __email__ = "vvlachoudis@gmail.com"
@@ -38,6 +43,7 @@ SERIAL_POLL = 0.125  # s
 SERIAL_TIMEOUT = 0.10  # s
 G_POLL = 10  # s
 RX_BUFFER_SIZE = 128
+QUEUE_SIZE = 1000  # compiled lines waiting to be sent while running
 
 GPAT = re.compile(r"[A-Za-z]\s*[-+]?\d+.*")
 FEEDPAT = re.compile(r"^(.*)[fF](\d+\.?\d+)(.*)$")
@@ -68,6 +74,57 @@ STATECOLOR = {
 }
 
 
+# =============================================================================
+# Character counting flow control of the controller RX buffer.
+# Keeps the lines sent but not yet acknowledged together with a running
+# total of their characters, so that no per line summation is needed
+# =============================================================================
+class RxBuffer:
+    def __init__(self, size=RX_BUFFER_SIZE):
+        self.size = size
+        self._lines = deque()
+        self.used = 0  # characters in flight
+
+    # ----------------------------------------------------------------------
+    def append(self, line):
+        self._lines.append(line)
+        self.used += len(line)
+
+    # ----------------------------------------------------------------------
+    # Remove the oldest line when acknowledged by the controller
+    # @return the line or None if the buffer is empty
+    # ----------------------------------------------------------------------
+    def pop(self):
+        if not self._lines:
+            return None
+        line = self._lines.popleft()
+        self.used -= len(line)
+        return line
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        self._lines.clear()
+        self.used = 0
+
+    # ----------------------------------------------------------------------
+    # @return True if the controller has room for the pending lines
+    # ----------------------------------------------------------------------
+    def hasRoom(self):
+        return self.used < self.size
+
+    # ----------------------------------------------------------------------
+    # @return buffer fill in percent
+    # ----------------------------------------------------------------------
+    def fill(self):
+        return self.used * 100.0 / self.size
+
+    # ----------------------------------------------------------------------
+    # Number of lines in flight
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self._lines)
+
+
 # =============================================================================
 # bCNC Sender class
 # =============================================================================
@@ -81,6 +138,16 @@ class Sender:
     MSG_ERROR = 4  # error message or exception
     MSG_RUNEND = 5  # run ended
     MSG_CLEAR = 6  # clear buffer
+    # Tags of the messages in the session log file
+    MSG_TAG = {
+        MSG_BUFFER: ">",
+        MSG_SEND: "=",
+        MSG_RECEIVE: "<",
+        MSG_OK: "<",
+        MSG_ERROR: "!",
+        MSG_RUNEND: "#",
+        MSG_CLEAR: "-",
+    }
 
     def __init__(self):
         # Global variables
@@ -95,13 +162,15 @@ class Sender:
         self.gcode = GCode(self)
 
         self.cnc = self.gcode.cnc
+        self.machine = MachineState()  # last status reports and history
 
         self.log = Queue()  # Log queue returned from GRBL
-        self.queue = Queue()  # Command queue to be send to GRBL
+        self.logFile = None  # Session log file of the log queue
+        self.queue = Queue(QUEUE_SIZE)  # Command queue to be send to GRBL
         self.pendant = Queue()  # Command queue to be executed from Pendant
         self.serial = None
         self.thread = None
-        
+        self.streamThread = None  # thread compiling the running program
         # BLTouc
         self.blt_serial = None
 
@@ -119,7 +188,9 @@ class Sender:
         self._pause = False  # machine is on Hold
         self._alarm = True  # Display alarm message if true
         self._msg = None
-        self._sumcline = 0
+        self.rxbuf = RxBuffer()  # lines sent and not yet acknowledged
+        self._sioCond = threading.Condition()  # serial threads bookkeeping
+        self._serialLock = threading.Lock()  # serialize writes to the port
         self._lastFeed = 0
         self._newFeed = 0
 
@@ -155,12 +226,24 @@ class Sender:
     def quit(self, event=None):
         self.saveConfig()
         Pendant.stop()
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
 
     # ----------------------------------------------------------------------
     def loadConfig(self):
         self.controllerSet(Utils.getStr("Connection", "controller"))
         Pendant.port = Utils.getInt("Connection", "pendantport", Pendant.port)
         GCode.LOOP_MERGE = Utils.getBool("File", "dxfloopmerge")
+        GCode.PACK_LINES = Utils.getBool("File", "packlines")
+        undo.UndoRedo.LIMIT = Utils.getInt("File", "undomemory", 256) << 20
+        logfile = Utils.getStr("Connection", "logfile")
+        if logfile and self.logFile is None:
+            try:
+                self.logFile = LogFile(os.path.expanduser(logfile))
+            except OSError:
+                typ, val, tb = sys.exc_info()
+                traceback.print_exception(typ, val, tb)
         self.loadHistory()
 
     # ----------------------------------------------------------------------
@@ -479,11 +562,10 @@ class Sender:
     # Serial write
     # ----------------------------------------------------------------------
     def serial_write(self, data):
-        if isinstance(data, bytes):
-            ret = self.serial.write(data)
-        else:
-            ret = self.serial.write(data.encode())
-        return ret
+        if not isinstance(data, bytes):
+            data = data.encode()
+        with self._serialLock:
+            return self.serial.write(data)
 
     # ----------------------------------------------------------------------
     # Open serial port
@@ -695,6 +777,77 @@ class Sender:
             except Empty:
                 break
 
+    # ----------------------------------------------------------------------
+    # Start streaming (line, path) pairs from a compile generator into the
+    # bounded send queue. The worker blocks whenever the queue is full, so
+    # lines are compiled only as fast as the controller consumes them.
+    # ----------------------------------------------------------------------
+    def streamRun(self, lines):
+        self._paths = PathMap()
+        self.streamThread = threading.Thread(
+            target=self._streamIO, args=(lines,))
+        self.streamThread.daemon = True
+        self.streamThread.start()
+
+    # ----------------------------------------------------------------------
+    # Put an item in the send queue, waiting while it is full
+    # @return False if the run was stopped or the connection closed
+    # ----------------------------------------------------------------------
+    def _streamPut(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=SERIAL_POLL)
+                return True
+            except Full:
+                if self._stop or self.serial is None:
+                    return False
+
+    # ----------------------------------------------------------------------
+    # thread compiling and queuing the lines of the running program
+    # ----------------------------------------------------------------------
+    def _streamIO(self, lines):
+        paths = self._paths
+        aborted = False
+        n = 0
+        try:
+            for line, path in lines:
+                paths.append(path)
+                if line is None:
+                    continue
+                if isinstance(line, str):
+                    line += "\n"
+                if not self._streamPut(line):
+                    aborted = True
+                    break
+                n += 1
+        except Exception:
+            for s in str(sys.exc_info()[1]).splitlines():
+                self.log.put((Sender.MSG_ERROR, s))
+            aborted = True
+
+        if not aborted and n > 0:
+            # wait at the end to become idle
+            aborted = not self._streamPut((WAIT,))
+        if not aborted:
+            # set it at the end to be sure that all lines are queued.
+            # stopRun checks it under the same lock, so a stop is either
+            # seen here or purged by stopRun
+            with self._sioCond:
+                aborted = self._stop
+                if not aborted and n > 0:
+                    self._runLines = n + 1
+
+        if aborted:
+            self.emptyQueue()
+            if self.serial is not None:
+                self.purgeController()
+            else:
+                self.runEnded()
+        elif n == 0:
+            self.runEnded()
+            self._update = "empty"
+        self.streamThread = None
+
     # ----------------------------------------------------------------------
     def stopProbe(self):
         if self.gcode.probe.start:
@@ -702,13 +855,13 @@ class Sender:
 
     # ----------------------------------------------------------------------
     def getBufferFill(self):
-        return self._sumcline * 100.0 / RX_BUFFER_SIZE
+        return self.rxbuf.fill()
 
     # ----------------------------------------------------------------------
     def initRun(self):
         self._quit = 0
         self._pause = False
-        self._paths = None
+        self._paths = PathMap()
         self.running = True
         self.disable()
         self.emptyQueue()
@@ -720,6 +873,13 @@ class Sender:
     def runEnded(self):
         if self.running:
             self.log.put((Sender.MSG_RUNEND, _("Run ended")))
+            stats = self.gcode.fitStats
+            if stats is not None and stats.lines:
+                self.log.put((Sender.MSG_RUNEND,
+                              _("Fitted {} lines to {} ({} arcs), "
+                                "estimated time saved {:.1f} s").format(
+                                  stats.lines, stats.fitted, stats.arcs,
+                                  stats.savedTime() * 60.0)))
             self.log.put((Sender.MSG_RUNEND, str(datetime.now())))
             self.log.put((Sender.MSG_RUNEND, str(CNC.vars["msg"])))
             if self._onStop:
@@ -739,9 +899,12 @@ class Sender:
     # ----------------------------------------------------------------------
     def stopRun(self, event=None):
         self.feedHold()
-        self._stop = True
-        # if we are in the process of submitting do not do anything
-        if self._runLines != sys.maxsize:
+        with self._sioCond:
+            self._stop = True
+            # if we are in the process of submitting do not do anything,
+            # the streaming thread purges the controller
+            purge = self._runLines != sys.maxsize
+        if purge:
             self.purgeController()
 
     # ----------------------------------------------------------------------
@@ -772,154 +935,203 @@ class Sender:
             self.jobDone()
 
     # ----------------------------------------------------------------------
-    # thread performing I/O on serial line
+    # thread performing the output on the serial line. It sleeps until a
+    # command is queued or the reader signals room in the controller buffer
     # ----------------------------------------------------------------------
     def serialIO(self):
         # wait for commands to complete (status change to Idle)
         self.sio_wait = False
         self.sio_status = False  # waiting for status <...> report
-        cline = []  # length of pipeline commands
-        sline = []  # pipeline commands
+        rxbuf = self.rxbuf  # pipeline commands
+        rxbuf.clear()
+        cond = self._sioCond
         tosend = None  # next string to send
-        tr = tg = time.time()  # last time a ? or $G was send to grbl
-
-        while self.thread:
-            t = time.time()
-            # refresh machine position?
-            if t - tr > SERIAL_POLL:
-                self.mcontrol.viewStatusReport()
-                tr = t
-
-                # If Override change, attach feed
-                if CNC.vars["_OvChanged"]:
-                    self.mcontrol.overrideSet()
+        tg = time.time()  # last time a $G was send to grbl
+
+        # the threads of this connection end once it is closed, even if
+        # another one is opened meanwhile
+        owner = threading.current_thread()
+        for target, args in ((self._serialRead, (owner, self.serial)),
+                             (self._serialPoll, (owner,))):
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+
+        while self.thread is owner:
+            # Received external message to stop
+            if self._stop:
+                self.emptyQueue()
+                tosend = None
+                self.log.put((Sender.MSG_CLEAR, ""))
+                # WARNING if runLines==maxint then it means we are
+                # still preparing/sending lines from from bCNC.run(),
+                # so don't stop
+                if self._runLines != sys.maxsize:
+                    self._stop = False
 
             # Fetch new command to send if...
-            if (
-                tosend is None
-                and not self.sio_wait
-                and not self._pause
-                and self.queue.qsize() > 0
-            ):
+            if tosend is None:
+                if self.sio_wait or self._pause:
+                    with cond:
+                        cond.wait(SERIAL_POLL)
+                    continue
                 try:
-                    tosend = self.queue.get_nowait()
-                    if isinstance(tosend, tuple):
-                        # wait to empty the grbl buffer and status is Idle
-                        if tosend[0] == WAIT:
-                            # Don't count WAIT until we are idle!
-                            self.sio_wait = True
-                        elif tosend[0] == MSG:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            if tosend[1] is not None:
-                                # show our message on machine status
-                                self._msg = tosend[1]
-                        elif tosend[0] == UPDATE:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            self._update = tosend[1]
-                        else:
-                            # Count executed commands as well
-                            self._gcount += 1
-                        tosend = None
-
-                    elif not isinstance(tosend, str):
-                        try:
-                            tosend = self.gcode.evaluate(tosend, self)
-                            if isinstance(tosend, str):
-                                tosend += "\n"
-                            else:
-                                # Count executed commands as well
-                                self._gcount += 1
-                        except Exception:
-                            for s in str(sys.exc_info()[1]).splitlines():
-                                self.log.put((Sender.MSG_ERROR, s))
-                            self._gcount += 1
-                            tosend = None
+                    tosend = self.queue.get(timeout=SERIAL_POLL)
                 except Empty:
-                    break
-
-                if tosend is not None:
-                    # All modification in tosend should be
-                    # done before adding it to cline
-
-                    # Keep track of last feed
-                    pat = FEEDPAT.match(tosend)
-                    if pat is not None:
-                        self._lastFeed = pat.group(2)
-
-                    # Modify sent g-code to reflect overridden feed for
-                    # controllers without override support
-                    if not self.mcontrol.has_override:
-                        if CNC.vars["_OvChanged"]:
-                            CNC.vars["_OvChanged"] = False
-                            self._newFeed = (
-                                float(self._lastFeed) * CNC.vars["_OvFeed"] / 100.0
-                            )
-                            if (
-                                pat is None
-                                and self._newFeed != 0
-                                and not tosend.startswith("$")
-                            ):
-                                tosend = f"f{self._newFeed:g}{tosend}"
-
-                        # Apply override Feed
-                        if CNC.vars["_OvFeed"] != 100 and self._newFeed != 0:
-                            pat = FEEDPAT.match(tosend)
-                            if pat is not None:
-                                try:
-                                    tosend = "{}f{:g}{}\n".format(
-                                        pat.group(1),
-                                        self._newFeed,
-                                        pat.group(3),
-                                    )
-                                except Exception:
-                                    pass
+                    continue
 
+                with cond:
+                    tosend = self._prepareSend(tosend)
+                    if tosend is None:
+                        continue
                     # Bookkeeping of the buffers
-                    sline.append(tosend)
-                    cline.append(len(tosend))
+                    rxbuf.append(tosend)
 
-            # Anything to receive?
-            if self.serial.inWaiting() or tosend is None:
-                try:
-                    line = str(self.serial.readline().decode("ascii", "ignore")).strip()
-                except Exception:
-                    self.log.put((Sender.MSG_RECEIVE, str(sys.exc_info()[1])))
-                    self.emptyQueue()
-                    self.close()
-                    return
+            with cond:
+                if not rxbuf.hasRoom():
+                    # woken up by the reader on every acknowledged line
+                    cond.wait(SERIAL_POLL)
+                    continue
 
-                if not line:
-                    pass
-                elif self.mcontrol.parseLine(line, cline, sline):
-                    pass
+            if self.mcontrol.gcode_case > 0:
+                tosend = tosend.upper()
+            if self.mcontrol.gcode_case < 0:
+                tosend = tosend.lower()
+
+            self.serial_write(tosend)
+
+            self.log.put((Sender.MSG_BUFFER, tosend))
+
+            tosend = None
+            t = time.time()
+            if not self.running and t - tg > G_POLL:
+                self.mcontrol.viewState()
+                tg = t
+
+    # ----------------------------------------------------------------------
+    # Process a command fetched from the queue before sending it
+    # @return the string to send or None if nothing has to be sent
+    # ----------------------------------------------------------------------
+    def _prepareSend(self, tosend):
+        if isinstance(tosend, tuple):
+            # wait to empty the grbl buffer and status is Idle
+            if tosend[0] == WAIT:
+                # Don't count WAIT until we are idle!
+                self.sio_wait = True
+            elif tosend[0] == MSG:
+                # Count executed commands as well
+                self._gcount += 1
+                if tosend[1] is not None:
+                    # show our message on machine status
+                    self._msg = tosend[1]
+            elif tosend[0] == UPDATE:
+                # Count executed commands as well
+                self._gcount += 1
+                self._update = tosend[1]
+            else:
+                # Count executed commands as well
+                self._gcount += 1
+            return None
+
+        elif not isinstance(tosend, str):
+            try:
+                tosend = self.gcode.evaluate(tosend, self)
+                if isinstance(tosend, str):
+                    tosend += "\n"
                 else:
-                    self.log.put((Sender.MSG_RECEIVE, line))
+                    # Count executed commands as well
+                    self._gcount += 1
+                    return None
+            except Exception:
+                for s in str(sys.exc_info()[1]).splitlines():
+                    self.log.put((Sender.MSG_ERROR, s))
+                self._gcount += 1
+                return None
+
+        # All modification in tosend should be
+        # done before adding it to rxbuf
+
+        # Keep track of last feed
+        pat = FEEDPAT.match(tosend)
+        if pat is not None:
+            self._lastFeed = pat.group(2)
+
+        # Modify sent g-code to reflect overridden feed for
+        # controllers without override support
+        if not self.mcontrol.has_override:
+            if CNC.vars["_OvChanged"]:
+                CNC.vars["_OvChanged"] = False
+                self._newFeed = (
+                    float(self._lastFeed) * CNC.vars["_OvFeed"] / 100.0
+                )
+                if (
+                    pat is None
+                    and self._newFeed != 0
+                    and not tosend.startswith("$")
+                ):
+                    tosend = f"f{self._newFeed:g}{tosend}"
+
+            # Apply override Feed
+            if CNC.vars["_OvFeed"] != 100 and self._newFeed != 0:
+                pat = FEEDPAT.match(tosend)
+                if pat is not None:
+                    try:
+                        tosend = "{}f{:g}{}\n".format(
+                            pat.group(1),
+                            self._newFeed,
+                            pat.group(3),
+                        )
+                    except Exception:
+                        pass
+        return tosend
 
-            # Received external message to stop
-            if self._stop:
+    # ----------------------------------------------------------------------
+    # thread reading the serial line. The read blocks until data arrive,
+    # every line is parsed and the output thread is woken up
+    # @param owner serialIO thread of the connection
+    # @param port serial port of the connection
+    # ----------------------------------------------------------------------
+    def _serialRead(self, owner, port):
+        cond = self._sioCond
+        while self.thread is owner:
+            try:
+                line = str(port.readline().decode("ascii", "ignore")).strip()
+            except Exception:
+                if self.thread is not owner:
+                    return  # port closed
+                self.log.put((Sender.MSG_RECEIVE, str(sys.exc_info()[1])))
                 self.emptyQueue()
-                tosend = None
-                self.log.put((Sender.MSG_CLEAR, ""))
-                # WARNING if runLines==maxint then it means we are
-                # still preparing/sending lines from from bCNC.run(),
-                # so don't stop
-                if self._runLines != sys.maxsize:
-                    self._stop = False
+                self.close()
+                return
 
-            if tosend is not None and sum(cline) < RX_BUFFER_SIZE:
-                self._sumcline = sum(cline)
-                if self.mcontrol.gcode_case > 0:
-                    tosend = tosend.upper()
-                if self.mcontrol.gcode_case < 0:
-                    tosend = tosend.lower()
+            if not line or self.thread is not owner:
+                continue
+            with cond:
+                if not self.mcontrol.parseLine(line, self.rxbuf):
+                    self.log.put((Sender.MSG_RECEIVE, line))
+                cond.notify_all()
 
-                self.serial_write(tosend)
+    # ----------------------------------------------------------------------
+    # thread requesting the status report from the controller at a fixed
+    # rate, independent of the traffic on the serial line
+    # @param owner serialIO thread of the connection
+    # ----------------------------------------------------------------------
+    def _serialPoll(self, owner):
+        tr = time.time()  # next time a ? is send to grbl
+        while self.thread is owner:
+            tr += SERIAL_POLL
+            delay = tr - time.time()
+            if delay > 0.0:
+                time.sleep(delay)
+            else:
+                tr -= delay  # fell behind, do not try to catch up
+            if self.thread is not owner:
+                break
 
-                self.log.put((Sender.MSG_BUFFER, tosend))
+            # refresh machine position
+            with self._sioCond:
+                self.mcontrol.viewStatusReport()
 
-                tosend = None
-                if not self.running and t - tg > G_POLL:
-                    self.mcontrol.viewState()
-                    tg = t
+            # If Override change, attach feed
+            if CNC.vars["_OvChanged"]:
+                self.mcontrol.overrideSet()
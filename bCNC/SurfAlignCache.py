@@ -0,0 +1,117 @@
+# Content addressed on-disk cache of the SurfAlign engraving toolpaths
+#
+# Generating the text toolpath means a full Blender round trip, while the
+# same text/font/parameters combination is requested again and again.
+# The resulting .tap program is stored under the hash of every parameter
+# and the bytes of the font file, the least recently used entries are
+# evicted once the cache grows over its size cap.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Bump when the generation in SurfAlignUtils changes its output
+CACHE_VERSION = 1
+CACHE_EXT = ".tap"
+CACHE_DIR = os.path.expanduser("~/.bCNC-cache/surfalign")
+CACHE_SIZE = 64  # MB
+
+
+class ToolpathCache:
+    """
+    Directory of generated .tap programs named after their key.
+    The modification time of every entry is its last use time.
+    """
+
+    def __init__(self, path=None, size=CACHE_SIZE):
+        self.path = path or CACHE_DIR
+        self.size = int(size * 1024 * 1024)
+
+    def key(self, font_path, **params):
+        """
+        Return the hash of the generation parameters and the font file.
+        Missing or unreadable fonts are hashed by their name only.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([CACHE_VERSION, params], sort_keys=True,
+                            default=repr).encode())
+        h.update(repr(font_path).encode())
+        if font_path:
+            try:
+                with open(font_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b""):
+                        h.update(chunk)
+            except OSError:
+                pass
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + CACHE_EXT)
+
+    def get(self, key, dest):
+        """
+        Copy the cached program of key to dest.
+        :return: dest on a hit, None on a miss
+        """
+        filename = self._file(key)
+        try:
+            shutil.copyfile(filename, dest)
+            os.utime(filename)
+        except OSError:
+            return None
+        return dest
+
+    def put(self, key, src):
+        """Store the program src under key and evict old entries"""
+        if not os.path.isfile(src):
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+            os.close(fd)
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, self._file(key))
+        except OSError as e:
+            print(f"Toolpath cache store failed: {e}")
+            return
+        self.evict()
+
+    def entries(self):
+        """Return the list of (mtime, size, filename) oldest first"""
+        entries = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if not entry.name.endswith(CACHE_EXT):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries above the size cap"""
+        entries = self.entries()
+        total = sum(size for mtime, size, filename in entries)
+        for mtime, size, filename in entries:
+            if total <= self.size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for mtime, size, filename in self.entries():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
@@ -10,6 +10,7 @@ import sys
 import time
 import winreg
 import re
+import traceback
 from tkinter import (
     YES,
     N,
@@ -60,7 +61,8 @@ import tkExtra
 import Utils
 from CNC import CNC, Block
 import os
-from SurfAlignUtils import setup_blender_scene
+from SurfAlignCache import ToolpathCache, CACHE_SIZE
+from SurfAlignWorker import worker
 from Helpers import N_
 import tkinter.font as tkFont 
 from tkinter import ttk
@@ -68,7 +70,9 @@ import threading
 from tkinter import Tk, font
 import tkinter
 import tkinter as tk
-from fontTools.ttLib import TTFont
+import lazy
+
+ttLib = lazy.lazyImport("fontTools.ttLib")
 
 __author__ = Utils.__author__
 __email__ = Utils.__email__
@@ -115,6 +119,8 @@ CAMERA_LOCATION_ORDER = [
     "Bottom-Right",
 ]
 
+GENERATE_POLL = 100  # ms between checks of the background generation
+
 
 # =============================================================================
 # Probe Tab Group
@@ -366,7 +372,7 @@ class GenGcodeFrame(CNCRibbon.PageFrame):
     
     def get_font_name_style(self, font_path):
         try:
-            font = TTFont(font_path, lazy=True)
+            font = ttLib.TTFont(font_path, lazy=True)
             name = ""
             subfamily = ""
             for record in font["name"].names:
@@ -430,6 +436,7 @@ class GenGcodeFrame(CNCRibbon.PageFrame):
 
     def __init__(self, master, app):
         CNCRibbon.PageFrame.__init__(self, master, "GenGcode", app)
+        self._generated = None
 
         lframe = tkExtra.ExLabelFrame(
             self, text=_("GCode"), foreground="DarkBlue")
@@ -763,6 +770,7 @@ class GenGcodeFrame(CNCRibbon.PageFrame):
         work_area_width, work_area_height = 500, 500
         if self.font_var.get() == "":
             text_font = None
+            font_path = None
         else:
             text_font = self.font_var.get()
             font_path = self.all_font_dict.get(text_font)
@@ -785,42 +793,78 @@ class GenGcodeFrame(CNCRibbon.PageFrame):
         spindle_rpm = float(self.spindleRPM.get())
         gap_distance_mm = float(self.gapDistance.get())
         
-        try:
-            gcode_file_path = setup_blender_scene(engrave_text,
-                                                  font_path,
-                                                   text_font_size,
-                                                   text_position_mm,
-                                                   rotation_degrees,
-                                                   layer_height_mm,
-                                                   safe_height_mm,
-                                                   save_dir,
-                                                   feedrate_mm,
-                                                   spindle_rpm,
-                                                   final_height_mm,
-                                                   work_area_width,
-                                                   work_area_height,
-                                                   gap_distance_mm)
-            
-            print("Generated Gcode file path:", gcode_file_path)
-            
-            # Check if the file was actually created
-            if not os.path.exists(gcode_file_path):
-                messagebox.showerror(_("GCode Generation Error"), 
-                                   _("GCode file was not created successfully. Please check the parameters and try again."))
-                return
-                
-            self.app.load(gcode_file_path)
-            print("Loaded Gcode file:", self.app.gcode.filename)
-            
-        except Exception as e:
-            messagebox.showerror(_("GCode Generation Error"), 
+        params = dict(
+            engrave_text=engrave_text,
+            text_font_size=text_font_size,
+            text_position_mm=text_position_mm,
+            rotation_degrees=rotation_degrees,
+            layer_height_mm=layer_height_mm,
+            safe_height_mm=safe_height_mm,
+            feedrate_mm=feedrate_mm,
+            spindle_rpm=spindle_rpm,
+            final_height_mm=final_height_mm,
+            work_area_width=work_area_width,
+            work_area_height=work_area_height,
+            gap_distance_mm=gap_distance_mm,
+        )
+        cache = ToolpathCache(Utils.getStr("SurfAlign", "cacheDir") or None,
+                              Utils.getFloat("SurfAlign", "cacheSize", CACHE_SIZE))
+        key = cache.key(font_path, **params)
+
+        gcode_file_path = os.path.join(save_dir, "Op_Text_1.tap")
+        if cache.get(key, gcode_file_path) is not None:
+            print("Toolpath cache hit:", key)
+            self.loadGcode(gcode_file_path)
+            return
+
+        if worker.busy():
+            messagebox.showinfo(_("GCode Generation"),
+                                _("GCode generation is already running."))
+            return
+
+        # Blender runs in the worker process, wait for it off the GUI thread
+        def generate():
+            try:
+                text = worker.generate(font_path=font_path, **params)
+                with open(gcode_file_path, "w") as f:
+                    f.write(text)
+                cache.put(key, gcode_file_path)
+                self._generated = (gcode_file_path, None)
+            except Exception as e:
+                traceback.print_exc()
+                self._generated = (None, e)
+
+        self._generated = None
+        threading.Thread(target=generate, daemon=True).start()
+        self.after(GENERATE_POLL, self._generateDone)
+
+    # -----------------------------------------------------------------------
+    # Poll the background generation and load the result once done
+    # -----------------------------------------------------------------------
+    def _generateDone(self):
+        if self._generated is None:
+            self.after(GENERATE_POLL, self._generateDone)
+            return
+        gcode_file_path, error = self._generated
+        self._generated = None
+        if error is not None:
+            messagebox.showerror(_("GCode Generation Error"),
                                _("GCode generation failed. Please check the parameters and try again."))
-            print(f"GCode generation error: {e}")
-            import traceback
-            traceback.print_exc()
+            print(f"GCode generation error: {error}")
+            return
+        self.loadGcode(gcode_file_path)
 
+    def loadGcode(self, gcode_file_path):
+        print("Generated Gcode file path:", gcode_file_path)
 
+        # Check if the file was actually created
+        if not os.path.exists(gcode_file_path):
+            messagebox.showerror(_("GCode Generation Error"),
+                               _("GCode file was not created successfully. Please check the parameters and try again."))
+            return
 
+        self.app.load(gcode_file_path)
+        print("Loaded Gcode file:", self.app.gcode.filename)
 
     # # -----------------------------------------------------------------------
     def saveConfig(self):
@@ -1810,6 +1854,14 @@ class SurfAlignPage(CNCRibbon.Page):
         self.tabGroup.tab.set("Probe")
         self.tabGroup.tab.trace("w", self.tabChange)
 
+    # -----------------------------------------------------------------------
+    # Warm up Blender in background when the page is raised, unless a
+    # generation is already using the worker
+    # -----------------------------------------------------------------------
+    def activate(self):
+        if not worker.busy():
+            worker.start()
+
     # -----------------------------------------------------------------------
     def tabChange(self, a=None, b=None, c=None):
         tab = self.tabGroup.tab.get()
@@ -9,13 +9,12 @@ os.environ["BLENDER_USER_DATAFILES"] = r""
 import bpy
 import sys
 import warnings
-from scipy.spatial import ConvexHull
 import numpy as np
-import matplotlib.pyplot as plt
 import re
 import math
 import winreg
 import mathutils
+import lazy
 
 # import fabex addon
 import fabex
@@ -280,9 +279,8 @@ def setup_blender_scene(engrave_text, font_path, text_font_size, text_position_m
     return gcode_file_path
 
 
-import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
+# only needed to plot the fitted surface
+plt = lazy.lazyImport("matplotlib.pyplot")
 
 
 def build_vandermonde(X, Y, degree):
@@ -323,6 +321,7 @@ def fit_polynomial_surface_numpy(points, degree=2):
 
 
 def plot_surface(points, X_grid, Y_grid, Z_grid):
+    from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 3d projection
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
 
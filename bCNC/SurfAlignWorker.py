@@ -0,0 +1,145 @@
+# Long lived Blender worker process for the SurfAlign text engraving
+#
+# bpy and the fabex addon are imported only inside the worker, which keeps
+# them warm between requests. A crash of Blender kills only the worker,
+# that is restarted on the next request.
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+
+# Time to wait for a worker to exit before killing it
+STOP_TIMEOUT = 5.0
+
+
+def _serve(conn):
+    """Worker main loop: receive parameters, reply with the G-code text"""
+    save_dir = tempfile.mkdtemp(prefix="bCNC-surfalign-")
+    try:
+        try:
+            from SurfAlignUtils import setup_blender_scene
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+            return
+        conn.send(("ready", None))
+
+        while True:
+            try:
+                params = conn.recv()
+            except (EOFError, OSError):
+                break
+            if params is None:
+                break
+            try:
+                filename = setup_blender_scene(save_dir=save_dir, **params)
+                with open(filename) as f:
+                    conn.send(("ok", f.read()))
+                os.remove(filename)
+            except Exception:
+                conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+
+class WorkerError(Exception):
+    pass
+
+
+class BlenderWorker:
+    """
+    Client side of the worker process. generate() blocks the calling
+    thread only, requests are serialized by a lock.
+    """
+
+    def __init__(self):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._process = None
+        self._conn = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker if it is not running, it warms up in background"""
+        if self._process is not None and self._process.is_alive():
+            return
+        self._close()
+        self._conn, child = self._ctx.Pipe()
+        self._process = self._ctx.Process(
+            target=_serve, args=(child,), name="SurfAlignWorker", daemon=True
+        )
+        self._process.start()
+        child.close()
+        self._ready = False
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            if self._process.is_alive():
+                self._process.kill()
+            self._process.join()
+            self._process = None
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                try:
+                    self._conn.send(None)
+                except OSError:
+                    pass
+                self._process.join(STOP_TIMEOUT)
+            self._close()
+
+    def busy(self):
+        return self._lock.locked()
+
+    def _recv(self):
+        try:
+            status, value = self._conn.recv()
+        except (EOFError, OSError):
+            code = None
+            if self._process is not None:
+                self._process.join(STOP_TIMEOUT)
+                code = self._process.exitcode
+            self._close()
+            raise WorkerError(f"Blender worker died (exit code {code})")
+        if status == "error":
+            raise WorkerError(value)
+        return value
+
+    def _request(self, params):
+        self.start()
+        if not self._ready:
+            self._recv()
+            self._ready = True
+        try:
+            self._conn.send(params)
+        except OSError as e:
+            self._close()
+            raise WorkerError(f"Blender worker died: {e}")
+        return self._recv()
+
+    def generate(self, **params):
+        """
+        Run setup_blender_scene in the worker with the keyword arguments
+        params (without save_dir) and return the generated G-code text.
+        The request is retried once on a fresh worker if the worker died.
+        """
+        with self._lock:
+            try:
+                return self._request(params)
+            except WorkerError:
+                if self._process is not None:
+                    raise  # error reported by a living worker
+            print("Restarting Blender worker", file=sys.stderr)
+            return self._request(params)
+
+
+# Shared worker of the application
+worker = BlenderWorker()
@@ -25,6 +25,7 @@ import Ribbon
 import tkExtra
 import Utils
 from Helpers import N_
+from ringlog import LINES, RingLog
 
 __author__ = "Vasilis Vlachoudis"
 __email__ = "vvlachoudis@gmail.com"
@@ -216,13 +217,27 @@ class TerminalFrame(CNCRibbon.PageFrame):
         self.buffer.bind("<<Copy>>", self.copy)
         self.buffer.bind("<Control-Key-c>", self.copy)
 
+        # --- lines kept and drawn once per frame by render()
+        lines = Utils.getInt("Connection", "terminallines", LINES)
+        self.terminalLog = RingLog(lines)
+        self.bufferLog = RingLog(lines)
+
         # ---
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
 
     # ----------------------------------------------------------------------
     def clear(self, event=None):
-        self.terminal.delete(0, END)
+        self.terminalLog.clear()
+        self.render()
+
+    # ----------------------------------------------------------------------
+    # Draw the lines added to the logs since the last call
+    # ----------------------------------------------------------------------
+    def render(self):
+        if self.terminalLog.render(self.terminal):
+            self.terminal.see(END)
+        self.bufferLog.render(self.buffer)
 
     # ----------------------------------------------------------------------
     def copy(self, event):
@@ -651,6 +651,7 @@ class Config(_Base):
             ("spindlemin", "int", 0, _("Spindle min (RPM)")),
             ("spindlemax", "int", 12000, _("Spindle max (RPM)")),
             ("drozeropad", "int", 0, _("DRO Zero padding")),
+            ("fittolerance", "mm", 0.0, _("Arc fit tolerance when sending")),
             ("header", "text", "", _("Header gcode")),
             ("footer", "text", "", _("Footer gcode")),
             ("init", "text", "", _("Connection init string")),
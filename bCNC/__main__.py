@@ -36,12 +36,20 @@ def usage(rc):
     wrt("\t-s # | --serial #\tOpen serial port specified\n")
     wrt("\t-S\t\t\tDo not open serial port\n")
     wrt("\t--run\t\t\tDirectly run the file once loaded\n")
+    wrt("\t--import-time\t\tReport the time spent importing modules\n")
     wrt("\n")
     sys.exit(rc)
 
 
 # -----------------------------------------------------------------------------
 def main():
+    # time the imports from the very beginning
+    timer = None
+    if "--import-time" in sys.argv:
+        import lazy
+        timer = lazy.ImportTimer()
+        timer.install()
+
     import Helpers
     import bmain
     import tkExtra
@@ -69,6 +77,7 @@ def main():
                 "serial=",
                 "baud=",
                 "run",
+                "import-time",
             ],
         )
     except getopt.GetoptError:
@@ -150,6 +159,9 @@ def main():
         elif opt == "--run":
             run = True
 
+        elif opt == "--import-time":
+            pass  # handled before the imports
+
     application = bmain.Application(className=f"  {Utils.__prg__}  ")
 
     palette = {"background": application.cget("background")}
@@ -200,6 +212,10 @@ def main():
     if run:
         application.run()
 
+    if timer is not None:
+        timer.uninstall()
+        timer.report()
+
     try:
         application.mainloop()
     except KeyboardInterrupt:
@@ -68,7 +68,7 @@ import tkExtra
 # Load configuration before anything else
 # and if needed replace the  translate function _()
 # before any string is initialized
-from CNC import CNC, WAIT, GCode
+from CNC import CNC, GCode
 import Ribbon
 import Pendant
 from CNCRibbon import Page
@@ -77,6 +77,7 @@ from EditorPage import EditorPage
 from FilePage import FilePage
 from ProbePage import ProbePage
 from SurfAlignPage import SurfAlignPage
+from SurfAlignWorker import worker
 from Sender import NOT_CONNECTED, STATECOLOR, STATECOLORDEF, Sender
 from TerminalPage import TerminalPage
 from ToolsPage import Tools, ToolsPage
@@ -105,6 +106,7 @@ _baud = None
 
 MONITOR_AFTER = 200  # ms
 DRAW_AFTER = 300  # ms
+LOAD_AFTER = 100  # ms
 
 RX_BUFFER_SIZE = 128
 
@@ -295,8 +297,8 @@ class Application(Tk, Sender):
         self.control = Page.frames["Control"]
         self.abccontrol = Page.frames["abcControl"]
         self.editor = Page.frames["Editor"].editor
-        self.terminal = Page.frames["Terminal"].terminal
-        self.buffer = Page.frames["Terminal"].buffer
+        self.terminalLog = Page.frames["Terminal"].terminalLog
+        self.bufferLog = Page.frames["Terminal"].bufferLog
 
         # XXX FIXME Do we need it or I can takes from Page every time?
         self.autolevel = Page.frames["Probe:Autolevel"]
@@ -429,7 +431,7 @@ class Application(Tk, Sender):
 
         self.bind("<Control-Key-a>", self.selectAll)
         self.bind("<Control-Key-A>", self.unselectAll)
-        self.bind("<Escape>", self.unselectAll)
+        self.bind("<Escape>", self.escape)
         self.bind("<Control-Key-i>", self.selectInvert)
 
         self.bind("<<SelectAll>>", self.selectAll)
@@ -538,6 +540,8 @@ class Application(Tk, Sender):
         CNC.vars["color"] = STATECOLOR[NOT_CONNECTED]
         self._pendantFileUploaded = None
         self._drawAfter = None  # after handle for modification
+        self._loader = None  # background g-code loader
+        self._runAfterLoad = None  # (lines,) of a run requested while loading
         self._inFocus = False
         # END - insertCount lines where ok was applied to for $xxx commands
         self._insertCount = (0)
@@ -637,6 +641,7 @@ class Application(Tk, Sender):
             return
 
         self.canvas.cameraOff()
+        worker.stop()
         Sender.quit(self)
         self.saveConfig()
         self.destroy()
@@ -827,6 +832,7 @@ class Application(Tk, Sender):
             self.gcode.undo()
             self.editor.fill()
             self.drawAfter()
+            self.undoStatus()
         return "break"
 
     # -----------------------------------------------------------------------
@@ -835,8 +841,16 @@ class Application(Tk, Sender):
             self.gcode.redo()
             self.editor.fill()
             self.drawAfter()
+            self.undoStatus()
         return "break"
 
+    # -----------------------------------------------------------------------
+    # Show the memory held by the undo/redo records
+    # -----------------------------------------------------------------------
+    def undoStatus(self):
+        self.setStatus(_("Undo memory {:.1f} MB").format(
+            self.gcode.undoMemory() / 1048576.0))
+
     # -----------------------------------------------------------------------
     def addUndo(self, undoinfo):
         self.gcode.addUndo(undoinfo)
@@ -1121,12 +1135,14 @@ class Application(Tk, Sender):
         le = 0
         r = 0
         t = 0
+        lim = 0
         for block in self.gcode.blocks:
             if block.enable:
                 e += 1
                 le += block.length
                 r += block.rapid
                 t += block.time
+                lim += len(block.limited)
 
         # ===========
         frame = LabelFrame(toplevel, text=_(
@@ -1208,6 +1224,18 @@ class Application(Tk, Sender):
             foreground="DarkBlue",
         ).grid(row=row, column=col, sticky=W)
 
+        # ---
+        row += 1
+        col = 0
+        Label(frame, text=_("Feed limited:")).grid(
+            row=row, column=col, sticky=E)
+        col += 1
+        Label(
+            frame,
+            text=_("{} lines too short to reach their feed").format(lim),
+            foreground="DarkBlue",
+        ).grid(row=row, column=col, sticky=W)
+
         frame.grid_columnconfigure(1, weight=1)
 
         # ===========
@@ -1371,6 +1399,16 @@ class Application(Tk, Sender):
             self.selectionChange()
             return "break"
 
+    # -----------------------------------------------------------------------
+    # Cancel the file loading if any or clear the selection
+    # -----------------------------------------------------------------------
+    def escape(self, event=None):
+        if self._loader is not None:
+            self._loader.cancel()
+            self._runAfterLoad = None
+            return "break"
+        return self.unselectAll(event)
+
     # -----------------------------------------------------------------------
     def selectInvert(self, event=None):
         focus = self.focus_get()
@@ -1993,6 +2031,7 @@ class Application(Tk, Sender):
 
         self.busy()
         sel = None
+        status = None
         if cmd == "AUTOLEVEL":
             sel = self.gcode.autolevel(items)
         elif cmd == "SURF_ALIGN":
@@ -2018,7 +2057,9 @@ class Application(Tk, Sender):
         elif cmd == "MOVE":
             self.gcode.moveLines(items, *args)
         elif cmd == "OPTIMIZE":
-            self.gcode.optimize(items)
+            before, after = self.gcode.optimize(items)
+            status = _("Rapid distance {:.1f} -> {:.1f}").format(
+                before, after)
         elif cmd == "ORIENT":
             self.gcode.orientLines(items)
         elif cmd == "REVERSE":
@@ -2039,9 +2080,11 @@ class Application(Tk, Sender):
                 self.editor.select(sel, clear=True)
         self.drawAfter()
         self.notBusy()
-        self.setStatus(
-            f"{cmd} {' '.join([str(a) for a in args if a is not None])}"
-        )
+        if status is None:
+            status = (
+                f"{cmd} {' '.join([str(a) for a in args if a is not None])}"
+            )
+        self.setStatus(status)
 
     # -----------------------------------------------------------------------
     def profile(
@@ -2311,7 +2354,7 @@ class Application(Tk, Sender):
     # save dialog
     # -----------------------------------------------------------------------
     def saveDialog(self, event=None):
-        if self.running:
+        if self.running or self.loadingError():
             return
         fn, ext = os.path.splitext(Utils.getUtf("File", "file"))
         if ext in (".dxf", ".DXF"):
@@ -2385,7 +2428,24 @@ class Application(Tk, Sender):
                     if ans == messagebox.YES or ans is True:
                         self.gcode.probe.init()
 
+        if self._loader is not None:
+            self._loader.cancel()
+            self._loader = None
+        self._runAfterLoad = None
+
         self.setStatus(_("Loading: {} ...").format(filename), True)
+        if ext.lower() not in (".probe", ".orient", ".stl", ".ply", ".dxf",
+                               ".svg"):
+            self._loader = self.gcode.loadBackground(filename)
+            if self._loader is not None:
+                self._saveConfigFile()
+                Utils.addRecent(filename)
+                self.editor.selectClear()
+                self.editor.fill()
+                self.canvas.reset()
+                self.after(LOAD_AFTER, self._loading, self._loader,
+                           autoloaded)
+                return
         Sender.load(self, filename)
 
         if ext == ".probe":
@@ -2405,6 +2465,10 @@ class Application(Tk, Sender):
             self.canvas.fit2Screen()
             Page.frames["CAM"].populate()
 
+        self._loaded(filename, autoloaded)
+
+    # -----------------------------------------------------------------------
+    def _loaded(self, filename, autoloaded):
         if autoloaded:
             self.setStatus(
                 _("'{}' reloaded at '{}'").format(
@@ -2417,8 +2481,63 @@ class Application(Tk, Sender):
             + f"{__platform_fingerprint__}"
         )
 
+    # -----------------------------------------------------------------------
+    # Collect the blocks of the background loader and report its progress
+    # -----------------------------------------------------------------------
+    def _loading(self, loader, autoloaded):
+        if loader is not self._loader:
+            return  # replaced by another load
+        self.gcode.addLoaded(loader.poll())
+        if not loader.finished():
+            self.setStatus(
+                _("Loading: {} {:.0f}% ... [Esc to cancel]").format(
+                    loader.filename, loader.progress() * 100.0))
+            self.after(LOAD_AFTER, self._loading, loader, autoloaded)
+            return
+
+        self._loader = None
+        run, self._runAfterLoad = self._runAfterLoad, None
+        if loader.error is not None or loader.canceled():
+            # never leave a truncated program in the editor
+            self.gcode.init()
+        else:
+            # modal state of the end of the file, e.g. feed mode
+            CNC.vars.update(loader.vars)
+        self.editor.fill()
+        self.draw()
+        self.canvas.fit2Screen()
+        Page.frames["CAM"].populate()
+
+        if loader.error is not None:
+            sys.stderr.write(loader.error)
+            self.setStatus(
+                _("Error loading: {}").format(loader.filename))
+        elif loader.canceled():
+            self.setStatus(
+                _("Loading canceled: {}").format(loader.filename))
+        else:
+            self._loaded(loader.filename, autoloaded)
+            if run is not None:
+                self.run(*run)
+
+    # -----------------------------------------------------------------------
+    # Show an error if the file is still loading
+    # @return True if loading
+    # -----------------------------------------------------------------------
+    def loadingError(self):
+        if self._loader is None:
+            return False
+        messagebox.showerror(
+            _("Loading"), _("Please wait for the file to load"),
+            parent=self
+        )
+        return True
+
     # -----------------------------------------------------------------------
     def save(self, filename):
+        # saving a partly loaded file would truncate it
+        if self.loadingError():
+            return
         Sender.save(self, filename)
         self.setStatus(_("'{}' saved").format(filename))
         self.title(
@@ -2608,7 +2727,13 @@ class Application(Tk, Sender):
                 _("Already running"), _("Please stop before"), parent=self
             )
             return
-
+        if self._loader is not None:
+            # started from the command line, a script or the pendant
+            # right after a load, run once the file is loaded
+            self._runAfterLoad = (lines,)
+            self.setStatus(_("Run after loading: {}").format(
+                self._loader.filename))
+            return
 
         self.editor.selectClear()
         self.selectionChange()
@@ -2622,7 +2747,6 @@ class Application(Tk, Sender):
         # are still sending or we finished
         self._gcount = 0  # count executed lines
         self._selectI = 0  # last selection pointer in items
-        self._paths = None  # temporary
         CNC.vars["running"] = True  # enable running status
         CNC.vars["_OvChanged"] = True  # force a feed change if any
         if self._onStart:
@@ -2632,29 +2756,19 @@ class Application(Tk, Sender):
                 pass
 
         if lines is None:
-            self.statusbar.setLimits(0, 9999)
-            self.statusbar.setProgress(0, 0)
-            self._paths = self.gcode.compile(self.queue, self.checkStop)
-            if self._paths is None:
-                self.emptyQueue()
-                self.purgeController()
-                return
-            elif not self._paths:
-                self.runEnded()
-                messagebox.showerror(
-                    _("Empty gcode"),
-                    _("Not gcode file was loaded"),
-                    parent=self
-                )
-                return
-
             # reset colors
             before = time.time()
-            for ij in self._paths:  # Slow loop
-                if not ij:
+            total = len(self.cnc.startup.splitlines())
+            for block in self.gcode.blocks:
+                if not block.enable:
                     continue
-                path = self.gcode[ij[0]].path(ij[1])
-                if path:
+                total += len(block)
+                last = None
+                for j in range(len(block)):
+                    path = block.path(j)
+                    if not path or path == last:
+                        continue  # merged items are shared by many lines
+                    last = path
                     color = self.canvas.itemcget(path, "fill")
                     if color != CNCCanvas.ENABLE_COLOR:
                         self.canvas.itemconfig(
@@ -2665,23 +2779,17 @@ class Application(Tk, Sender):
                         self.update()
                         before = time.time()
 
-            # the buffer of the machine should be empty?
-            self._runLines = len(self._paths) + 1  # plus the wait
+            # compile lazily while sending, _runLines is set by the
+            # streaming thread once the last line is queued
+            self.streamRun(self.gcode.compileLines(lambda: self._stop))
         else:
-            n = 1  # including one wait command
-            for line in CNC.compile(lines):
-                if line is not None:
-                    if isinstance(line, str):
-                        self.queue.put(line + "\n")
-                    else:
-                        self.queue.put(line)
-                    n += 1
-            # set it at the end to be sure that all lines are queued
-            self._runLines = n
-        self.queue.put((WAIT,))  # wait at the end to become idle
+            lines = CNC.compile(lines)
+            total = len(lines)
+            self.gcode.fitStats = None
+            self.streamRun((line, None) for line in lines)
 
         self.setStatus(_("Running..."))
-        self.statusbar.setLimits(0, self._runLines)
+        self.statusbar.setLimits(0, total + 1)  # plus the wait
         self.statusbar.configText(fill="White")
         self.statusbar.config(background="DarkGray")
 
@@ -2728,23 +2836,25 @@ class Application(Tk, Sender):
         # Check serial output
         t = time.time()
 
-        # dump in the terminal what ever you can in less than 0.1s
-        inserted = False
+        # move to the terminal logs what ever you can in less than 0.1s
+        # and draw them once
+        terminal = self.terminalLog
+        buffer = self.bufferLog
         while self.log.qsize() > 0 and time.time() - t < 0.1:
             try:
                 msg, line = self.log.get_nowait()
                 line = str(line).rstrip("\n")
-                inserted = True
+                if self.logFile is not None:
+                    self.logFile.write(line, Sender.MSG_TAG.get(msg, "?"))
 
                 if msg == Sender.MSG_BUFFER:
-                    self.buffer.insert(END, line)
+                    buffer.append(line)
 
                 elif msg == Sender.MSG_SEND:
-                    self.terminal.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Blue")
+                    terminal.append(line, "Blue")
 
                 elif msg == Sender.MSG_RECEIVE:
-                    self.terminal.insert(END, line)
+                    terminal.append(line)
                     if self._insertCount:
                         # when counting is started, then continue
                         self._insertCount += 1
@@ -2753,52 +2863,31 @@ class Application(Tk, Sender):
                         # starting with $ or [
                         self._insertCount = 1
 
-                elif msg == Sender.MSG_OK:
-                    if self.terminal.size() > 0:
-                        if self._insertCount:
-                            pos = self.terminal.size() - self._insertCount
-                            self._insertCount = 0
-                        else:
-                            pos = END
-                        self.terminal.insert(pos, self.buffer.get(0))
-                        self.terminal.itemconfig(pos, foreground="Blue")
-                        self.buffer.delete(0)
-                    self.terminal.insert(END, line)
-
-                elif msg == Sender.MSG_ERROR:
-                    if self.terminal.size() > 0:
-                        if self._insertCount:
-                            pos = self.terminal.size() - self._insertCount
-                            self._insertCount = 0
-                        else:
-                            pos = END
-                        self.terminal.insert(pos, self.buffer.get(0))
-                        self.terminal.itemconfig(pos, foreground="Blue")
-                        self.buffer.delete(0)
-                    self.terminal.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Red")
+                elif msg == Sender.MSG_OK or msg == Sender.MSG_ERROR:
+                    if len(terminal) > 0:
+                        pos = len(terminal) - self._insertCount
+                        self._insertCount = 0
+                        terminal.insert(pos, buffer.popleft(), "Blue")
+                    if msg == Sender.MSG_OK:
+                        terminal.append(line)
+                    else:
+                        terminal.append(line, "Red")
 
                 elif msg == Sender.MSG_RUNEND:
-                    self.terminal.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Magenta")
+                    terminal.append(line, "Magenta")
                     self.setStatus(line)
                     self.enable()
 
                 elif msg == Sender.MSG_CLEAR:
-                    self.buffer.delete(0, END)
+                    buffer.clear()
 
                 else:
                     # Unknown?
-                    self.buffer.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Magenta")
-
-                if self.terminal.size() > 1000:
-                    self.terminal.delete(0, 500)
+                    terminal.append(line, "Magenta")
             except Empty:
                 break
 
-        if inserted:
-            self.terminal.see(END)
+        Page.frames["Terminal"].render()
 
         # Check pendant
         try:
@@ -2855,11 +2944,23 @@ class Application(Tk, Sender):
                 Page.frames["Probe:Tool"].updateTool()
             elif self._update == "TLO":
                 Page.frames["ProbeCommon"].updateTlo()
+            elif self._update == "empty":
+                messagebox.showerror(
+                    _("Empty gcode"),
+                    _("Not gcode file was loaded"),
+                    parent=self
+                )
             self._update = None
 
         if self.running:
+            if (self._runLines != sys.maxsize
+                    and self.statusbar.high != self._runLines):
+                # streaming finished, replace the estimated line count
+                t0 = self.statusbar.t0
+                self.statusbar.setLimits(0, self._runLines)
+                self.statusbar.setStartTime(t0)
             self.statusbar.setProgress(
-                self._runLines - self.queue.qsize(), self._gcount
+                len(self._paths) - self.queue.qsize(), self._gcount
             )
             CNC.vars["msg"] = self.statusbar.msg
             self.bufferbar.setProgress(Sender.getBufferFill(self))
@@ -182,7 +182,7 @@ class Controller(_GenericController):
                     # CNC.vars[gcode+"B"] = values[k[0]]['b']
                     # CNC.vars[gcode+"C"] = values[k[0]]['c']
 
-    def parseLine(self, line, cline, sline):
+    def parseLine(self, line, rxbuf):
         if not line:
             return True
 
@@ -193,8 +193,7 @@ class Controller(_GenericController):
                 if not self.master.sio_status:
                     self.master.log.put((self.master.MSG_OK, line))
                     self.master._gcount += 1
-                    if cline: del cline[0]
-                    if sline: del sline[0]
+                    rxbuf.pop()
                 self.master.sio_status = False
             self.parseValues(values)
 
@@ -206,7 +205,7 @@ class Controller(_GenericController):
         # Machine is Idle buffer is empty stop waiting and go on
         if (
             self.master.sio_wait
-            and not cline
+            and not rxbuf
             and CNC.vars["state"] == "Idle"
         ):
             self.master.sio_wait = False
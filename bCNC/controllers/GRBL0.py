@@ -11,7 +11,7 @@ class Controller(_GenericGRBL):
         self.has_override = False
         self.master = master
 
-    def parseBracketAngle(self, line, cline):
+    def parseBracketAngle(self, line, rxbuf):
         self.master.sio_status = False
         pat = STATUSPAT.match(line)
         if pat:
@@ -34,7 +34,7 @@ class Controller(_GenericGRBL):
             # stop waiting and go on
             if (
                 self.master.sio_wait
-                and not cline
+                and not rxbuf
                 and pat.group(1) not in ("Run", "Jog", "Hold")
             ):
                 self.master.sio_wait = False
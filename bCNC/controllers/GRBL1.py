@@ -3,6 +3,7 @@
 from _GenericController import SPLITPAT
 from _GenericGRBL import _GenericGRBL
 from CNC import CNC
+from machine import AXES
 
 OV_FEED_100 = chr(0x90)  # Extended override commands
 OV_FEED_i10 = chr(0x91)
@@ -25,6 +26,91 @@ OV_SPINDLE_STOP = chr(0x9E)
 OV_FLOOD_TOGGLE = chr(0xA0)
 OV_MIST_TOGGLE = chr(0xA1)
 
+# CNC.vars names of the axes values
+MPOS_VARS = [f"m{axis}" for axis in AXES]
+WPOS_VARS = [f"w{axis}" for axis in AXES]
+WCO_VARS = [f"wco{axis}" for axis in AXES]
+
+
+# -----------------------------------------------------------------------------
+# @return the axes values of a status report field, keeping the values of
+#         axes not reported from old, and the number of axes reported
+# -----------------------------------------------------------------------------
+def _axes(value, old):
+    values = value.split(",")
+    n = len(values)
+    if n < 3 or n > len(old):
+        raise ValueError(value)
+    return list(map(float, values)) + old[n:], n
+
+
+# -----------------------------------------------------------------------------
+# Parse a GRBL 1.1 status report "<State|Field:values|...>" in a single
+# pass into machine, a MachineState, and record it in the history when it
+# reports the position. Only the values reported are copied to variables,
+# the axes reported of the position. Fields after an invalid one are
+# skipped.
+# @return (position, garbage) True if the position was reported, and the
+#         name of the invalid field or None
+# -----------------------------------------------------------------------------
+def parseStatus(line, machine, variables):
+    fields = line[1:-1].split("|")
+    machine.state = fields[0]
+    machine.pins = ""
+    machine.accessories = ""
+    mpos = wpos = None
+    garbage = None
+    for field in fields[1:]:
+        name, _, value = field.partition(":")
+        try:
+            if name == "MPos":
+                mpos, machine.axes = _axes(value, machine.mpos)
+            elif name == "Bf":
+                planner, rxbytes = value.split(",")
+                variables["planner"] = machine.planner = int(planner)
+                variables["rxbytes"] = machine.rxbytes = int(rxbytes)
+            elif name == "FS":
+                feed, spindle = value.split(",")
+                variables["curfeed"] = machine.feed = float(feed)
+                variables["curspindle"] = machine.spindle = float(spindle)
+            elif name == "WPos":
+                wpos, machine.axes = _axes(value, machine.wpos)
+            elif name == "F":
+                variables["curfeed"] = machine.feed = float(value)
+            elif name == "Ln":
+                machine.line = int(value)
+            elif name == "WCO":
+                machine.setOffset(_axes(value, machine.wco)[0])
+                variables.update(zip(WCO_VARS[:machine.axes], machine.wco))
+            elif name == "Ov":
+                feed, rapid, spindle = value.split(",")
+                machine.override = [int(feed), int(rapid), int(spindle)]
+                (variables["OvFeed"],
+                 variables["OvRapid"],
+                 variables["OvSpindle"]) = machine.override
+            elif name == "Pn":
+                machine.pins = value
+            elif name == "A":
+                machine.accessories = value
+        except ValueError:
+            garbage = name
+            break
+    variables["pins"] = machine.pins
+
+    # the work position is converted once the offset is known
+    wco = machine.wco
+    if wpos is not None:
+        mpos = [w + o for w, o in zip(wpos, wco)]
+    if mpos is None:
+        return False, garbage
+    machine.setPosition(mpos)
+    # round(x * scale) / scale is twice as fast as round(x, CNC.digits)
+    scale = 10.0 ** CNC.digits
+    for i in range(machine.axes):
+        variables[MPOS_VARS[i]] = mpos[i]
+        variables[WPOS_VARS[i]] = round((mpos[i] - wco[i]) * scale) / scale
+    return True, garbage
+
 
 class Controller(_GenericGRBL):
     def __init__(self, master):
@@ -91,135 +177,44 @@ class Controller(_GenericGRBL):
             self.master.serial_write(OV_SPINDLE_d1)
             CNC.vars["_OvChanged"] = diff < -1
 
-    def parseBracketAngle(self, line, cline):
+    def parseBracketAngle(self, line, rxbuf):
         self.master.sio_status = False
-        fields = line[1:-1].split("|")
-        CNC.vars["pins"] = ""
+        machine = self.master.machine
+        position, garbage = parseStatus(line, machine, CNC.vars)
+        state = machine.state
 
         # Report if state has changed
         if (
-            CNC.vars["state"] != fields[0]
+            CNC.vars["state"] != state
             or self.master.runningPrev != self.master.running
         ):
-            self.master.controllerStateChange(fields[0])
+            self.master.controllerStateChange(state)
         self.master.runningPrev = self.master.running
 
-        self.displayState(fields[0])
+        self.displayState(state)
 
-        for field in fields[1:]:
-            word = SPLITPAT.split(field)
-            if word[0] == "MPos":
-                try:
-                    CNC.vars["mx"] = float(word[1])
-                    CNC.vars["my"] = float(word[2])
-                    CNC.vars["mz"] = float(word[3])
-                    CNC.vars["wx"] = round(
-                        CNC.vars["mx"] - CNC.vars["wcox"], CNC.digits
-                    )
-                    CNC.vars["wy"] = round(
-                        CNC.vars["my"] - CNC.vars["wcoy"], CNC.digits
-                    )
-                    CNC.vars["wz"] = round(
-                        CNC.vars["mz"] - CNC.vars["wcoz"], CNC.digits
-                    )
-                    if len(word) > 4:
-                        CNC.vars["ma"] = float(word[4])
-                        CNC.vars["wa"] = round(
-                            CNC.vars["ma"] - CNC.vars["wcoa"], CNC.digits
-                        )
-                    if len(word) > 5:
-                        CNC.vars["mb"] = float(word[5])
-                        CNC.vars["wb"] = round(
-                            CNC.vars["mb"] - CNC.vars["wcob"], CNC.digits
-                        )
-                    if len(word) > 6:
-                        CNC.vars["mc"] = float(word[6])
-                        CNC.vars["wc"] = round(
-                            CNC.vars["mc"] - CNC.vars["wcoc"], CNC.digits
-                        )
-                    self.master._posUpdate = True
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "F":
-                try:
-                    CNC.vars["curfeed"] = float(word[1])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "FS":
-                try:
-                    CNC.vars["curfeed"] = float(word[1])
-                    CNC.vars["curspindle"] = float(word[2])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "Bf":
-                try:
-                    CNC.vars["planner"] = int(word[1])
-                    CNC.vars["rxbytes"] = int(word[2])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "Ov":
-                try:
-                    CNC.vars["OvFeed"] = int(word[1])
-                    CNC.vars["OvRapid"] = int(word[2])
-                    CNC.vars["OvSpindle"] = int(word[3])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "WCO":
-                try:
-                    CNC.vars["wcox"] = float(word[1])
-                    CNC.vars["wcoy"] = float(word[2])
-                    CNC.vars["wcoz"] = float(word[3])
+        if position:
+            self.master._posUpdate = True
+        if garbage is not None:
+            CNC.vars["state"] = f"Garbage receive {garbage}: {line}"
+            self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
 
-                    if len(word) > 4:
-                        CNC.vars["wcoa"] = float(word[4])
-                    if len(word) > 5:
-                        CNC.vars["wcob"] = float(word[5])
-                    if len(word) > 6:
-                        CNC.vars["wcoc"] = float(word[6])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "Pn":
-                try:
-                    CNC.vars["pins"] = word[1]
-                    if "S" in word[1]:
-                        if (CNC.vars["state"] == "Idle"
-                                and not self.master.running):
-                            print("Stream requested by CYCLE START "
-                                  + "machine button")
-                            self.master.event_generate("<<Run>>", when="tail")
-                        else:
-                            print(
-                                "Ignoring machine stream request, "
-                                + "because of state: ",
-                                CNC.vars["state"],
-                                self.master.running,
-                            )
-                except (ValueError, IndexError):
-                    break
+        if "S" in machine.pins:
+            if CNC.vars["state"] == "Idle" and not self.master.running:
+                print("Stream requested by CYCLE START machine button")
+                self.master.event_generate("<<Run>>", when="tail")
+            else:
+                print(
+                    "Ignoring machine stream request, because of state: ",
+                    CNC.vars["state"],
+                    self.master.running,
+                )
 
         # Machine is Idle buffer is empty stop waiting and go on
         if (
             self.master.sio_wait
-            and not cline
-            and fields[0] not in ("Run", "Jog", "Hold")
+            and not rxbuf
+            and state not in ("Run", "Jog", "Hold")
         ):
             self.master.sio_wait = False
             self.master._gcount += 1
@@ -64,7 +64,7 @@ class Controller(_GenericController):
     def grblHelp(self):
         self.master.serial_write(b"help\n")
 
-    def parseBracketAngle(self, line, cline):
+    def parseBracketAngle(self, line, rxbuf):
         # <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000|F:12345.12|S:1.2>
         ln = line[1:-1]  # strip off < .. >
 
@@ -94,7 +94,7 @@ class Controller(_GenericController):
 
         # Machine is Idle buffer is empty
         # stop waiting and go on
-        if self.master.sio_wait and not cline and lval[0] not in ("Run", "Jog", "Hold"):
+        if self.master.sio_wait and not rxbuf and lval[0] not in ("Run", "Jog", "Hold"):
             self.master.sio_wait = False
             self.master._gcount += 1
 
@@ -244,7 +244,7 @@ class _GenericController:
         CNC.vars["state"] = state
 
     # ----------------------------------------------------------------------
-    def parseLine(self, line, cline, sline):
+    def parseLine(self, line, rxbuf):
         if not line:
             return True
 
@@ -252,7 +252,7 @@ class _GenericController:
             if not self.master.sio_status:
                 self.master.log.put((self.master.MSG_RECEIVE, line))
             else:
-                self.parseBracketAngle(line, cline)
+                self.parseBracketAngle(line, rxbuf)
 
         elif line[0] == "[":
             self.master.log.put((self.master.MSG_RECEIVE, line))
@@ -261,10 +261,8 @@ class _GenericController:
         elif "error:" in line or "ALARM:" in line:
             self.master.log.put((self.master.MSG_ERROR, line))
             self.master._gcount += 1
-            if cline:
-                del cline[0]
-            if sline:
-                CNC.vars["errline"] = sline.pop(0)
+            if rxbuf:
+                CNC.vars["errline"] = rxbuf.pop()
             if not self.master._alarm:
                 self.master._posUpdate = True
             self.master._alarm = True
@@ -275,10 +273,7 @@ class _GenericController:
         elif line.find("ok") >= 0:
             self.master.log.put((self.master.MSG_OK, line))
             self.master._gcount += 1
-            if cline:
-                del cline[0]
-            if sline:
-                del sline[0]
+            rxbuf.pop()
 
         elif line[0] == "$":
             self.master.log.put((self.master.MSG_RECEIVE, line))
@@ -289,8 +284,7 @@ class _GenericController:
         elif line[:4] == "Grbl" or line[:13] == "CarbideMotion":
             self.master.log.put((self.master.MSG_RECEIVE, line))
             self.master._stop = True
-            del cline[:]  # After reset clear the buffer counters
-            del sline[:]
+            rxbuf.clear()  # After reset clear the buffer counters
             CNC.vars["version"] = line.split()[1]
             # Detect controller
             if self.master.controller in ("GRBL0", "GRBL1"):
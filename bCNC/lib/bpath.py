@@ -46,6 +46,45 @@ def eq(A, B, acc=EPS):
     return d2 < err
 
 
+# -----------------------------------------------------------------------------
+# Find the pairs of segments with overlapping bounding boxes, sweeping
+# along x: the boxes are visited by increasing minx, keeping the ones
+# whose x range is still open
+#
+# @param first  list of segments
+# @param second list of segments, None to pair first with itself
+# @return sorted list of (i, j) pairs, i indexing first and j second, or
+#         both first with i<j
+# -----------------------------------------------------------------------------
+def overlappingPairs(first, second=None):
+    boxes = [(s.minx, s.maxx, s.miny, s.maxy, 0, i)
+             for i, s in enumerate(first)]
+    if second is not None:
+        boxes.extend((s.minx, s.maxx, s.miny, s.maxy, 1, j)
+                     for j, s in enumerate(second))
+    boxes.sort(key=itemgetter(0))
+
+    pairs = []
+    active = [[], []]
+    for box in boxes:
+        minx, maxx, miny, maxy, group, i = box
+        other = group if second is None else 1 - group
+        # drop the boxes ending before this one starts
+        candidates = [b for b in active[other] if b[1] >= minx]
+        active[other] = candidates
+        for b in candidates:
+            if b[2] <= maxy and miny <= b[3]:
+                if second is None:
+                    pairs.append((b[5], i) if b[5] < i else (i, b[5]))
+                elif group:
+                    pairs.append((b[5], i))
+                else:
+                    pairs.append((i, b[5]))
+        active[group].append(box)
+    pairs.sort()
+    return pairs
+
+
 # =============================================================================
 # Segment
 # =============================================================================
@@ -1358,24 +1397,27 @@ class Path(list):
             oi = self[i].order(P)
             points.append((i, oi, P))
 
-        # Find all intersection points
-        for i, si in enumerate(self[:-2]):
-            if si.type == Segment.LINE and self[i + 1].type == Segment.LINE:
-                j = i + 2
-            else:
-                j = i + 1
-            while j < len(self):
-                P1, P2 = si.intersect(self[j])
-                # skip doublet solution
-                if P1 is not None and P2 is not None and eq(P1, P2, EPS):
-                    P2 = None
-                if P1:
-                    addPoint(i, P1)
-                    addPoint(j, P1)
-                if P2:
-                    addPoint(i, P2)
-                    addPoint(j, P2)
-                j += 1
+        # Find all intersection points, only between segments with
+        # overlapping bounding boxes
+        last = len(self) - 2
+        for i, j in overlappingPairs(self):
+            if i >= last:
+                continue
+            si = self[i]
+            # consecutive lines meet only at their common point
+            if j == i + 1 and si.type == Segment.LINE \
+                    and self[j].type == Segment.LINE:
+                continue
+            P1, P2 = si.intersect(self[j])
+            # skip doublet solution
+            if P1 is not None and P2 is not None and eq(P1, P2, EPS):
+                P2 = None
+            if P1:
+                addPoint(i, P1)
+                addPoint(j, P1)
+            if P2:
+                addPoint(i, P2)
+                addPoint(j, P2)
 
         # sort according to index, and position of point
         points.sort(key=itemgetter(0, 1))
@@ -1411,17 +1453,17 @@ class Path(list):
             oi = self[i].order(P)
             points.append((i, oi, P))
 
-        # Find all intersection points
-        for i, si in enumerate(self):
-            for cut in path:
-                P1, P2 = si.intersect(cut)
-                # skip doublet solution
-                if P1 is not None and P2 is not None and eq(P1, P2, EPS):
-                    P2 = None
-                if P1:
-                    addPoint(i, P1)
-                if P2:
-                    addPoint(i, P2)
+        # Find all intersection points, only between segments with
+        # overlapping bounding boxes
+        for i, j in overlappingPairs(self, path):
+            P1, P2 = self[i].intersect(path[j])
+            # skip doublet solution
+            if P1 is not None and P2 is not None and eq(P1, P2, EPS):
+                P2 = None
+            if P1:
+                addPoint(i, P1)
+            if P2:
+                addPoint(i, P2)
 
         # sort according to index, and position of point
         points.sort(key=itemgetter(0, 1))
@@ -34,6 +34,7 @@
 
 import math
 import sys
+from itertools import compress
 
 import spline
 from bmath import Vector
@@ -55,6 +56,23 @@ MULTIPLE_ENTRIES_TAGS = {
     "SPLINE": (10, 11, 20, 21, 30, 31, 40)
 }
 
+# Group codes converted to float and int when reading, see DXF.read
+FLOAT_TAGS = frozenset(
+    list(range(10, 60))
+    + list(range(140, 148))
+    + list(range(210, 240))
+    + list(range(1010, 1060))
+)
+INT_TAGS = frozenset(
+    list(range(60, 80))
+    + list(range(90, 100))
+    + list(range(170, 176))
+    + list(range(280, 290))
+    + list(range(370, 390))
+    + list(range(400, 410))
+    + list(range(1060, 1072))
+)
+
 # Just to avoid repeating errors
 errors = {}
 
@@ -634,6 +652,8 @@ class Entity(dict):
     # ----------------------------------------------------------------------
     def read(self, dxf):
         """Read entity from a dxf file"""
+        if dxf._tags is not None and dxf._saved is None:
+            return self._readBulk(dxf)
         while True:
             tag, value = dxf.read()
             if tag is None:
@@ -665,6 +685,50 @@ class Entity(dict):
                     else:
                         self[42].append(0.0)
 
+    # ----------------------------------------------------------------------
+    def _readBulk(self, dxf):
+        """Same as read() going through the pairs tokenized by the dxf"""
+        tags = dxf._tags
+        values = dxf._values
+        pos = dxf._pos
+        multiple = MULTIPLE_ENTRIES_TAGS.get(self.type, ())
+        lwpolyline = self.type == "LWPOLYLINE"
+        get = self.get
+        while pos < len(tags):
+            tag = tags[pos]
+            value = values[pos]
+            pos += 1
+            if tag is None:
+                break
+            if tag == 0:
+                if self.type == "POLYLINE":
+                    dxf._pos = pos
+                    self._readVertex(dxf)
+                else:
+                    dxf._pos = pos - 1  # leave it for the next read
+                return self
+            elif tag == 8:
+                self.name = str(value)
+            else:
+                existing = get(tag)
+
+                if tag == 42 and lwpolyline:
+                    # Replace last value
+                    self[42][-1] = value
+                elif existing is None:
+                    self[tag] = [value] if tag in multiple else value
+                elif isinstance(existing, list):
+                    existing.append(value)
+                # Synchronize optional bulge with number of vertices
+                if tag == 10 and lwpolyline:
+                    bulge = get(42)
+                    if bulge is None:
+                        self[42] = [0.0]
+                    else:
+                        bulge.append(0.0)
+        dxf._pos = pos
+        return None
+
 
 # =============================================================================
 # DXF layer
@@ -710,29 +774,53 @@ class Layer:
         if self._sorted:
             return
         self._sorted = True
-        new = []
 
         # Move all points to beginning
-        i = 0
-        while i < len(self.entities):
-            if self.entities[i].type == "POINT":
-                new.append(self.entities[i])
-                del self.entities[i]
-            elif self.entities[i].type == "INSERT":
-                new.append(self.entities[i])
-                del self.entities[i]
-            else:
-                i += 1
-
-        if not self.entities:
+        new = [e for e in self.entities if e.type in ("POINT", "INSERT")]
+        entities = [
+            e for e in self.entities if e.type not in ("POINT", "INSERT")]
+        if not entities:
             self.entities = new
             return
 
+        # Hash the end points on a grid, in every cell touched by the
+        # largest tolerance of the relative EPS2 check around them. The
+        # points matching a point are then in the cell of the point
+        points = [(e.start(), e.end()) for e in entities]
+        big = max(max(abs(s[0]), abs(s[1]), abs(e[0]), abs(e[1]))
+                  for s, e in points)
+        tolerance = EPS * math.sqrt(8.0 * big * big + 1.0)
+        cell = 16.0 * tolerance
+        grid = {}
+        for i, (s, e) in enumerate(points):
+            for x, y in (s, e):
+                x0 = math.floor((x - tolerance) / cell)
+                x1 = math.floor((x + tolerance) / cell)
+                y0 = math.floor((y - tolerance) / cell)
+                y1 = math.floor((y + tolerance) / cell)
+                grid.setdefault((x0, y0), []).append(i)
+                if x0 != x1:
+                    grid.setdefault((x1, y0), []).append(i)
+                if y0 != y1:
+                    grid.setdefault((x0, y1), []).append(i)
+                    if x0 != x1:
+                        grid.setdefault((x1, y1), []).append(i)
+
+        def near(sx, sy, ex, ey):
+            d2 = (sx - ex) ** 2 + (sy - ey) ** 2
+            err = EPS2 * ((abs(sx) + abs(ex)) ** 2
+                          + (abs(sy) + abs(ey)) ** 2
+                          + 1.0)
+            return d2 < err
+
         # ---
+        used = [False] * len(entities)
+        first = 0  # first entity not used
+
         def pushStart():
             # Find starting point and add it to the new list
             start = Entity("@START", self.name)
-            s = self.entities[0].start()
+            s = entities[first].start()
             start._initCache(s, s)
             new.append(start)
 
@@ -740,37 +828,45 @@ class Layer:
         pushStart()
 
         # Repeat until all entities are used
-        while self.entities:
+        left = len(entities)
+        while left:
             # End point
             ex, ey = new[-1].end()
 
-            # Find the entity that starts after the last one
-            for i, entity in enumerate(self.entities):
-                # Try starting point
-                sx, sy = entity.start()
-                d2 = (sx - ex) ** 2 + (sy - ey) ** 2
-                err = EPS2 * ((abs(sx) + abs(ex)) ** 2
-                              + (abs(sy) + abs(ey)) ** 2
-                              + 1.0)
-                if d2 < err:
-                    new.append(entity)
-                    del self.entities[i]
-                    break
-
-                # Try ending point (inverse)
-                sx, sy = entity.end()
-                d2 = (sx - ex) ** 2 + (sy - ey) ** 2
-                err = EPS2 * ((abs(sx) + abs(ex)) ** 2
-                              + (abs(sy) + abs(ey)) ** 2
-                              + 1.0)
-                if d2 < err:
+            # Find the first entity that starts or ends at the end point
+            best = len(entities)
+            reverse = False
+            bucket = grid.get((math.floor(ex / cell), math.floor(ey / cell)))
+            if bucket:
+                alive = [i for i in bucket if not used[i]]
+                if len(alive) < len(bucket):
+                    bucket[:] = alive
+                for i in alive:
+                    if i >= best:
+                        continue
+                    # Try starting point, then ending point (inverse)
+                    entity = entities[i]
+                    sx, sy = entity.start()
+                    if near(sx, sy, ex, ey):
+                        best = i
+                        reverse = False
+                        continue
+                    sx, sy = entity.end()
+                    if near(sx, sy, ex, ey):
+                        best = i
+                        reverse = True
+
+            if best < len(entities):
+                entity = entities[best]
+                if reverse:
                     entity.invert()
-                    new.append(entity)
-                    del self.entities[i]
-                    break
-
+                new.append(entity)
+                used[best] = True
+                left -= 1
             else:
                 # Not found push a new start point and
+                while used[first]:
+                    first += 1
                 pushStart()
 
         self.entities = new
@@ -855,6 +951,8 @@ class Block(dict):
 # DXF importer/exporter class
 # =============================================================================
 class DXF:
+    bulk = True  # read and convert the whole file when opening
+
     # Default drawing units for AutoCAD DesignCenter blocks:
     UNITLESS = 0
     INCHES = 1
@@ -918,6 +1016,9 @@ class DXF:
         self.layers = {}  # entities per layer diction of lists
         self.blocks = {}
         self._saved = None
+        self._tags = None  # pairs read at once in bulk mode
+        self._values = None
+        self._pos = 0
         self.splineSegs = 8
         self.vars = {}
         errors.clear()
@@ -959,6 +1060,59 @@ class DXF:
         """Open filename for reading or writing"""
         self._f = open(filename, mode)
         self.init()
+        if "r" in mode and DXF.bulk:
+            self._tokenize(self._f.read())
+
+    # ----------------------------------------------------------------------
+    def _tokenize(self, text):
+        """Split the whole text in the tag,value pairs returned by read()
+        converting the values of every type at once"""
+        lines = text.split("\n")
+        if lines[-1] == "":
+            del lines[-1]  # trailing newline
+        tags = lines[0::2]
+        values = lines[1::2]
+        if len(values) < len(tags):
+            values.append("")
+        try:
+            # few distinct tags, convert each one once
+            table = {tag: int(tag) for tag in set(tags)}
+            tags = list(map(table.__getitem__, tags))
+            values = list(map(str.strip, values))
+            for kind, group in ((float, FLOAT_TAGS), (int, INT_TAGS)):
+                idx = list(compress(range(len(tags)),
+                                    map(group.__contains__, tags)))
+                converted = list(map(kind, map(values.__getitem__, idx)))
+                for i, value in zip(idx, converted):
+                    values[i] = value
+        except ValueError:
+            # report the errors and resynchronize as read() does
+            self._tokenizeLines(lines)
+            return
+        self._tags = tags
+        self._values = values
+        self._pos = 0
+
+    # ----------------------------------------------------------------------
+    def _tokenizeLines(self, lines):
+        """Line by line version of _tokenize() for files with errors"""
+        self._tags = tags = []
+        self._values = values = []
+        self._pos = 0
+        i = 0
+        while i < len(lines):
+            line = lines[i] + "\n"
+            i += 1
+            tag = self._tag(line)
+            value = None
+            if tag is not None:
+                value = self._value(line, tag,
+                                    lines[i] if i < len(lines) else "")
+                i += 1
+                if value is None:
+                    tag = None
+            tags.append(tag)
+            values.append(value)
 
     # ----------------------------------------------------------------------
     def close(self):
@@ -1007,52 +1161,62 @@ class DXF:
             self._saved = None
             return tv
 
+        # pairs tokenized when opening
+        if self._tags is not None:
+            pos = self._pos
+            if pos >= len(self._tags):
+                return None, None
+            self._pos = pos + 1
+            return self._tags[pos], self._values[pos]
+
         # read the tag
         line = self._f.readline()
         if not line:
             return None, None
+        tag = self._tag(line)
+        if tag is None:
+            return None, None
+
+        # and the value
+        value = self._value(line, tag, self._f.readline())
+        if value is None:
+            return None, None
+        return tag, value
+
+    # ----------------------------------------------------------------------
+    def _tag(self, line):
+        """Convert the tag line, None on errors"""
         try:
-            tag = int(line.strip())
+            return int(line.strip())
         except Exception:
             error(f"Error reading line {line}, tag was expected\n")
-            return None, None
+            return None
 
-        # and the value
-        value = self._f.readline().strip()
+    # ----------------------------------------------------------------------
+    def _value(self, line, tag, value):
+        """Convert the value line of tag, None on errors"""
+        value = value.strip()
 
         # change the type depending on the tag range
         # float
-        if (
-            10 <= tag <= 59
-            or 140 <= tag <= 147
-            or 210 <= tag <= 239
-            or 1010 <= tag <= 1059
-        ):
+        if tag in FLOAT_TAGS:
             try:
                 value = float(value)
             except Exception:
                 error(f"Error reading line '{line}', tag={int(tag)}, "
                       + f"floating point expected found \"{value}\"\n")
-                return None, None
+                return None
 
         # int
-        elif (
-            60 <= tag <= 79
-            or 90 <= tag <= 99
-            or 170 <= tag <= 175
-            or 280 <= tag <= 289
-            or 370 <= tag <= 389
-            or 400 <= tag <= 409
-            or 1060 <= tag <= 1071
-        ):
+        elif tag in INT_TAGS:
             try:
                 value = int(value)
             except Exception:
                 error(f"Error reading line '{line}', tag={int(tag)}, "
                       + f"integer expected found \"{value}\"\n")
-                return None, None
+                return None
 
-        return tag, value
+        return value
 
     # ----------------------------------------------------------------------
     def peek(self):
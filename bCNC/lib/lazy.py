@@ -0,0 +1,183 @@
+# Lazy import of the heavy optional modules and import time report
+#
+# Usage:
+#       plt = lazy.lazyImport("matplotlib.pyplot")
+#       ...
+#       plt.show()      # matplotlib is imported here
+#
+# ImportTimer measures the time spent executing every imported module,
+# in the same spirit as "python -X importtime"
+
+import importlib
+import importlib.util
+import sys
+import time
+
+
+# -----------------------------------------------------------------------------
+# Return True if the top level package of name can be imported,
+# without importing it
+# -----------------------------------------------------------------------------
+def available(name):
+    top = name.partition(".")[0]
+    if top in sys.modules:
+        return sys.modules[top] is not None
+    try:
+        return importlib.util.find_spec(top) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# =============================================================================
+# Module proxy importing the real module on the first attribute access
+# =============================================================================
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    # ----------------------------------------------------------------------
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self._name)
+            self.__dict__["_module"] = module
+        return module
+
+    # ----------------------------------------------------------------------
+    def loaded(self):
+        return self.__dict__["_module"] is not None
+
+    # ----------------------------------------------------------------------
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    # ----------------------------------------------------------------------
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    # ----------------------------------------------------------------------
+    def __dir__(self):
+        return dir(self._load())
+
+    # ----------------------------------------------------------------------
+    def __repr__(self):
+        if self.loaded():
+            return repr(self._module)
+        return f"<lazy module '{self._name}'>"
+
+
+# -----------------------------------------------------------------------------
+# Return the module if already imported, a lazy proxy otherwise
+# -----------------------------------------------------------------------------
+def lazyImport(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+# =============================================================================
+# Loader wrapper timing the execution of a module
+# =============================================================================
+class _TimedLoader:
+    def __init__(self, timer, loader):
+        self._timer = timer
+        self._loader = loader
+
+    # ----------------------------------------------------------------------
+    def create_module(self, spec):
+        create = getattr(self._loader, "create_module", None)
+        if create is None:
+            return None
+        spec.loader = self._loader
+        try:
+            return create(spec)
+        finally:
+            spec.loader = self
+
+    # ----------------------------------------------------------------------
+    def exec_module(self, module):
+        # restore the real loader, some modules inspect it
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        self._timer.enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.leave(module.__name__)
+
+    # ----------------------------------------------------------------------
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+
+# =============================================================================
+# Meta path finder recording the self and cumulative import time of
+# every module imported while installed
+# =============================================================================
+class ImportTimer:
+    def __init__(self):
+        self.times = []  # (self, cumulative, name) in import order
+        self._stack = []  # [start, children time]
+        self._start = time.perf_counter()
+
+    # ----------------------------------------------------------------------
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        self._start = time.perf_counter()
+
+    # ----------------------------------------------------------------------
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    # ----------------------------------------------------------------------
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find = getattr(finder, "find_spec", None)
+            if find is None:
+                continue
+            spec = find(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(self, spec.loader)
+        return spec
+
+    # ----------------------------------------------------------------------
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    # ----------------------------------------------------------------------
+    def leave(self, name):
+        start, children = self._stack.pop()
+        cumulative = time.perf_counter() - start
+        if self._stack:
+            self._stack[-1][1] += cumulative
+        self.times.append((cumulative - children, cumulative, name))
+
+    # ----------------------------------------------------------------------
+    # Write the report of the slowest imports
+    # @param limit maximum number of lines, None for all modules
+    # ----------------------------------------------------------------------
+    def report(self, file=None, limit=40):
+        if file is None:
+            file = sys.stderr
+        elapsed = time.perf_counter() - self._start
+        total = sum(t[0] for t in self.times)
+        file.write(f"import time: {len(self.times)} modules "
+                   f"{total * 1e3:.0f} ms of {elapsed * 1e3:.0f} ms\n")
+        file.write("import time: self [ms] | cumulative | imported package\n")
+        times = sorted(self.times, key=lambda t: -t[1])
+        if limit is not None:
+            times = times[:limit]
+        for selft, cumulative, name in times:
+            file.write(f"import time: {selft * 1e3:9.1f} | "
+                       f"{cumulative * 1e3:10.1f} | {name}\n")
@@ -0,0 +1,169 @@
+# Machine state reported by the controller
+#
+# MachineState holds the values of the last status reports, and History
+# the timestamped positions, feed and buffer fill of every report in a
+# numpy ring buffer, for the canvas, the pendant or any analysis of a run
+# to read at their own pace.
+
+import threading
+import time
+
+import numpy as np
+
+AXES = "xyzabc"
+HISTORY = 36000  # status reports kept, one hour at 10 Hz
+BATCH = 256  # records appended to the ring at once
+
+
+# =============================================================================
+# Ring buffer of the status reports.
+# Records are appended by a single thread, the one reading the controller,
+# to a flat list of the reported values without locking, and copied to the
+# numpy array in batches, or when they are read, computing the work
+# position from the offset, that changes rarely. count is the number of
+# records ever appended, and the sequence number of the next one
+# =============================================================================
+class History:
+    DTYPE = np.dtype(
+        [("t", "f8")]
+        + [(f"m{axis}", "f8") for axis in AXES]
+        + [(f"w{axis}", "f8") for axis in AXES]
+        + [("feed", "f8"),
+           ("spindle", "f8"),
+           ("planner", "f8"),
+           ("rxbytes", "f8")]
+    )
+    # values of a pending record: t, mpos, feed, spindle, planner, rxbytes
+    PENDING = 1 + len(AXES) + 4
+
+    def __init__(self, size=HISTORY):
+        self._ring = np.zeros((max(1, size), len(self.DTYPE.names)))
+        self.data = self._ring.view(self.DTYPE)[:, 0]
+        self._flushed = 0  # records copied to the ring
+        self._wco = np.zeros(len(AXES))
+        self._pending = []
+        self._lock = threading.Lock()
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return min(self.count, len(self.data))
+
+    # ----------------------------------------------------------------------
+    @property
+    def count(self):
+        return self._flushed + len(self._pending) // self.PENDING
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        with self._lock:
+            del self._pending[:]
+            self._flushed = 0
+
+    # ----------------------------------------------------------------------
+    # Append a record, the list is extended at once so readers never see
+    # a partial record
+    # @param t time of the report
+    # @param mpos machine position of all the AXES
+    # ----------------------------------------------------------------------
+    def append(self, t, mpos, feed, spindle, planner, rxbytes):
+        pending = self._pending
+        pending += (t, *mpos, feed, spindle, planner, rxbytes)
+        if len(pending) >= BATCH * self.PENDING:
+            with self._lock:
+                self._flush()
+
+    # ----------------------------------------------------------------------
+    # Set the work offset of the next records
+    # ----------------------------------------------------------------------
+    def setOffset(self, wco):
+        with self._lock:
+            self._flush()
+            self._wco[:] = wco
+
+    # ----------------------------------------------------------------------
+    # Copy the pending records to the ring, the lock must be held
+    # ----------------------------------------------------------------------
+    def _flush(self):
+        k = len(self._pending)
+        if k == 0:
+            return
+        values = np.array(self._pending[:k]).reshape(-1, self.PENDING)
+        del self._pending[:k]
+        size = len(self.data)
+        start = self._flushed
+        self._flushed += len(values)
+        if len(values) > size:
+            values = values[-size:]
+            start = self._flushed - size
+        n = len(AXES)
+        records = np.empty((len(values), self._ring.shape[1]))
+        records[:, :1 + n] = values[:, :1 + n]
+        records[:, 1 + n:1 + 2 * n] = values[:, 1:1 + n] - self._wco
+        records[:, 1 + 2 * n:] = values[:, 1 + n:]
+        self._ring[np.arange(start, self._flushed) % size] = records
+
+    # ----------------------------------------------------------------------
+    # @return a copy of the records with sequence number start or later
+    #         still in the ring, oldest first
+    # ----------------------------------------------------------------------
+    def since(self, start):
+        with self._lock:
+            self._flush()
+            count = self._flushed
+            start = max(start, count - len(self.data), 0)
+            return self.data[np.arange(start, count) % len(self.data)]
+
+    # ----------------------------------------------------------------------
+    # @return a copy of the last n records, all if n is None, oldest first
+    # ----------------------------------------------------------------------
+    def last(self, n=None):
+        if n is None:
+            return self.since(0)
+        return self.since(self.count - n)
+
+
+# =============================================================================
+# Values of the last status reports of the controller, in machine units
+# =============================================================================
+class MachineState:
+    def __init__(self, history=HISTORY):
+        self.state = ""
+        self.axes = 3  # number of axes reported
+        self.mpos = [0.0] * len(AXES)  # machine position
+        self.wco = [0.0] * len(AXES)  # work coordinates offset
+        self.feed = 0.0
+        self.spindle = 0.0
+        self.planner = 0  # free blocks of the planner buffer
+        self.rxbytes = 0  # free bytes of the serial receive buffer
+        self.override = [100, 100, 100]  # feed, rapid, spindle %
+        self.pins = ""
+        self.accessories = ""
+        self.line = 0  # line number executing
+        self.time = 0.0  # time of the last position report
+        self.history = History(history)
+
+    # ----------------------------------------------------------------------
+    # Work position
+    # ----------------------------------------------------------------------
+    @property
+    def wpos(self):
+        return [m - o for m, o in zip(self.mpos, self.wco)]
+
+    # ----------------------------------------------------------------------
+    # Set the machine position and record it in the history
+    # @param t time of the report, now if None
+    # ----------------------------------------------------------------------
+    def setPosition(self, mpos, t=None):
+        self.mpos = mpos
+        self.time = time.time() if t is None else t
+        self.history.append(self.time, mpos, self.feed, self.spindle,
+                            self.planner, self.rxbytes)
+
+    # ----------------------------------------------------------------------
+    # Set the work coordinates offset, the controller resends it unchanged
+    # periodically
+    # ----------------------------------------------------------------------
+    def setOffset(self, wco):
+        if wco != self.wco:
+            self.history.setOffset(wco)
+        self.wco = wco
@@ -0,0 +1,149 @@
+# Motion planner simulator estimating the machining time
+#
+# Follows the GRBL planner model:
+#   - every motion is split in linear segments, each one a planner block
+#   - the nominal speed of a segment is the feed limited by the per axis
+#     maximum rates ($110..) and its acceleration the per axis maximum
+#     accelerations ($120..) projected on the direction of motion
+#   - the speed through a junction is limited by the junction deviation
+#     ($11) and the angle between the segments
+#   - only the blocks in the planner buffer are looked ahead, the last
+#     one must always be able to stop
+#   - every segment follows a trapezoidal velocity profile
+#
+# The look-ahead recurrences are solved on the squared speeds as running
+# minima of prefix sums, so a whole program is planned with numpy array
+# operations only.
+
+import numpy as np
+
+PLANNER_BLOCKS = 15  # look-ahead, GRBL BLOCK_BUFFER_SIZE - 1
+FEED_LIMIT = 0.95  # segments not reaching this fraction of their feed
+MINIMUM_LENGTH = 1e-6  # shorter segments are skipped like in GRBL
+JUNCTION_COS = 0.999999  # limits for straight and reversing junctions
+JUNCTION_DEVIATION = 0.01  # mm, GRBL default $11
+SYNC_MCODES = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 30)  # stop the motion
+
+
+# -----------------------------------------------------------------------------
+# Plan the motions and return their duration
+#
+# @param points  (N,3) vertices of all motions
+# @param start   (M+1,) offset of every motion in points, each motion
+#                starts from the last point of the previous one
+# @param feed    (M,) feed rate of every motion in units/min,
+#                inf for rapid motions
+# @param stop    (M,) True where the machine stops before the motion
+#                (program pause, spindle/coolant synchronization, dwell)
+# @param rate    (3,) maximum rate of X, Y, Z in units/min
+# @param accel   (3,) acceleration of X, Y, Z in units/min^2
+# @param junction junction deviation in units
+# @param blocks  planner look-ahead in segments
+# @return (time, limited) arrays (M,) with the time in min of every
+#         motion and True for the motions having a segment whose length
+#         does not allow to reach FEED_LIMIT of its nominal speed
+# -----------------------------------------------------------------------------
+def plan(points, start, feed, stop, rate, accel, junction,
+         blocks=PLANNER_BLOCKS):
+    points = np.asarray(points, dtype=float)
+    start = np.asarray(start)
+    nmotions = len(start) - 1
+    time = np.zeros(nmotions)
+    limited = np.zeros(nmotions, dtype=bool)
+    if nmotions == 0:
+        return time, limited
+
+    # segments between the consecutive points of every motion
+    count = np.diff(start)
+    begins = np.ones(len(points), dtype=bool)
+    begins[start[1:][count > 0] - 1] = False
+    index = np.nonzero(begins)[0]
+    motion = np.repeat(np.arange(nmotions), np.maximum(count - 1, 0))
+    delta = points[index + 1] - points[index]
+    length = np.sqrt((delta * delta).sum(axis=1))
+
+    keep = length > MINIMUM_LENGTH
+    motion = motion[keep]
+    delta = delta[keep]
+    length = length[keep]
+    n = len(length)
+    if n == 0:
+        return time, limited
+
+    # a segment starts at rest after a stop, also when it is recorded
+    # on a motion without any segment
+    stops = np.cumsum(np.asarray(stop, dtype=bool))[motion]
+    rest = np.ones(n, dtype=bool)
+    rest[1:] = stops[1:] != stops[:-1]
+
+    # nominal speed and acceleration along the segment
+    rate = np.asarray(rate, dtype=float)
+    accel = np.asarray(accel, dtype=float)
+    unit = delta / length[:, None]
+    absunit = np.abs(unit)
+    with np.errstate(divide="ignore"):
+        speed = np.min(rate / absunit, axis=1)
+        acceleration = np.min(accel / absunit, axis=1)
+    feed = np.asarray(feed, dtype=float)[motion]
+    speed = np.where(feed > 0.0, np.minimum(feed, speed), speed)
+    nominal2 = speed * speed
+
+    # maximum junction speed with the previous segment
+    junction2 = np.zeros(n)
+    cos = -(unit[1:] * unit[:-1]).sum(axis=1)
+    vector = unit[1:] - unit[:-1]
+    norm = np.sqrt((vector * vector).sum(axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccel = np.min(
+            accel * norm[:, None] / np.abs(vector), axis=1)
+        sin = np.sqrt(np.maximum(0.5 * (1.0 - cos), 0.0))
+        junction2[1:] = jaccel * junction * sin / (1.0 - sin)
+    junction2[1:][cos > JUNCTION_COS] = 0.0  # reversal
+    junction2[1:][cos < -JUNCTION_COS] = np.inf  # straight
+    entry2 = np.minimum(junction2, nominal2)
+    entry2[1:] = np.minimum(entry2[1:], nominal2[:-1])
+    entry2[rest] = nominal2[rest]
+
+    # speed^2 gained/lost over a segment, and its prefix sums
+    gain = 2.0 * acceleration * length
+    total = np.zeros(n + 1)
+    np.cumsum(gain, out=total[1:])
+    before = total[:-1]
+
+    # look-ahead: stop at the end of the planner buffer
+    ahead = np.minimum(np.arange(n) + blocks, n)
+    buffer2 = total[ahead] - before
+
+    # segments too short to reach the feed even entering and leaving at
+    # the highest speed the junctions and the look-ahead allow. A buffer
+    # reaching a stop or the program end is not limited by the lengths
+    rests = np.zeros(n + 1, dtype=int)
+    np.cumsum(rest, out=rests[1:])
+    full = (ahead < n) & (rests[ahead] == rests[1:])
+    limit2 = np.where(full, np.minimum(entry2, buffer2), entry2)
+    exit2 = nominal2.copy()
+    exit2[:-1] = np.where(rest[1:], nominal2[:-1], limit2[1:])
+    short = (np.minimum(nominal2, 0.5 * (gain + limit2 + exit2))
+             < FEED_LIMIT * FEED_LIMIT * nominal2)
+
+    entry2 = np.minimum(entry2, buffer2)
+    entry2[rest] = 0.0
+
+    # backward pass: entry2[i] <= entry2[i+1] + gain[i]
+    entry2 = np.minimum.accumulate((entry2 + before)[::-1])[::-1] - before
+    # forward pass: entry2[i+1] <= entry2[i] + gain[i]
+    entry2 = np.minimum.accumulate(entry2 - before) + before
+    entry2 = np.maximum(entry2, 0.0)
+    exit2 = np.zeros(n)
+    exit2[:-1] = entry2[1:]
+
+    # trapezoidal or triangular velocity profile
+    peak2 = np.minimum(nominal2, 0.5 * (gain + entry2 + exit2))
+    peak = np.sqrt(peak2)
+    cruise = length - (2.0 * peak2 - entry2 - exit2) / (2.0 * acceleration)
+    t = ((2.0 * peak - np.sqrt(entry2) - np.sqrt(exit2)) / acceleration
+         + np.maximum(cruise, 0.0) / peak)
+
+    time += np.bincount(motion, weights=t, minlength=nmotions)
+    limited[motion[short]] = True
+    return time, limited
@@ -0,0 +1,153 @@
+# Terminal log model
+#
+# RingLog keeps the last lines of a log in a fixed size ring buffer and
+# remembers what changed since it was last drawn, so a Listbox can be
+# brought up to date with one delete and one insert per frame, however
+# many lines arrived in between.
+#
+# LogFile appends the complete session log to a file from a background
+# thread, so writing to the disk never delays the caller.
+
+import threading
+import time
+from collections import deque
+from itertools import islice
+from queue import Empty, Queue
+from tkinter import END
+
+LINES = 1000  # default number of lines kept
+
+
+# =============================================================================
+# Ring buffer of (line, color) items mirrored in a Listbox of _rows rows.
+# The first _dirty items are displayed on the listbox after the first
+# _dropped rows, that are removed from the ring since the last render
+# =============================================================================
+class RingLog:
+    def __init__(self, size=LINES):
+        self.items = deque(maxlen=max(1, size))
+        self._dirty = 0
+        self._dropped = 0
+        self._rows = 0
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.items)
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, i):
+        return self.items[i][0]
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        for line, color in self.items:
+            yield line
+
+    # ----------------------------------------------------------------------
+    # Remove the first item
+    # ----------------------------------------------------------------------
+    def _popleft(self):
+        if self._dirty:
+            self._dirty -= 1
+            self._dropped += 1
+        return self.items.popleft()[0]
+
+    # ----------------------------------------------------------------------
+    def append(self, line, color=None):
+        if len(self.items) == self.items.maxlen:
+            self._popleft()
+        self.items.append((line, color))
+
+    # ----------------------------------------------------------------------
+    # Insert a line before position pos, dropping the oldest line when
+    # the ring is full
+    # ----------------------------------------------------------------------
+    def insert(self, pos, line, color=None):
+        if len(self.items) == self.items.maxlen:
+            self._popleft()
+            pos -= 1
+        pos = min(max(0, pos), len(self.items))
+        self.items.insert(pos, (line, color))
+        self._dirty = min(self._dirty, pos)
+
+    # ----------------------------------------------------------------------
+    # Remove and return the first line, an empty string if there is none
+    # ----------------------------------------------------------------------
+    def popleft(self):
+        if not self.items:
+            return ""
+        return self._popleft()
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        self.items.clear()
+        self._dirty = 0
+
+    # ----------------------------------------------------------------------
+    # @return True if the listbox is not up to date
+    # ----------------------------------------------------------------------
+    def modified(self):
+        return (self._dropped > 0
+                or self._dirty < len(self.items)
+                or self._dirty < self._rows)
+
+    # ----------------------------------------------------------------------
+    # Bring the listbox up to date with the ring
+    # @return True if the listbox was modified
+    # ----------------------------------------------------------------------
+    def render(self, listbox):
+        if not self.modified():
+            return False
+        listbox.delete(self._dropped + self._dirty, END)
+        if self._dropped:
+            listbox.delete(0, self._dropped - 1)
+        new = list(islice(self.items, self._dirty, None))
+        if new:
+            listbox.insert(END, *[line for line, color in new])
+            for i, (line, color) in enumerate(new, self._dirty):
+                if color:
+                    listbox.itemconfig(i, foreground=color)
+        self._dirty = self._rows = len(self.items)
+        self._dropped = 0
+        return True
+
+
+# =============================================================================
+# Session log written to a file by a background thread
+# =============================================================================
+class LogFile:
+    def __init__(self, filename):
+        self._file = open(filename, "a")
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    # ----------------------------------------------------------------------
+    # Queue a line to be written with the current time and a tag
+    # ----------------------------------------------------------------------
+    def write(self, line, tag=""):
+        self._queue.put((time.time(), tag, line))
+
+    # ----------------------------------------------------------------------
+    # Write everything queued, and flush once the queue is empty
+    # ----------------------------------------------------------------------
+    def _write(self):
+        item = self._queue.get()
+        while item is not None:
+            t, tag, line = item
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+            self._file.write(f"{stamp}.{int(t * 1000) % 1000:03d} "
+                             f"{tag} {line}\n")
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                self._file.flush()
+                item = self._queue.get()
+        self._file.close()
+
+    # ----------------------------------------------------------------------
+    # Write the pending lines and close the file
+    # ----------------------------------------------------------------------
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
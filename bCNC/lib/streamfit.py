@@ -0,0 +1,238 @@
+# Arc fitting and colinear merging of linear motions while streaming
+#
+# A run of consecutive G1 motions is replaced by fewer motions deviating
+# at most by a tolerance from the original vertices:
+#   - colinear lines are merged when every intermediate vertex lies within
+#     the tolerance from the merged line, moving always forward
+#   - lines on a constant Z are replaced by an XY arc when every vertex is
+#     within the tolerance from the circle, the sagitta of every original
+#     line is within the tolerance and the vertices turn in one direction
+#
+# The fitting is greedy, the longest primitive starting from the current
+# vertex is taken. Its end is searched with a galloping then a binary
+# search, so a run of n vertices is fitted in O(n log n) numpy operations.
+
+import math
+
+import numpy as np
+
+import planner
+
+MIN_ARC_SEGMENTS = 3  # shortest run of lines replaced by an arc
+ARC_TOLERANCE = 0.002  # mm, GRBL default $12
+EPSILON = 1e-9
+
+
+# -----------------------------------------------------------------------------
+# Return the largest end in [lo, hi] accepted by valid(), lo must be valid
+# -----------------------------------------------------------------------------
+def _search(valid, lo, hi):
+    step = 1
+    while lo < hi:
+        end = min(lo + step, hi)
+        if not valid(end):
+            hi = end - 1
+            break
+        lo = end
+        step *= 2
+    while lo < hi:
+        end = (lo + hi + 1) // 2
+        if valid(end):
+            lo = end
+        else:
+            hi = end - 1
+    return lo
+
+
+# -----------------------------------------------------------------------------
+# @return True if points can be replaced by a line from the first to the last
+# -----------------------------------------------------------------------------
+def _isLine(points, tolerance):
+    chord = points[-1] - points[0]
+    length = math.sqrt(chord @ chord)
+    delta = points[1:-1] - points[0]
+    if length < EPSILON:
+        return bool(((delta * delta).sum(axis=1) <= tolerance**2).all())
+    unit = chord / length
+    along = delta @ unit
+    across = delta - along[:, None] * unit
+    if ((across * across).sum(axis=1) > tolerance**2).any():
+        return False
+    # no backward motion along the line
+    along = np.concatenate(([0.0], along, [length]))
+    return bool((np.diff(along) >= -tolerance).all())
+
+
+# -----------------------------------------------------------------------------
+# @return (center, cw) of the XY arc replacing the points, None if they
+#         cannot be replaced by an arc
+# -----------------------------------------------------------------------------
+def _arc(points, tolerance):
+    z = points[:, 2]
+    if z.max() - z.min() > tolerance:
+        return None
+
+    # circle through the first, middle and last point
+    xy = points[:, :2]
+    a = xy[0]
+    b = xy[len(xy) // 2] - a
+    c = xy[-1] - a
+    d = 2.0 * (b[0] * c[1] - b[1] * c[0])
+    if abs(d) < EPSILON:
+        return None
+    bb = b @ b
+    cc = c @ c
+    center = a + np.array([c[1] * bb - b[1] * cc, b[0] * cc - c[0] * bb]) / d
+    radius = math.sqrt((a - center) @ (a - center))
+
+    # vertices on the circle
+    vector = xy - center
+    distance = np.sqrt((vector * vector).sum(axis=1))
+    if (np.abs(distance - radius) > tolerance).any():
+        return None
+
+    # lines close to the arc
+    chord = np.diff(xy, axis=0)
+    half = 0.5 * np.sqrt((chord * chord).sum(axis=1))
+    if (half > radius).any():
+        return None
+    if (radius - np.sqrt(radius * radius - half * half) > tolerance).any():
+        return None
+
+    # turning always in the same direction, less than a full circle
+    angle = np.diff(np.unwrap(np.arctan2(vector[:, 1], vector[:, 0])))
+    if (angle > 0.0).all():
+        cw = False
+    elif (angle < 0.0).all():
+        cw = True
+    else:
+        return None
+    if abs(angle.sum()) >= 2.0 * math.pi - EPSILON:
+        return None
+    return center, cw
+
+
+# -----------------------------------------------------------------------------
+# Fit the lines joining consecutive points
+#
+# @param points    (N,3) vertices, the first one is the starting position
+# @param tolerance maximum deviation from the original vertices
+# @param arcs      allow XY arcs
+# @return list of (end, center, cw) for every fitted motion, end is the
+#         index of its last point, center the (x,y) center of an arc or
+#         None for a line. The last motion is always a line, keeping the
+#         controller in G1 after the run
+# -----------------------------------------------------------------------------
+def fit(points, tolerance, arcs=True):
+    points = np.asarray(points, dtype=float)
+    n = len(points) - 1
+    motions = []
+    start = 0
+    while start < n:
+        end = _search(
+            lambda e: _isLine(points[start:e + 1], tolerance),
+            start + 1, n)
+
+        # an arc must be longer than the line and never reach the last point
+        lo = max(start + MIN_ARC_SEGMENTS, end + 1)
+        if arcs and lo <= n - 1 \
+                and _arc(points[start:lo + 1], tolerance) is not None:
+            lo = _search(
+                lambda e: _arc(points[start:e + 1], tolerance) is not None,
+                lo, n - 1)
+            center, cw = _arc(points[start:lo + 1], tolerance)
+            motions.append((lo, (center[0], center[1]), cw))
+            start = lo
+            continue
+
+        motions.append((end, None, False))
+        start = end
+    return motions
+
+
+# -----------------------------------------------------------------------------
+# Split an XY arc in segments the way GRBL does, with a chord error of
+# tolerance
+# @return (K,3) points following the start point, ending on end
+# -----------------------------------------------------------------------------
+def arcPoints(start, end, center, cw, tolerance=ARC_TOLERANCE):
+    u0 = start[0] - center[0]
+    v0 = start[1] - center[1]
+    u1 = end[0] - center[0]
+    v1 = end[1] - center[1]
+    radius = math.hypot(u0, v0)
+    sweep = math.atan2(u0 * v1 - v0 * u1, u0 * u1 + v0 * v1)
+    if cw:
+        if sweep >= -EPSILON:
+            sweep -= 2.0 * math.pi
+    elif sweep <= EPSILON:
+        sweep += 2.0 * math.pi
+    length = abs(sweep) * radius
+    if tolerance < radius:
+        step = math.sqrt(tolerance * (2.0 * radius - tolerance))
+        segments = max(int(length / step), 1)
+    else:
+        segments = 1
+    t = np.arange(1, segments + 1) / segments
+    phi = math.atan2(v0, u0) + sweep * t
+    arc = np.empty((segments, 3))
+    arc[:, 0] = center[0] + radius * np.cos(phi)
+    arc[:, 1] = center[1] + radius * np.sin(phi)
+    arc[:, 2] = start[2] + (end[2] - start[2]) * t
+    arc[-1] = end
+    return arc
+
+
+# =============================================================================
+# Statistics of the fitted motions, with the machining time estimated by
+# the motion planner before and after the fitting
+# =============================================================================
+class FitStats:
+    def __init__(self, rate, accel, junction, arcTolerance=ARC_TOLERANCE):
+        self.rate = rate
+        self.accel = accel
+        self.junction = junction
+        self.arcTolerance = arcTolerance
+        self.lines = 0  # original lines
+        self.fitted = 0  # lines sent instead
+        self.arcs = 0  # arcs among them
+        self.time = 0.0  # min, planned time of the original lines
+        self.fittedTime = 0.0  # min, planned time of the fitted lines
+
+    # ----------------------------------------------------------------------
+    # Account a fitted run
+    # @param points  original vertices passed to fit()
+    # @param motions result of fit()
+    # @param feed    feed rate of the run
+    # ----------------------------------------------------------------------
+    def add(self, points, motions, feed):
+        points = np.asarray(points, dtype=float)
+        self.lines += len(points) - 1
+        self.fitted += len(motions)
+
+        path = [points[:1]]
+        start = 0
+        for end, center, cw in motions:
+            if center is None:
+                path.append(points[end:end + 1])
+            else:
+                self.arcs += 1
+                path.append(arcPoints(points[start], points[end], center, cw,
+                                      self.arcTolerance))
+            start = end
+        path = np.concatenate(path)
+
+        # both runs start and end at rest, not to depend on their neighbours
+        for vertices, attr in ((points, "time"), (path, "fittedTime")):
+            time, limited = planner.plan(vertices, [0, len(vertices)], [feed],
+                                   [True], self.rate, self.accel,
+                                   self.junction)
+            setattr(self, attr, getattr(self, attr) + time[0])
+
+    # ----------------------------------------------------------------------
+    def saved(self):
+        return self.lines - self.fitted
+
+    # ----------------------------------------------------------------------
+    def savedTime(self):
+        return self.time - self.fittedTime
@@ -0,0 +1,349 @@
+# Ordering of paths to minimize the travel between them
+#
+# Every node is a path with a start and an end point, and it can be
+# traversed backwards when reversible. The tour starts always from the
+# first node, in its direction, and is open at the end.
+#
+# The tour is built with a nearest neighbour search on a uniform grid of
+# the entry points, then improved with 2-opt and Or-opt moves restricted
+# to the nearest neighbours of every point, until no move improves it or
+# the time is over.
+
+import math
+import time
+from heapq import heappush, heappushpop
+
+NEIGHBOURS = 8  # candidates of every point for the improvement moves
+IMPROVE_TIME = 2.0  # s, maximum time spent improving the tour
+OR_SEGMENT = 3  # longest run of nodes moved by Or-opt
+EPSILON = 1e-9
+
+
+# =============================================================================
+# Uniform grid of points for nearest neighbour queries.
+# Points are referenced by their index in the x, y coordinate lists
+# =============================================================================
+class Grid:
+    def __init__(self, x, y, ids):
+        self.x = x
+        self.y = y
+        self.size = len(ids)
+        self.cells = {}
+        if not ids:
+            self.x0 = self.y0 = 0.0
+            self.cell = 1.0
+            self.nx = self.ny = 0
+            return
+        xs = [x[i] for i in ids]
+        ys = [y[i] for i in ids]
+        self.x0 = min(xs)
+        self.y0 = min(ys)
+        extent = max(max(xs) - self.x0, max(ys) - self.y0)
+        self.cell = extent / math.sqrt(len(ids)) if extent > 0.0 else 1.0
+        for i in ids:
+            self.cells.setdefault(self.key(x[i], y[i]), []).append(i)
+        self.nx = int((max(xs) - self.x0) / self.cell)
+        self.ny = int((max(ys) - self.y0) / self.cell)
+
+    # ----------------------------------------------------------------------
+    def key(self, x, y):
+        return (math.floor((x - self.x0) / self.cell),
+                math.floor((y - self.y0) / self.cell))
+
+    # ----------------------------------------------------------------------
+    # Points of the cells at Chebyshev distance r from cell (i, j)
+    # ----------------------------------------------------------------------
+    def ring(self, i, j, r):
+        cells = self.cells
+        if r == 0:
+            yield from cells.get((i, j), ())
+            return
+        for di in range(-r, r + 1):
+            yield from cells.get((i + di, j - r), ())
+            yield from cells.get((i + di, j + r), ())
+        for dj in range(-r + 1, r):
+            yield from cells.get((i - r, j + dj), ())
+            yield from cells.get((i + r, j + dj), ())
+
+    # ----------------------------------------------------------------------
+    # @return the k nearest points to (px, py) accepted by accept(),
+    #         as a sorted list of (distance, id)
+    # ----------------------------------------------------------------------
+    def nearest(self, px, py, k=1, accept=None):
+        x = self.x
+        y = self.y
+        i, j = self.key(px, py)
+        last = max(i, self.nx - i, j, self.ny - j)
+        heap = []  # max heap of the k nearest as (-distance, id)
+        r = 0
+        while r <= last:
+            for p in self.ring(i, j, r):
+                if accept is not None and not accept(p):
+                    continue
+                d = math.hypot(x[p] - px, y[p] - py)
+                if len(heap) < k:
+                    heappush(heap, (-d, p))
+                elif d < -heap[0][0]:
+                    heappushpop(heap, (-d, p))
+            # points of the next rings are at least r cells away
+            if len(heap) == k and -heap[0][0] <= r * self.cell:
+                break
+            r += 1
+        return sorted((-d, p) for d, p in heap)
+
+
+# =============================================================================
+# Tour of the nodes, with the entry and exit point of every node
+# depending on its direction. Point n+i is the end of node i
+# =============================================================================
+class Tour:
+    def __init__(self, starts, ends, reversible):
+        self.n = n = len(starts)
+        self.x = [float(p[0]) for p in starts] + [float(p[0]) for p in ends]
+        self.y = [float(p[1]) for p in starts] + [float(p[1]) for p in ends]
+        self.reversible = [bool(r) for r in reversible]
+        self.order = [0]
+        self.flipped = [False] * n
+        self.pos = [0] * n
+        self._grid = None
+        self._neighbours = {}
+
+    # ----------------------------------------------------------------------
+    def entry(self, node):
+        return node + self.n if self.flipped[node] else node
+
+    # ----------------------------------------------------------------------
+    def exit(self, node):
+        return node if self.flipped[node] else node + self.n
+
+    # ----------------------------------------------------------------------
+    def dist(self, p, q):
+        return math.hypot(self.x[p] - self.x[q], self.y[p] - self.y[q])
+
+    # ----------------------------------------------------------------------
+    # Travel length of the tour
+    # ----------------------------------------------------------------------
+    def length(self):
+        total = 0.0
+        for a, b in zip(self.order, self.order[1:]):
+            total += self.dist(self.exit(a), self.entry(b))
+        return total
+
+    # ----------------------------------------------------------------------
+    # Build the tour going every time to the closest entry point not
+    # visited yet, in either direction for the reversible nodes
+    # ----------------------------------------------------------------------
+    def nearestNeighbour(self):
+        n = self.n
+        visited = [False] * n
+        visited[0] = True
+        entries = [p for p in range(1, n)]
+        entries.extend(n + i for i in range(1, n) if self.reversible[i])
+
+        def alive(p):
+            return not visited[p % n]
+
+        grid = Grid(self.x, self.y, entries)
+        remaining = len(entries)
+        node = 0
+        order = [0]
+        for _ in range(n - 1):
+            p = self.exit(node)
+            d, q = grid.nearest(self.x[p], self.y[p], 1, alive)[0]
+            node = q % n
+            self.flipped[node] = q >= n
+            visited[node] = True
+            order.append(node)
+            remaining -= 2 if self.reversible[node] else 1
+            # rebuild the grid when most of its points are visited
+            if 0 < remaining < grid.size // 2:
+                grid = Grid(self.x, self.y,
+                            [p for p in entries if alive(p)])
+        self.order = order
+        self._index(0, n)
+
+    # ----------------------------------------------------------------------
+    # Update the position of the nodes at positions start..stop-1
+    # ----------------------------------------------------------------------
+    def _index(self, start, stop):
+        order = self.order
+        pos = self.pos
+        for k in range(start, stop):
+            pos[order[k]] = k
+
+    # ----------------------------------------------------------------------
+    # @return the NEIGHBOURS points nearest to point p, of other nodes
+    # ----------------------------------------------------------------------
+    def neighbours(self, p):
+        result = self._neighbours.get(p)
+        if result is None:
+            if self._grid is None:
+                self._grid = Grid(self.x, self.y, range(2 * self.n))
+            n = self.n
+            node = p % n
+            result = [
+                q for d, q in self._grid.nearest(
+                    self.x[p], self.y[p], NEIGHBOURS,
+                    lambda q: q % n != node)
+            ]
+            self._neighbours[p] = result
+        return result
+
+    # ----------------------------------------------------------------------
+    # Reverse the nodes at positions i..j of the tour
+    # ----------------------------------------------------------------------
+    def _reverse(self, i, j):
+        order = self.order
+        order[i:j + 1] = order[i:j + 1][::-1]
+        for k in range(i, j + 1):
+            node = order[k]
+            self.flipped[node] = not self.flipped[node]
+            self.pos[node] = k
+
+    # ----------------------------------------------------------------------
+    # 2-opt: reverse the nodes after position i, up to a node whose exit
+    # is close to the exit of the node at position i
+    # @return True if the tour was improved
+    # ----------------------------------------------------------------------
+    def _twoOpt(self, i):
+        order = self.order
+        n = self.n
+        a = order[i]
+        pa = self.exit(a)
+        pb = self.entry(order[i + 1])
+        old = self.dist(pa, pb)
+        for q in self.neighbours(pa):
+            new = self.dist(pa, q)
+            if new >= old:
+                break
+            c = q % n
+            j = self.pos[c]
+            if j <= i or self.exit(c) != q:
+                continue
+            if j + 1 < n:
+                pe = self.entry(order[j + 1])
+                delta = new + self.dist(pb, pe) - old - self.dist(q, pe)
+            else:
+                delta = new - old
+            if delta < -EPSILON and all(
+                    self.reversible[order[k]] for k in range(i + 1, j + 1)):
+                self._reverse(i + 1, j)
+                return True
+        return False
+
+    # ----------------------------------------------------------------------
+    # Or-opt: move the nodes at positions i..i+size-1 after a node whose
+    # exit is close to their entry, or to their exit moving them reversed
+    # @return True if the tour was improved
+    # ----------------------------------------------------------------------
+    def _orOpt(self, i, size):
+        order = self.order
+        n = self.n
+        last = i + size - 1
+        segment = order[i:last + 1]
+        s0 = self.entry(segment[0])
+        s1 = self.exit(segment[-1])
+        pp = self.exit(order[i - 1])
+        if last + 1 < n:
+            pn = self.entry(order[last + 1])
+            gain = self.dist(pp, s0) + self.dist(s1, pn) - self.dist(pp, pn)
+        else:
+            gain = self.dist(pp, s0)
+        if gain <= EPSILON:
+            return False
+        reversible = all(self.reversible[node] for node in segment)
+
+        for p, reverse in ((s0, False), (s1, True)):
+            if reverse and not reversible:
+                break
+            for q in self.neighbours(p):
+                add = self.dist(q, p)
+                if add >= gain:
+                    break
+                c = q % n
+                k = self.pos[c]
+                if i - 1 <= k <= last or self.exit(c) != q:
+                    continue
+                if k + 1 < n:
+                    pd = self.entry(order[k + 1])
+                    if reverse:
+                        add += self.dist(s0, pd)
+                    else:
+                        add += self.dist(s1, pd)
+                    add -= self.dist(q, pd)
+                if add < gain - EPSILON:
+                    self._move(i, last, k, reverse)
+                    return True
+        return False
+
+    # ----------------------------------------------------------------------
+    # Move the nodes at positions i..last after position k
+    # ----------------------------------------------------------------------
+    def _move(self, i, last, k, reverse):
+        order = self.order
+        segment = order[i:last + 1]
+        if reverse:
+            segment.reverse()
+            for node in segment:
+                self.flipped[node] = not self.flipped[node]
+        del order[i:last + 1]
+        if k > last:
+            k -= len(segment)
+            order[k + 1:k + 1] = segment
+            self._index(i, k + len(segment) + 1)
+        else:
+            order[k + 1:k + 1] = segment
+            self._index(k + 1, last + 1)
+
+    # ----------------------------------------------------------------------
+    # Improve the tour with 2-opt and Or-opt moves
+    # @param timeout maximum time in seconds
+    # ----------------------------------------------------------------------
+    def improve(self, timeout=IMPROVE_TIME):
+        deadline = time.perf_counter() + timeout
+        n = self.n
+        improved = True
+        while improved:
+            improved = False
+            for i in range(n - 1):
+                if time.perf_counter() > deadline:
+                    return
+                while self._twoOpt(i):
+                    improved = True
+                if i == 0:
+                    continue
+                for size in range(1, OR_SEGMENT + 1):
+                    if i + size > n:
+                        break
+                    if self._orOpt(i, size):
+                        improved = True
+                        break
+
+
+# -----------------------------------------------------------------------------
+# Order the nodes to minimize the travel from the end of every node to
+# the start of the next one
+#
+# @param starts     (x, y) start point of every node
+# @param ends       (x, y) end point of every node
+# @param reversible True for the nodes that can be traversed backwards
+# @param timeout    maximum time in seconds spent improving the tour
+# @return (order, flipped) the nodes in the order to visit them, and
+#         True for the nodes to traverse backwards
+# -----------------------------------------------------------------------------
+def optimize(starts, ends, reversible, timeout=IMPROVE_TIME):
+    tour = Tour(starts, ends, reversible)
+    if tour.n > 1:
+        tour.nearestNeighbour()
+        tour.improve(timeout)
+    return tour.order, tour.flipped
+
+
+# -----------------------------------------------------------------------------
+# @return travel length visiting the nodes in order
+# -----------------------------------------------------------------------------
+def length(starts, ends, order, flipped):
+    tour = Tour(starts, ends, [False] * len(starts))
+    tour.order = list(order)
+    tour.flipped = list(flipped)
+    return tour.length()
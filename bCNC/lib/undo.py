@@ -29,20 +29,63 @@
 #
 # Author:    Vasilis.Vlachoudis@cern.ch
 
+import sys
+
+
+# -----------------------------------------------------------------------------
+# @return an estimate of the bytes held by an undo record. Objects with an
+#         nbytes() method or attribute report their own storage, functions
+#         and numbers are not accounted
+# -----------------------------------------------------------------------------
+def sizeof(obj):
+    if isinstance(obj, (str, bytes)):
+        return sys.getsizeof(obj)
+    nbytes = getattr(obj, "nbytes", None)
+    if nbytes is not None:
+        return nbytes() if callable(nbytes) else int(nbytes)
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(map(sizeof, obj))
+    return 0
+
 
 # =============================================================================
 # Undo Redo Class
+# The memory of the records is tracked, and the oldest undo records are
+# dropped once it exceeds LIMIT
 # =============================================================================
 class UndoRedo:
+    LIMIT = 0  # bytes kept in the undo/redo records, 0 for no limit
+
     # -----------------------------------------------------------------------
     def __init__(self):
         self.undoList = []
         self.redoList = []
+        self._undoSize = []  # bytes of every record of undoList
+        self._redoSize = []
 
     # -----------------------------------------------------------------------
     def reset(self):
         del self.undoList[:]
         del self.redoList[:]
+        del self._undoSize[:]
+        del self._redoSize[:]
+
+    # -----------------------------------------------------------------------
+    # @return bytes held by the undo and redo records
+    # -----------------------------------------------------------------------
+    def memory(self):
+        return sum(self._undoSize) + sum(self._redoSize)
+
+    # -----------------------------------------------------------------------
+    # Drop the oldest undo records exceeding LIMIT, keeping the last one
+    # -----------------------------------------------------------------------
+    def _trim(self):
+        if self.LIMIT <= 0:
+            return
+        memory = self.memory()
+        while memory > self.LIMIT and len(self.undoList) > 1:
+            del self.undoList[0]
+            memory -= self._undoSize.pop(0)
 
     # -----------------------------------------------------------------------
     # Add undoinfo as (msg, func/list, args)
@@ -67,7 +110,10 @@ class UndoRedo:
             or isinstance(undoinfo[f], list)
         )
         self.undoList.append(undoinfo)
+        self._undoSize.append(sizeof(undoinfo))
         del self.redoList[:]
+        del self._redoSize[:]
+        self._trim()
 
     # -----------------------------------------------------------------------
     # Split the undoinfo into [msg, ]func/list [, args]
@@ -115,13 +161,21 @@ class UndoRedo:
     def undo(self):
         if not self.undoList:
             return
-        self.redoList.append(self._execute(self.undoList.pop()))
+        self._undoSize.pop()
+        redoinfo = self._execute(self.undoList.pop())
+        self.redoList.append(redoinfo)
+        self._redoSize.append(sizeof(redoinfo))
+        self._trim()
 
     # -----------------------------------------------------------------------
     def redo(self):
         if not self.redoList:
             return
-        self.undoList.append(self._execute(self.redoList.pop()))
+        self._redoSize.pop()
+        undoinfo = self._execute(self.redoList.pop())
+        self.undoList.append(undoinfo)
+        self._undoSize.append(sizeof(undoinfo))
+        self._trim()
 
     # -----------------------------------------------------------------------
     def canUndo(self):
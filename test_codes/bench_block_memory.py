@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Memory benchmark of the Block line storage
+#
+# Generates a program, splits it in blocks and measures with tracemalloc
+# the memory of plain Block lists against PackedBlock, together with the
+# canvas path ids and the time to iterate every line, then again after
+# computing the drawing geometry of every block as the canvas does.
+#
+# Usage:
+#       python test_codes/bench_block_memory.py [lines] [lines per block]
+
+import builtins
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path[:0] = [
+    os.path.join(os.path.dirname(__file__), "..", "bCNC"),
+    os.path.join(os.path.dirname(__file__), "..", "bCNC", "lib"),
+]
+builtins._ = lambda x: x  # normally installed by the gettext setup
+
+import CNC  # noqa: E402
+import CNCCanvas  # noqa: E402
+
+
+# -----------------------------------------------------------------------------
+# Canvas stand-in computing the drawing geometry of the blocks
+# -----------------------------------------------------------------------------
+class Drawer:
+    blockGeometry = CNCCanvas.CNCCanvas.blockGeometry
+    motionFeed = CNCCanvas.CNCCanvas.motionFeed
+
+    def __init__(self):
+        self.app = None
+        self.gcode = CNC.GCode()
+        self.cnc = self.gcode.cnc
+        self.cnc.initPath()
+
+    def update(self):
+        pass
+
+
+def draw(blocks):
+    drawer = Drawer()
+    for block in blocks:
+        drawer.blockGeometry(block)
+
+
+def program(n):
+    random.seed(0)
+    for i in range(n):
+        yield (f"G1 X{random.uniform(0, 300):.4f} "
+               f"Y{random.uniform(0, 300):.4f} "
+               f"Z{random.uniform(-2, 0):.4f}")
+
+
+def build(n, size, pack):
+    blocks = []
+    for i in range(0, n, size):
+        block = CNC.Block(f"block {i // size}")
+        block.extend(program(min(size, n - i)))
+        # merged canvas items, one id shared by many lines
+        block.setPath([1000 + j // 1000 for j in range(len(block))])
+        if pack:
+            block.pack()
+        blocks.append(block)
+    return blocks
+
+
+def measure(n, size, pack):
+    tracemalloc.start()
+    blocks = build(n, size, pack)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    chars = 0
+    for block in blocks:
+        for line in block:
+            chars += len(line)
+    elapsed = time.perf_counter() - t0
+
+    # the geometry and the compiled lines are kept by the blocks
+    tracemalloc.start()
+    draw(blocks)
+    geometry, drawPeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # time without tracing the first draw of new blocks, and a redraw
+    # reusing their geometry
+    blocks = build(n, size, pack)
+    t0 = time.perf_counter()
+    draw(blocks)
+    t1 = time.perf_counter()
+    draw(blocks)
+    t2 = time.perf_counter()
+    return (current, peak, elapsed, chars,
+            geometry, drawPeak, t1 - t0, t2 - t1)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print(f"{n} lines in blocks of {size} lines")
+    print(f"{'storage':8s} {'memory':>10s} {'peak':>10s} "
+          f"{'per line':>9s} {'iterate':>8s} "
+          f"{'drawn':>10s} {'draw peak':>10s} {'draw':>8s} {'redraw':>8s}")
+    result = {}
+    for name, pack in (("list", False), ("packed", True)):
+        (current, peak, elapsed, chars,
+         geometry, drawPeak, drawn, redrawn) = measure(n, size, pack)
+        result[name] = current, chars
+        print(f"{name:8s} {current / 1e6:8.1f}MB {peak / 1e6:8.1f}MB "
+              f"{current / n:7.1f} B {elapsed:7.2f}s "
+              f"{(current + geometry) / 1e6:8.1f}MB "
+              f"{(current + drawPeak) / 1e6:8.1f}MB {drawn:7.2f}s "
+              f"{redrawn:7.2f}s")
+    if result["list"][1] != result["packed"][1]:
+        print("ERROR: the packed lines differ")
+        sys.exit(1)
+    print(f"ratio    {result['list'][0] / result['packed'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Benchmark of the bpath intersections
+#
+# Offsets a closed wavy outline of lines and arcs, and intersects it with
+# a shifted copy, timing Path.intersectSelf and Path.intersectPath. On a
+# smaller outline the result is compared with the original implementation
+# testing every pair of segments.
+#
+# Usage:
+#       python test_codes/bench_bpath_intersect.py [outline] [check outline]
+#
+# where outline is the number of segments of the outline
+
+import math
+import os
+import sys
+import time
+from copy import deepcopy
+from operator import itemgetter
+
+sys.path[:0] = [
+    os.path.join(os.path.dirname(__file__), "..", "bCNC"),
+    os.path.join(os.path.dirname(__file__), "..", "bCNC", "lib"),
+]
+
+from bmath import Vector  # noqa: E402
+from bpath import EPS, Path, Segment, eq  # noqa: E402
+
+WAVES = 40  # undulations of the outline
+OFFSET = 1.5  # offset making the waves intersect
+
+
+# -----------------------------------------------------------------------------
+# Closed outline of n segments, a circle with a wavy radius, every fourth
+# segment an arc
+# -----------------------------------------------------------------------------
+def outline(n):
+    points = []
+    for k in range(n):
+        phi = 2.0 * math.pi * k / n
+        r = 50.0 + 3.0 * math.sin(WAVES * phi)
+        points.append(Vector(r * math.cos(phi), r * math.sin(phi)))
+    path = Path("outline")
+    for k in range(n):
+        A = points[k]
+        B = points[(k + 1) % n]
+        if k % 4 == 3:
+            # arc bulging outwards through both points
+            M = (A + B) * 0.5
+            C = M - (B - A).orthogonal() * (20.0 * (B - A).length())
+            path.append(Segment(Segment.CW, A, B, C))
+        else:
+            path.append(Segment(Segment.LINE, A, B))
+    return path
+
+
+# -----------------------------------------------------------------------------
+# Original implementations, testing every pair of segments
+# -----------------------------------------------------------------------------
+def split(self, points):
+    points.sort(key=itemgetter(0, 1))
+    for i, o, P in reversed(points):
+        new = self[i].split(P)
+        if not isinstance(new, int):
+            self.insert(i + 1, new)
+            self[i]._cross = True
+    return points
+
+
+def legacyIntersectSelf(self):
+    points = []
+
+    def addPoint(i, P):
+        if eq(P, self[i].A, EPS) or eq(P, self[i].B, EPS):
+            return
+        points.append((i, self[i].order(P), P))
+
+    for i, si in enumerate(self[:-2]):
+        if si.type == Segment.LINE and self[i + 1].type == Segment.LINE:
+            j = i + 2
+        else:
+            j = i + 1
+        while j < len(self):
+            P1, P2 = si.intersect(self[j])
+            if P1 is not None and P2 is not None and eq(P1, P2, EPS):
+                P2 = None
+            if P1:
+                addPoint(i, P1)
+                addPoint(j, P1)
+            if P2:
+                addPoint(i, P2)
+                addPoint(j, P2)
+            j += 1
+    return split(self, points)
+
+
+def legacyIntersectPath(self, path):
+    points = []
+
+    def addPoint(i, P):
+        if eq(P, self[i].A, EPS) or eq(P, self[i].B, EPS):
+            return
+        points.append((i, self[i].order(P), P))
+
+    for i, si in enumerate(self):
+        for cut in path:
+            P1, P2 = si.intersect(cut)
+            if P1 is not None and P2 is not None and eq(P1, P2, EPS):
+                P2 = None
+            if P1:
+                addPoint(i, P1)
+            if P2:
+                addPoint(i, P2)
+    return split(self, points)
+
+
+# -----------------------------------------------------------------------------
+def signature(path):
+    return [(s.type, tuple(s.A), tuple(s.B), s._cross) for s in path]
+
+
+# -----------------------------------------------------------------------------
+# @return the offset path and a shifted copy of the outline
+# -----------------------------------------------------------------------------
+def inputs(n):
+    path = outline(n)
+    opath = path.offset(OFFSET)
+    other = deepcopy(path)
+    for segment in other:
+        segment.setStart(segment.A + Vector(1.0, 0.5))
+        segment.setEnd(segment.B + Vector(1.0, 0.5))
+        if segment.type != Segment.LINE:
+            segment.setCenter(segment.C + Vector(1.0, 0.5))
+    return path, opath, other
+
+
+# -----------------------------------------------------------------------------
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    check = int(sys.argv[2]) if len(sys.argv) > 2 else 800
+
+    path, opath, other = inputs(n)
+    segments = len(opath)
+    t0 = time.perf_counter()
+    crossings = len(opath.intersectSelf())
+    t1 = time.perf_counter()
+    cuts = len(path.intersectPath(other))
+    t2 = time.perf_counter()
+    print(f"{segments} segments: intersectSelf {t1 - t0:.2f}s "
+          f"({crossings} points), intersectPath {t2 - t1:.2f}s "
+          f"({cuts} points)")
+
+    path, opath, other = inputs(check)
+    lpath, lopath, lother = inputs(check)
+    segments = len(opath)
+    t0 = time.perf_counter()
+    opath.intersectSelf()
+    path.intersectPath(other)
+    t1 = time.perf_counter()
+    legacyIntersectSelf(lopath)
+    legacyIntersectPath(lpath, lother)
+    t2 = time.perf_counter()
+    print(f"{segments} segments: intersect {t1 - t0:.2f}s "
+          f"legacy {t2 - t1:.2f}s")
+    if signature(opath) != signature(lopath) \
+            or signature(path) != signature(lpath):
+        print("ERROR: the intersected paths differ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Benchmark of the DXF entity chaining of Layer.sort
+#
+# Writes a synthetic DXF with closed contours of LINE and ARC entities,
+# shuffled and half of them reversed, reads it back and times the
+# sorting of the layer. On a smaller file the result is compared with
+# the original linear scan implementation.
+#
+# Usage:
+#       python test_codes/bench_dxf_sort.py [entities] [check entities]
+
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [
+    os.path.join(os.path.dirname(__file__), "..", "bCNC"),
+    os.path.join(os.path.dirname(__file__), "..", "bCNC", "lib"),
+]
+
+import dxf  # noqa: E402
+from dxf import DXF, EPS2, Entity  # noqa: E402
+
+SIDES = 8  # entities per contour
+
+
+# -----------------------------------------------------------------------------
+# Write n entities as contours of SIDES entities, alternating lines and
+# arcs bulging out of a regular polygon
+# -----------------------------------------------------------------------------
+def write(filename, n):
+    random.seed(0)
+    entities = []
+    columns = int(math.sqrt(n / SIDES)) + 1
+    for c in range(n // SIDES):
+        cx = 20.0 * (c % columns)
+        cy = 20.0 * (c // columns)
+        r = random.uniform(3.0, 8.0)
+        for k in range(SIDES):
+            a0 = 2.0 * math.pi * k / SIDES
+            a1 = 2.0 * math.pi * (k + 1) / SIDES
+            if k % 2:
+                # arc centered on the polygon center through both vertices
+                entities.append(
+                    ("arc", cx, cy, r, math.degrees(a0), math.degrees(a1)))
+            else:
+                p0 = (cx + r * math.cos(a0), cy + r * math.sin(a0))
+                p1 = (cx + r * math.cos(a1), cy + r * math.sin(a1))
+                if random.random() < 0.5:
+                    p0, p1 = p1, p0
+                entities.append(("line", *p0, *p1))
+    random.shuffle(entities)
+
+    out = DXF(filename, "w")
+    out.writeHeader()
+    for entity in entities:
+        if entity[0] == "arc":
+            out.arc(*entity[1:], name="0")
+        else:
+            out.line(*entity[1:], name="0")
+    out.writeEOF()
+    out.close()
+    return len(entities)
+
+
+# -----------------------------------------------------------------------------
+# Original implementation, scanning the remaining entities for every
+# end point
+# -----------------------------------------------------------------------------
+def legacySort(layer):
+    new = []
+    i = 0
+    while i < len(layer.entities):
+        if layer.entities[i].type in ("POINT", "INSERT"):
+            new.append(layer.entities[i])
+            del layer.entities[i]
+        else:
+            i += 1
+    if not layer.entities:
+        layer.entities = new
+        return
+
+    def pushStart():
+        start = Entity("@START", layer.name)
+        s = layer.entities[0].start()
+        start._initCache(s, s)
+        new.append(start)
+
+    pushStart()
+    while layer.entities:
+        ex, ey = new[-1].end()
+        for i, entity in enumerate(layer.entities):
+            sx, sy = entity.start()
+            d2 = (sx - ex) ** 2 + (sy - ey) ** 2
+            err = EPS2 * ((abs(sx) + abs(ex)) ** 2
+                          + (abs(sy) + abs(ey)) ** 2
+                          + 1.0)
+            if d2 < err:
+                new.append(entity)
+                del layer.entities[i]
+                break
+            sx, sy = entity.end()
+            d2 = (sx - ex) ** 2 + (sy - ey) ** 2
+            err = EPS2 * ((abs(sx) + abs(ex)) ** 2
+                          + (abs(sy) + abs(ey)) ** 2
+                          + 1.0)
+            if d2 < err:
+                entity.invert()
+                new.append(entity)
+                del layer.entities[i]
+                break
+        else:
+            pushStart()
+    layer.entities = new
+
+
+# -----------------------------------------------------------------------------
+def read(filename):
+    f = DXF(filename, "r")
+    f.readFile()
+    f.close()
+    return f.layers["0"]
+
+
+# -----------------------------------------------------------------------------
+def signature(layer):
+    return [(e.type, tuple(e.start()), tuple(e.end()), e._invert)
+            for e in layer.entities]
+
+
+# -----------------------------------------------------------------------------
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    check = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    dxf.errors.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.dxf")
+
+        n = write(filename, n)
+        t0 = time.perf_counter()
+        layer = read(filename)
+        t1 = time.perf_counter()
+        layer.sort()
+        t2 = time.perf_counter()
+        starts = sum(1 for e in layer.entities if e.type == "@START")
+        print(f"{n} entities: read {t1 - t0:.2f}s sort {t2 - t1:.2f}s, "
+              f"{starts} contours")
+
+        check = write(filename, check)
+        layer = read(filename)
+        legacy = read(filename)
+        t0 = time.perf_counter()
+        layer.sort()
+        t1 = time.perf_counter()
+        legacySort(legacy)
+        t2 = time.perf_counter()
+        print(f"{check} entities: sort {t1 - t0:.2f}s "
+              f"legacy {t2 - t1:.2f}s")
+        if signature(layer) != signature(legacy):
+            print("ERROR: the sorted entities differ")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
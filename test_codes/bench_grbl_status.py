@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Benchmark of the GRBL 1.1 status report parsing
+#
+# Parses a stream of synthetic status reports with GRBL1.parseStatus into
+# a MachineState, and with the original field by field implementation
+# into CNC.vars, comparing the resulting variables after every report.
+#
+# Usage:
+#       python test_codes/bench_grbl_status.py [reports]
+
+import builtins
+import os
+import random
+import sys
+import time
+
+sys.path[:0] = [
+    os.path.join(os.path.dirname(__file__), "..", "bCNC"),
+    os.path.join(os.path.dirname(__file__), "..", "bCNC", "lib"),
+    os.path.join(os.path.dirname(__file__), "..", "bCNC", "controllers"),
+]
+builtins._ = lambda x: x  # normally installed by the gettext setup
+
+import GRBL1  # noqa: E402
+from _GenericController import SPLITPAT  # noqa: E402
+from CNC import CNC  # noqa: E402
+from machine import MachineState  # noqa: E402
+
+REPEAT = 5  # timed runs of each parser
+
+
+# -----------------------------------------------------------------------------
+# Reports as GRBL 1.1 sends them, with the work offset every 10 reports,
+# changed every 1000, and the overrides every 20
+# -----------------------------------------------------------------------------
+def reports(n):
+    random.seed(0)
+    for i in range(n):
+        x, y, z = (random.uniform(-300, 0) for _ in range(3))
+        if i % 1000 == 0:
+            wco = (x / 2, y / 2)
+        fields = [random.choice(("Idle", "Run", "Hold:0", "Jog")),
+                  f"MPos:{x:.3f},{y:.3f},{z:.3f}",
+                  f"Bf:{random.randint(0, 15)},{random.randint(0, 128)}",
+                  f"FS:{random.randint(0, 2000)},{random.randint(0, 24000)}"]
+        if i % 10 == 0:
+            fields.append(f"WCO:{wco[0]:.3f},{wco[1]:.3f},0.000")
+        if i % 20 == 0:
+            fields.append(f"Ov:100,{random.choice((25, 50, 100))},110")
+        if i % 50 == 0:
+            fields.append("Pn:XZ")
+        yield "<" + "|".join(fields) + ">"
+
+
+# -----------------------------------------------------------------------------
+# Original implementation, without the error handling
+# -----------------------------------------------------------------------------
+def legacy(line):
+    fields = line[1:-1].split("|")
+    CNC.vars["pins"] = ""
+    for field in fields[1:]:
+        word = SPLITPAT.split(field)
+        if word[0] == "MPos":
+            CNC.vars["mx"] = float(word[1])
+            CNC.vars["my"] = float(word[2])
+            CNC.vars["mz"] = float(word[3])
+            CNC.vars["wx"] = round(
+                CNC.vars["mx"] - CNC.vars["wcox"], CNC.digits)
+            CNC.vars["wy"] = round(
+                CNC.vars["my"] - CNC.vars["wcoy"], CNC.digits)
+            CNC.vars["wz"] = round(
+                CNC.vars["mz"] - CNC.vars["wcoz"], CNC.digits)
+        elif word[0] == "FS":
+            CNC.vars["curfeed"] = float(word[1])
+            CNC.vars["curspindle"] = float(word[2])
+        elif word[0] == "Bf":
+            CNC.vars["planner"] = int(word[1])
+            CNC.vars["rxbytes"] = int(word[2])
+        elif word[0] == "Ov":
+            CNC.vars["OvFeed"] = int(word[1])
+            CNC.vars["OvRapid"] = int(word[2])
+            CNC.vars["OvSpindle"] = int(word[3])
+        elif word[0] == "WCO":
+            CNC.vars["wcox"] = float(word[1])
+            CNC.vars["wcoy"] = float(word[2])
+            CNC.vars["wcoz"] = float(word[3])
+        elif word[0] == "Pn":
+            CNC.vars["pins"] = word[1]
+
+
+# -----------------------------------------------------------------------------
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lines = list(reports(n))
+    machine = MachineState(n)
+
+    # best of a few alternating runs, the timing is noisy
+    tlegacy = tparse = float("inf")
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        for line in lines:
+            legacy(line)
+        t1 = time.perf_counter()
+        for line in lines:
+            GRBL1.parseStatus(line, machine, CNC.vars)
+        t2 = time.perf_counter()
+        tlegacy = min(tlegacy, t1 - t0)
+        tparse = min(tparse, t2 - t1)
+    print(f"{n} reports: legacy {1e6 * tlegacy / n:.1f} us, "
+          f"parseStatus {1e6 * tparse / n:.1f} us per report, "
+          f"history {len(machine.history)} records "
+          f"{machine.history.data.nbytes / 1e6:.1f} MB")
+
+    # the work position of the legacy parser uses the previous offset
+    # when the offset arrives after the position, compare reports
+    # without the offset only
+    machine = MachineState()
+    variables = dict(CNC.vars)
+    for i, line in enumerate(lines[:2000]):
+        legacy(line)
+        GRBL1.parseStatus(line, machine, variables)
+        if "WCO" not in line and variables != CNC.vars:
+            print(f"ERROR: report {i} differs {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Benchmark of the GCode undo records
+#
+# Generates a program, moves every block a few times and replaces all the
+# lines of every block once, like autolevel does, then reports the memory
+# held by the undo records and the time to undo and redo everything,
+# checking that the lines come back.
+#
+# Usage:
+#       python test_codes/bench_undo_memory.py [lines] [lines per block]
+
+import os
+import random
+import sys
+import time
+
+sys.path[:0] = [
+    os.path.join(os.path.dirname(__file__), "..", "bCNC"),
+    os.path.join(os.path.dirname(__file__), "..", "bCNC", "lib"),
+]
+
+from CNC import Block, GCode  # noqa: E402
+
+MOVES = 3  # moves of the whole program
+
+
+def program(n):
+    random.seed(0)
+    for i in range(n):
+        yield (f"G1 X{random.uniform(0, 300):.4f} "
+               f"Y{random.uniform(0, 300):.4f} "
+               f"Z{random.uniform(-2, 0):.4f}")
+
+
+def build(n, size):
+    gcode = GCode()
+    for i in range(0, n, size):
+        block = Block(f"block {i // size}")
+        block.extend(program(min(size, n - i)))
+        gcode.blocks.append(block)
+    return gcode
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    gcode = build(n, size)
+    original = list(gcode.lines())
+    items = [(bid, None) for bid in range(len(gcode.blocks))]
+
+    t0 = time.perf_counter()
+    for i in range(MOVES):
+        gcode.moveLines(items, 1.0, 2.0)
+    t1 = time.perf_counter()
+    moved = list(gcode.lines())
+    undoinfo = []
+    for bid, block in enumerate(gcode.blocks):
+        undoinfo.append(gcode.setBlockLinesUndo(
+            bid, [line.lower() for line in block]))
+    gcode.addUndo(undoinfo)
+    t2 = time.perf_counter()
+    print(f"{n} lines: {MOVES} moves {t1 - t0:.2f}s, "
+          f"replacement {t2 - t1:.2f}s, "
+          f"undo records {gcode.undoMemory() / 1e6:.1f} MB "
+          f"for {len(''.join(moved)) / 1e6:.1f} MB of text")
+
+    t0 = time.perf_counter()
+    gcode.undo()
+    t1 = time.perf_counter()
+    if list(gcode.lines()) != moved:
+        print("ERROR: undo of the replacement differs")
+        sys.exit(1)
+    while gcode.canUndo():
+        gcode.undo()
+    t2 = time.perf_counter()
+    if list(gcode.lines()) != original:
+        print("ERROR: undo of the moves differs")
+        sys.exit(1)
+    while gcode.canRedo():
+        gcode.redo()
+    t3 = time.perf_counter()
+    if list(gcode.lines()) != [line.lower() for line in moved]:
+        print("ERROR: redo differs")
+        sys.exit(1)
+    print(f"undo replacement {t1 - t0:.2f}s, undo moves {t2 - t1:.2f}s, "
+          f"redo all {t3 - t2:.2f}s")
+
+
+if __name__ == "__main__":
+    main()